@@ -0,0 +1,148 @@
+import os
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Iterable, Iterator, Optional
+from uuid import UUID
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import Skin
+from schemas import SkinResponse
+from snapshots import Snapshot
+
+SKIN_CATALOG_TTL = float(os.getenv("SKIN_CATALOG_TTL", 300))
+
+
+@dataclass(frozen=True, slots=True)
+class CatalogSkin:
+    """Read-only snapshot of a single `skins` row"""
+
+    id: UUID
+    name: str
+    required_xp: int
+    price_ton: float
+    open_from: int
+    is_droppable: bool
+
+    @classmethod
+    def from_orm(cls, skin: Skin) -> "CatalogSkin":
+        return cls(
+            id=skin.id,
+            name=skin.name,
+            required_xp=skin.required_xp,
+            price_ton=skin.price_ton,
+            open_from=skin.open_from,
+            is_droppable=bool(skin.is_droppable),
+        )
+
+
+class SkinCatalog:
+    """Immutable snapshot of the skin catalog.
+
+    Every skin has a fixed index within a catalog, so the skins a user owns
+    fit in a single int bitmap. Responses for both ownership states are
+    built once per load.
+    """
+
+    __slots__ = (
+        "droppable_mask",
+        "_skins",
+        "_index",
+        "_responses",
+    )
+
+    def __init__(self, skins: Iterable[CatalogSkin] = ()):
+        self._skins = tuple(skins)
+        self._index = MappingProxyType(
+            {skin.id: index for index, skin in enumerate(self._skins)}
+        )
+        self._responses = tuple(_response_pair(skin) for skin in self._skins)
+        self.droppable_mask = sum(
+            1 << index for index, skin in enumerate(self._skins) if skin.is_droppable
+        )
+
+    def __len__(self) -> int:
+        return len(self._skins)
+
+    def __iter__(self) -> Iterator[CatalogSkin]:
+        return iter(self._skins)
+
+    def get(self, skin_id) -> Optional[CatalogSkin]:
+        index = self._index.get(_skin_key(skin_id))
+        return self._skins[index] if index is not None else None
+
+    def knows(self, skin_ids: Iterable) -> bool:
+        """Whether all the given skins are part of this catalog"""
+
+        return all(_skin_key(skin_id) in self._index for skin_id in skin_ids)
+
+    def ownership_mask(self, skin_ids: Iterable) -> int:
+        """Bitmap of the given skins over catalog indices, unknown ids are skipped"""
+
+        mask = 0
+        for skin_id in skin_ids:
+            index = self._index.get(_skin_key(skin_id))
+            if index is not None:
+                mask |= 1 << index
+        return mask
+
+    def response(self, skin: CatalogSkin, owned: bool = False) -> SkinResponse:
+        return self._responses[self._index[skin.id]][owned]
+
+    def responses(self, owned_mask: int = 0) -> list[SkinResponse]:
+        """Catalog as `SkinResponse`s, flagged with the user's ownership"""
+
+        return [
+            pair[(owned_mask >> index) & 1]
+            for index, pair in enumerate(self._responses)
+        ]
+
+    def droppable(self, owned_mask: int = 0) -> list[CatalogSkin]:
+        """Droppable skins not in the user's ownership bitmap"""
+
+        mask = self.droppable_mask & ~owned_mask
+        return [skin for index, skin in enumerate(self._skins) if mask >> index & 1]
+
+
+def _response_pair(skin: CatalogSkin) -> tuple[SkinResponse, SkinResponse]:
+    response = SkinResponse.model_validate(skin)
+    return response, response.model_copy(update={"owned": True})
+
+
+def _skin_key(skin_id) -> UUID:
+    return skin_id if isinstance(skin_id, UUID) else UUID(str(skin_id))
+
+
+async def _read_catalog(db: AsyncSession) -> SkinCatalog:
+    skins = (
+        await db.scalars(select(Skin).order_by(Skin.open_from, Skin.required_xp))
+    ).all()
+    return SkinCatalog(CatalogSkin.from_orm(skin) for skin in skins)
+
+
+_catalog = Snapshot(_read_catalog, SkinCatalog(), SKIN_CATALOG_TTL)
+
+
+def get_catalog() -> SkinCatalog:
+    """Currently loaded catalog, possibly stale"""
+
+    return _catalog.get()
+
+
+async def load_catalog(db: AsyncSession) -> SkinCatalog:
+    """Read `skins` into a new catalog and make it current"""
+
+    return await _catalog.load(db)
+
+
+async def reload_catalog() -> SkinCatalog:
+    """Reload hook to call after the `skins` rows have been edited"""
+
+    return await _catalog.reload()
+
+
+async def current_catalog() -> SkinCatalog:
+    """Current catalog, loaded on first use and once older than `SKIN_CATALOG_TTL`"""
+
+    return await _catalog.current()
@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+from sqlalchemy import exc, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+
+class PoolStats:
+    """Checkout counters of a connection pool, for sizing it from data"""
+
+    __slots__ = ("checkouts", "timeouts", "wait_total", "wait_max", "peak_in_use")
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.peak_in_use = 0
+
+    def record(self, wait: float, in_use: int):
+        self.checkouts += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        self.peak_in_use = max(self.peak_in_use, in_use)
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Queue pool that measures how long each checkout waits.
+
+    The wait covers queueing for a free connection as well as opening a
+    new one and the pre-ping, i.e. everything a request spends before it
+    can send its first statement.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            self.stats.timeouts += 1
+            raise
+        self.stats.record(time.perf_counter() - start, self.checkedout())
+        return connection
+
+    def recreate(self) -> "InstrumentedPool":
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+    def snapshot(self) -> dict:
+        stats = self.stats
+        return {
+            "size": self.size(),
+            "in_use": self.checkedout(),
+            "idle": self.checkedin(),
+            "overflow": self.overflow(),
+            "peak_in_use": stats.peak_in_use,
+            "checkouts": stats.checkouts,
+            "timeouts": stats.timeouts,
+            "wait_avg_ms": (
+                stats.wait_total / stats.checkouts * 1000 if stats.checkouts else 0.0
+            ),
+            "wait_max_ms": stats.wait_max * 1000,
+        }
+
+
+async def warm_up(engine: AsyncEngine, connections: int):
+    """Open `connections` pooled connections ahead of the first requests"""
+
+    async def ping():
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    await asyncio.gather(*(ping() for _ in range(connections)))
@@ -0,0 +1,54 @@
+import asyncio
+from typing import Optional
+
+
+class PeriodicFlusher:
+    """Base of the in-process buffers written to the database in batches.
+
+    A background task calls `flush()` every `flush_interval` seconds, or
+    right away when the buffer calls `wake()` because it has filled up.
+    Subclasses implement `flush`, which must not raise.
+    """
+
+    def __init__(self, flush_interval: float):
+        self.flush_interval = flush_interval
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def flush(self) -> int:
+        raise NotImplementedError
+
+    def wake(self):
+        """Flush without waiting for the interval, if the task is running"""
+
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the background flusher and write what is left"""
+
+        await self._cancel()
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def _cancel(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._wakeup = None
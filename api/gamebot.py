@@ -0,0 +1,95 @@
+import time
+from typing import NamedTuple, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import ShiftUser
+from scores import ScoreChange, credit_score, REASON_GAMEBOT
+from tiers import current_tiers, get_tiers
+
+GAMEBOT_REWARD_PER_MINUTE = 100 / 60
+# The bot starts working one minute after the cycle starts
+GAMEBOT_GRACE_MINUTES = 1
+
+
+class GamebotAccrual(NamedTuple):
+    """Gamebot state of a user at a point in time"""
+
+    worked_minutes: int
+    reward: int
+    # Minutes worked in the cycle, settled when the reward is paid out
+    settled_minutes: int
+
+
+def gamebot_accrual(user: ShiftUser, now: Optional[float] = None) -> GamebotAccrual:
+    """Compute the user's gamebot earnings from the stored cycle start.
+
+    The bot works from `gamebot_started_at` (plus a minute of grace) for at
+    most the tier's `gamebot` hours; level 1 has no bot. Minutes already
+    claimed or dropped in the cycle are in `gamebot_worked_minutes`, and
+    `gamebot_reward` holds a balance carried over from before accrual was
+    computed on read.
+    """
+
+    now = time.time() if now is None else now
+    tier = get_tiers().for_level(user.current_level)
+
+    worked_minutes = 0
+    if user.gamebot_started_at is not None and tier and tier.level != 1:
+        elapsed_minutes = int(now - user.gamebot_started_at) // 60
+        worked_minutes = min(
+            max(elapsed_minutes - GAMEBOT_GRACE_MINUTES, 0), (tier.gamebot or 0) * 60
+        )
+
+    settled_minutes = user.gamebot_worked_minutes or 0
+    unsettled_minutes = max(worked_minutes - settled_minutes, 0)
+    reward = (user.gamebot_reward or 0) + int(
+        unsettled_minutes * GAMEBOT_REWARD_PER_MINUTE
+    )
+
+    return GamebotAccrual(worked_minutes, reward, max(worked_minutes, settled_minutes))
+
+
+def start_gamebot_cycle(user: ShiftUser, started_at: int):
+    """Start a new daily cycle; earnings of the previous one are forfeited"""
+
+    user.gamebot_started_at = started_at
+    user.gamebot_worked_minutes = 0
+    user.gamebot_reward = 0
+
+
+async def settle_gamebot(
+    db: AsyncSession, user_id, *, credit: bool, deferred: bool = False
+) -> Optional[ScoreChange]:
+    """Pay out (`credit`) or drop the gamebot reward accrued so far.
+
+    The accrual is computed from a plain read and written back with a
+    guard on the cycle it was computed from, so a concurrent claim or a
+    new cycle makes this a no-op instead of paying twice. Returns None
+    when the user is missing or the guard failed.
+    """
+
+    await current_tiers()
+    user = await db.scalar(select(ShiftUser).where(ShiftUser.id == user_id))
+    if user is None:
+        return None
+
+    accrual = gamebot_accrual(user)
+
+    return await credit_score(
+        db,
+        user.id,
+        accrual.reward if credit else 0,
+        reason=REASON_GAMEBOT,
+        guards=[
+            ShiftUser.gamebot_started_at.is_not_distinct_from(user.gamebot_started_at),
+            ShiftUser.gamebot_worked_minutes.is_not_distinct_from(
+                user.gamebot_worked_minutes
+            ),
+            ShiftUser.gamebot_reward.is_not_distinct_from(user.gamebot_reward),
+        ],
+        values={"gamebot_worked_minutes": accrual.settled_minutes, "gamebot_reward": 0},
+        deferred=deferred,
+        user=user,
+    )
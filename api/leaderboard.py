@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import os
+from typing import Iterable, Optional
+from uuid import UUID
+
+from sortedcontainers import SortedList
+from sqlalchemy import event, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from models import AsyncSessionLocal, ShiftUser
+
+logger = logging.getLogger(__name__)
+
+LEADERBOARD_REFRESH_INTERVAL = float(os.getenv("LEADERBOARD_REFRESH_INTERVAL", 300))
+
+
+def user_key(user_id) -> UUID:
+    """User id as a UUID, the key of the in-process score structures"""
+
+    return user_id if isinstance(user_id, UUID) else UUID(str(user_id))
+
+
+class Leaderboard:
+    """In-process ranking of all users by score.
+
+    Users are kept in a sorted list of `(-score, id)` keys, so updates,
+    rank lookups and slices around a position are O(log n). Score changes
+    committed by this process are applied as they happen; the whole board
+    is reloaded from the database every `LEADERBOARD_REFRESH_INTERVAL`
+    seconds to pick up changes made by other workers.
+
+    The board holds every user, so it is only kept by processes that
+    `load` it; elsewhere updates are ignored and `lookup_rank` counts in
+    the database.
+    """
+
+    def __init__(self):
+        self.loaded = False
+        self._scores: dict[UUID, int] = {}
+        self._ranked = SortedList()
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    def __contains__(self, user_id) -> bool:
+        return user_key(user_id) in self._scores
+
+    def update(self, user_id, score: Optional[int]):
+        if not self.loaded:
+            return
+
+        key = user_key(user_id)
+        score = score or 0
+
+        old_score = self._scores.get(key)
+        if old_score == score:
+            return
+        if old_score is not None:
+            self._ranked.remove((-old_score, key))
+
+        self._scores[key] = score
+        self._ranked.add((-score, key))
+
+    def update_many(self, scores: Iterable[tuple]):
+        for user_id, score in scores:
+            self.update(user_id, score)
+
+    def score(self, user_id) -> Optional[int]:
+        return self._scores.get(user_key(user_id))
+
+    def rank(self, user_id) -> Optional[int]:
+        """1-based position of the user, None when not on the board"""
+
+        key = user_key(user_id)
+        score = self._scores.get(key)
+        if score is None:
+            return None
+        return self._ranked.bisect_left((-score, key)) + 1
+
+    def top(self, limit: int, offset: int = 0) -> list[tuple[int, UUID, int]]:
+        """`(rank, user_id, score)` of the users ranked after `offset`"""
+
+        return [
+            (rank, key, -negative_score)
+            for rank, (negative_score, key) in enumerate(
+                self._ranked.islice(offset, offset + limit), start=offset + 1
+            )
+        ]
+
+    def around(self, user_id, radius: int) -> list[tuple[int, UUID, int]]:
+        """Up to `radius` users on either side of the user, and the user"""
+
+        rank = self.rank(user_id)
+        if rank is None:
+            return []
+        offset = max(rank - 1 - radius, 0)
+        return self.top(rank - offset + radius, offset)
+
+    def ranked(self, user_ids: Iterable) -> list[tuple[int, UUID, int]]:
+        """`(rank, user_id, score)` of the given users in board order"""
+
+        entries = []
+        for user_id in user_ids:
+            rank = self.rank(user_id)
+            if rank is not None:
+                entries.append((rank, user_key(user_id), self.score(user_id)))
+        return sorted(entries)
+
+    async def load(self, db: AsyncSession):
+        """Replace the board with the scores currently in the database"""
+
+        scores = {
+            user_id: score or 0
+            for user_id, score in await db.execute(
+                select(ShiftUser.id, ShiftUser.score)
+            )
+        }
+        ranked = SortedList((-score, user_id) for user_id, score in scores.items())
+
+        self._scores, self._ranked = scores, ranked
+        self.loaded = True
+
+    async def ensure(self, db: AsyncSession, user_id) -> bool:
+        """Put a user created by another worker on the board.
+
+        Returns False when the user does not exist.
+        """
+
+        if user_id in self:
+            return True
+
+        found = (
+            await db.execute(
+                select(ShiftUser.id, ShiftUser.score).where(ShiftUser.id == user_id)
+            )
+        ).first()
+        if found is None:
+            return False
+
+        self.update(*found)
+        return True
+
+    async def lookup_rank(self, db: AsyncSession, user_id) -> Optional[int]:
+        """Rank of the user, from the board when loaded, else from the database"""
+
+        if self.loaded:
+            await self.ensure(db, user_id)
+            return self.rank(user_id)
+
+        key = user_key(user_id)
+        score = func.coalesce(ShiftUser.score, 0)
+        user_score = await db.scalar(select(score).where(ShiftUser.id == key))
+        if user_score is None:
+            return None
+
+        # Two range counts over ix_users_score_rank, with the score known
+        # when the statement is planned
+        above = select(func.count()).where(score > user_score).scalar_subquery()
+        ties = (
+            select(func.count())
+            .where(score == user_score, ShiftUser.id < key)
+            .scalar_subquery()
+        )
+        return await db.scalar(select(above + ties + 1))
+
+
+leaderboard = Leaderboard()
+
+
+@event.listens_for(Session, "after_commit")
+def _hand_over_score_updates(session: Session):
+    leaderboard.update_many(session.info.pop("score_updates", {}).items())
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _discard_score_updates(session: Session, transaction):
+    if transaction.parent is None:
+        session.info.pop("score_updates", None)
+
+
+async def run_leaderboard_refresh(interval: float = LEADERBOARD_REFRESH_INTERVAL):
+    """Periodically reload the board from the database"""
+
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with AsyncSessionLocal() as db:
+                await leaderboard.load(db)
+        except Exception:
+            logger.exception("Leaderboard refresh failed")
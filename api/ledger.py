@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import Date, cast, delete, event, func, insert, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from flusher import PeriodicFlusher
+from models import AsyncSessionLocal, ScoreEvent, ScoreDailyRollup
+
+logger = logging.getLogger(__name__)
+
+LEDGER_BATCH_SIZE = int(os.getenv("LEDGER_BATCH_SIZE", 500))
+LEDGER_FLUSH_INTERVAL = float(os.getenv("LEDGER_FLUSH_INTERVAL", 2.0))
+LEDGER_MAX_BUFFER = int(os.getenv("LEDGER_MAX_BUFFER", 100_000))
+LEDGER_RETENTION_DAYS = int(os.getenv("LEDGER_RETENTION_DAYS", 30))
+LEDGER_ROLLUP_INTERVAL = float(os.getenv("LEDGER_ROLLUP_INTERVAL", 3600))
+LEDGER_ROLLUP_BATCH_SIZE = int(os.getenv("LEDGER_ROLLUP_BATCH_SIZE", 10_000))
+
+# pg advisory lock key guarding the rollup job
+ROLLUP_LOCK_ID = 0x5C07E
+
+
+class ScoreLedger(PeriodicFlusher):
+    """In-process buffer of score events, written in multi-row batches.
+
+    Events are flushed when `batch_size` of them are pending or every
+    `flush_interval` seconds, whichever comes first, so hot claim paths
+    never pay for their own INSERT.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = LEDGER_BATCH_SIZE,
+        flush_interval: float = LEDGER_FLUSH_INTERVAL,
+        max_buffer: int = LEDGER_MAX_BUFFER,
+    ):
+        super().__init__(flush_interval)
+        self.batch_size = batch_size
+        self.max_buffer = max_buffer
+        self._buffer: list[tuple] = []
+
+    def __len__(self) -> int:
+        return len(self._buffer)
+
+    def record(self, events: list[tuple]):
+        """Buffer `(user_id, delta, reason, created_at)` tuples"""
+
+        self._buffer.extend(events)
+
+        overflow = len(self._buffer) - self.max_buffer
+        if overflow > 0:
+            logger.warning("Score ledger buffer full, dropping %d events", overflow)
+            del self._buffer[:overflow]
+
+        if len(self._buffer) >= self.batch_size:
+            self.wake()
+
+    async def flush(self) -> int:
+        """Write all buffered events with one multi-row INSERT"""
+
+        if not self._buffer:
+            return 0
+
+        events, self._buffer = self._buffer, []
+        rows = [
+            {"user_id": user_id, "delta": delta, "reason": reason, "created_at": at}
+            for user_id, delta, reason, at in events
+        ]
+
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(insert(ScoreEvent), rows)
+                await db.commit()
+        except Exception:
+            logger.exception("Failed to flush %d score events", len(events))
+            # Put them back in front of anything recorded meanwhile
+            self._buffer[:0] = events
+            return 0
+
+        return len(events)
+
+
+score_ledger = ScoreLedger()
+
+
+@event.listens_for(Session, "after_commit")
+def _hand_over_score_events(session: Session):
+    events = session.info.pop("score_events", None)
+    if events:
+        score_ledger.record(events)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _discard_score_events(session: Session, transaction):
+    # Runs after after_commit, so anything left was rolled back or abandoned
+    if transaction.parent is None:
+        session.info.pop("score_events", None)
+
+
+async def rollup_score_events(db: AsyncSession, before: datetime) -> int:
+    """Compact events older than `before` into per-user daily aggregates.
+
+    Each batch moves events with a single statement:
+    WITH moved AS (DELETE ... RETURNING ...) INSERT INTO rollups SELECT ...
+    ON CONFLICT DO UPDATE, so an event is either in the ledger or in its
+    rollup, never both. Only one worker compacts at a time. Returns the
+    number of aggregate rows written.
+    """
+
+    total = 0
+
+    while True:
+        if not await db.scalar(select(func.pg_try_advisory_xact_lock(ROLLUP_LOCK_ID))):
+            return total
+
+        batch_ids = (
+            select(ScoreEvent.id)
+            .where(ScoreEvent.created_at < before)
+            .order_by(ScoreEvent.id)
+            .limit(LEDGER_ROLLUP_BATCH_SIZE)
+            .scalar_subquery()
+        )
+        moved = (
+            delete(ScoreEvent)
+            .where(ScoreEvent.id.in_(batch_ids))
+            .returning(
+                ScoreEvent.user_id,
+                ScoreEvent.delta,
+                ScoreEvent.reason,
+                ScoreEvent.created_at,
+            )
+            .cte("moved")
+        )
+        day = cast(moved.c.created_at, Date)
+
+        stmt = pg_insert(ScoreDailyRollup).from_select(
+            ["user_id", "day", "reason", "delta_total", "event_count"],
+            select(
+                moved.c.user_id,
+                day,
+                moved.c.reason,
+                func.sum(moved.c.delta),
+                func.count(),
+            ).group_by(moved.c.user_id, day, moved.c.reason),
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[
+                ScoreDailyRollup.user_id,
+                ScoreDailyRollup.day,
+                ScoreDailyRollup.reason,
+            ],
+            set_={
+                "delta_total": ScoreDailyRollup.delta_total + stmt.excluded.delta_total,
+                "event_count": ScoreDailyRollup.event_count + stmt.excluded.event_count,
+            },
+        )
+
+        connection = await db.connection()
+        aggregates = (await connection.execute(stmt)).rowcount
+        await db.commit()
+
+        total += aggregates
+        if not aggregates:
+            return total
+
+
+async def run_score_rollups(interval: float = LEDGER_ROLLUP_INTERVAL):
+    """Periodically compact events older than the retention window"""
+
+    while True:
+        cutoff = datetime.combine(
+            datetime.utcnow().date() - timedelta(days=LEDGER_RETENTION_DAYS), time.min
+        )
+        try:
+            async with AsyncSessionLocal() as db:
+                compacted = await rollup_score_events(db, cutoff)
+            if compacted:
+                logger.info("Rolled up score events before %s", cutoff)
+        except Exception:
+            logger.exception("Score event rollup failed")
+        await asyncio.sleep(interval)
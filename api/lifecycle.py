@@ -0,0 +1,50 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+from catalog import load_catalog
+from dbpool import warm_up
+from leaderboard import leaderboard, run_leaderboard_refresh
+from ledger import score_ledger, run_score_rollups
+from models import AsyncSessionLocal, async_engine
+from rollover import run_rollovers
+from settings import db_settings
+from tiers import load_tiers
+from writebehind import score_accumulator
+
+
+@asynccontextmanager
+async def running_services(jobs: bool = True, board: bool = True):
+    """Start what the services need in this process, and stop it after.
+
+    Opens the pool's connections, fills the in-process caches and runs the
+    score buffers. With `board` every user's score is loaded into the
+    in-process leaderboard and refreshed periodically; without it ranks
+    are counted in the database. With `jobs` the scheduled database jobs
+    (score rollups, daily rollover) run here as well. A process embedding
+    the services next to the API can leave both to the API.
+    """
+
+    await warm_up(async_engine, db_settings.worker_pool_size)
+    async with AsyncSessionLocal() as db:
+        await load_tiers(db)
+        await load_catalog(db)
+        if board:
+            await leaderboard.load(db)
+
+    score_ledger.start()
+    score_accumulator.start()
+    tasks = []
+    if board:
+        tasks.append(asyncio.create_task(run_leaderboard_refresh()))
+    if jobs:
+        tasks.append(asyncio.create_task(run_score_rollups()))
+        tasks.append(asyncio.create_task(run_rollovers()))
+
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await score_accumulator.stop()
+        await score_ledger.stop()
@@ -1,30 +1,32 @@
 import logging
 import os
-from datetime import datetime, timedelta
-from typing import Optional, List
+from contextlib import asynccontextmanager
+from typing import Literal, Optional, List
 
-import uvicorn
 from dotenv import load_dotenv
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from sqlalchemy import select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
 
 from models import (
     get_db,
+    async_engine,
     ShiftUser,
     Referral,
-    Skin,
     UserSkin,
-    UserStatus,
     Quest,
     Subtask,
-    UserQuest,
     UserSubtask,
 )
 from schemas import (
     UserData,
     UserResponse,
-    StatusResponse,
+    ReferralPageResponse,
+    LeaderboardResponse,
+    RankResponse,
+    ReferredUserResponse,
     PurchaseSkinRequest,
     SkinResponse,
     UpgradeLevelRequest,
@@ -35,22 +37,74 @@ from schemas import (
 from services import (
     get_user_status,
     calculate_score_to_next_level,
-    update_days_in_row,
     purchase_skin_with_xp,
     purchase_skin_with_ton,
     upgrade_user_level,
+    login_user,
+    encode_referral_cursor,
+    decode_referral_cursor,
+    get_quests_with_progress,
+    count_subtask_progress,
+    mark_subtask_completed,
+    mark_quest_reward_claimed,
+    get_friend_ids,
+    get_leaderboard_entries,
 )
+from scores import (
+    add_score,
+    claim_pending_score,
+    REASON_QUEST,
+    REASON_REFERRAL,
+    REASON_SUBTASK,
+)
+from tiers import get_tiers
+from gamebot import settle_gamebot
+from leaderboard import leaderboard
+from catalog import current_catalog, reload_catalog
+from lifecycle import running_services
+from ratelimit import RateLimit
+from serialization import (
+    quests_adapter,
+    skins_adapter,
+    trusted_response,
+    FastJSONResponse,
+    user_adapter,
+)
+from validators import get_validator
 
-from middleware import TelegramAuthMiddleware
-
-GAMEBOT_REWARD_PER_MINUTE = 100 / 60
+from middleware import TelegramAuthMiddleware, QueryCountMiddleware, get_user_data
 
 logging.basicConfig(level=logging.DEBUG)
 
-app = FastAPI(title="Shift")
+# Per-client limits of the endpoints that each cost a write transaction
+claim_limit = RateLimit("claim", rate=0.5, burst=5)
+gamebot_claim_limit = RateLimit("gamebot_claim", rate=0.5, burst=5)
+subtask_complete_limit = RateLimit("subtask_complete", rate=2, burst=10)
+purchase_limit = RateLimit("skin_purchase", rate=1, burst=5)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm up before the first request: open the pool's connections and
+    # fill the in-process caches
+    async with running_services():
+        if TOKEN:
+            get_validator(TOKEN)
+
+        yield
+
+
+app = FastAPI(title="Shift", lifespan=lifespan)
 
 load_dotenv()
 TOKEN = os.getenv("BOT_TOKEN")
+# Require Telegram initData on every call; rate limits then count per
+# verified user instead of per client address
+TELEGRAM_AUTH = os.getenv("TELEGRAM_AUTH", "0") != "0"
+
+# Added before CORS, so CORS headers are also set on its 401 and 403
+if TELEGRAM_AUTH:
+    app.add_middleware(TelegramAuthMiddleware, telegram_bot_token=TOKEN)
 
 app.add_middleware(
     CORSMiddleware,
@@ -60,245 +114,235 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if os.getenv("LOG_QUERY_COUNT"):
+    app.add_middleware(QueryCountMiddleware)
+
 
-# app.add_middleware(TelegramAuthMiddleware, telegram_bot_token=TOKEN)
+@app.get("/metrics/db-pool")
+async def db_pool_metrics():
+    return async_engine.pool.snapshot()
 
 
-@app.put("/users", response_model=UserResponse)
+@app.put("/users", response_model=UserResponse, response_class=FastJSONResponse)
 async def create_or_update_user(
-    user_data: UserData,
+    user_data: UserData = Depends(get_user_data),
     referrer_id: Optional[str] = None,
-    db: Session = Depends(get_db),
+    referrals: Literal["full", "summary"] = "full",
 ):
-    auth_date_datetime = datetime.fromtimestamp(user_data.auth_date)
-    db_user = db.query(ShiftUser).filter(ShiftUser.tg_id == user_data.tg_id).first()
+    response = await login_user(user_data, referrer_id, referrals)
 
-    days_row = dict()
-    days_row["is_days_dropped"] = False
+    return trusted_response(user_adapter, response)
 
-    if db_user:
-        last_login_datetime = datetime.fromtimestamp(db_user.auth_date)
-        last_login_date = datetime.fromtimestamp(db_user.auth_date)
 
-        user_status = get_user_status(db_user, db)
+@app.get("/users/{user_id}/referrals", response_model=ReferralPageResponse)
+async def get_referrals(
+    user_id: str,
+    cursor: Optional[str] = None,
+    limit: int = Query(default=20, ge=1, le=100),
+    db: AsyncSession = Depends(get_db),
+):
+    referral_count = await db.scalar(
+        select(ShiftUser.referral_count).where(ShiftUser.id == user_id)
+    )
+    if referral_count is None:
+        raise HTTPException(status_code=404, detail="User not found")
 
-        if auth_date_datetime.date() > last_login_date.date():
-            db_user.is_days_shown = False
-        else:
-            db_user.is_days_shown = True
+    query = (
+        select(Referral)
+        .where(Referral.referrer_id == user_id)
+        .options(joinedload(Referral.referred_user, innerjoin=True))
+        .order_by(Referral.created_at, Referral.id)
+        .limit(limit + 1)
+    )
 
-        days_row = update_days_in_row(
-            db_user, auth_date_datetime.date(), db_user.is_days_shown, db
+    if cursor:
+        try:
+            created_at, referral_id = decode_referral_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        query = query.where(
+            tuple_(Referral.created_at, Referral.id) > tuple_(created_at, referral_id)
         )
 
-        if user_status.level != 1:
-            if auth_date_datetime.date() > last_login_datetime.date():
-                db_user.gamebot_worked_minutes = 0
-                db_user.gamebot_reward = 0
-            else:
-                time_diff = auth_date_datetime - last_login_datetime
-                if time_diff > timedelta(minutes=1):
-                    gamebot_active_minutes = max(time_diff.total_seconds() // 60 - 1, 0)
-                    user_status = get_user_status(db_user, db)
-
-                    available_gamebot_minutes = user_status.gamebot * 60 - (
-                        db_user.gamebot_worked_minutes
-                        if db_user.gamebot_worked_minutes is not None
-                        else 0
-                    )
-                    gamebot_worked = min(
-                        gamebot_active_minutes, available_gamebot_minutes
-                    )
-
-                    if db_user.gamebot_worked_minutes is None:
-                        db_user.gamebot_worked_minutes = 0
-                    if db_user.gamebot_reward is None:
-                        db_user.gamebot_reward = 0
-
-                    db_user.gamebot_worked_minutes += gamebot_worked
-                    gamebot_reward = gamebot_worked * GAMEBOT_REWARD_PER_MINUTE
-                    db_user.gamebot_reward += gamebot_reward
-
-        db_user.first_name = user_data.first_name
-        db_user.last_name = user_data.last_name
-
-        db_user.username = user_data.username
-        db_user.is_premium = user_data.is_premium
-        db_user.tg_image = user_data.tg_image
-        db_user.auth_date = user_data.auth_date
-
-        db.commit()
-        db.refresh(db_user)
-    else:
-        referrer = None
-        if referrer_id:
-            referrer_tg_id = referrer_id
-            referrer = (
-                db.query(ShiftUser).filter(ShiftUser.tg_id == referrer_tg_id).first()
-            )
-
-        initial_score = 1000 if referrer else 0
-
-        db_user = ShiftUser(
-            tg_id=user_data.tg_id,
-            first_name=user_data.first_name,
-            last_name=user_data.last_name,
-            username=user_data.username,
-            is_premium=user_data.is_premium,
-            tg_image=user_data.tg_image,
-            days_in_row=1,
-            auth_date=user_data.auth_date,
-            register_date=auth_date_datetime,
-            is_days_shown=False,
-            score=initial_score,
-        )
-        db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
-
-        if referrer and len(referrer.referrals_made) < 150:
-            referrer.reward += 1000
-            new_referral = Referral(
-                referrer_id=referrer.id, referred_user_id=db_user.id
+    page = (await db.scalars(query)).all()
+    next_cursor = encode_referral_cursor(page[limit - 1]) if len(page) > limit else None
+
+    return ReferralPageResponse(
+        referral_count=referral_count,
+        items=[
+            ReferredUserResponse(
+                id=str(referral.referred_user.id),
+                tg_id=referral.referred_user.tg_id,
+                first_name=referral.referred_user.first_name,
+                last_name=referral.referred_user.last_name,
+                username=referral.referred_user.username,
+                is_premium=referral.referred_user.is_premium,
+                score=referral.referred_user.score,
             )
-            db.add(new_referral)
-            db.commit()
-
-    next_level_data = (
-        db.query(UserStatus)
-        .filter(UserStatus.level == db_user.current_level + 1)
-        .first()
-    )
-
-    xp_to_next_level = (
-        next_level_data.xp_to_upgrade if next_level_data.xp_to_upgrade else None
+            for referral in page[:limit]
+        ],
+        next_cursor=next_cursor,
     )
 
-    ton_to_next_level = (
-        next_level_data.ton_to_upgrade if next_level_data.ton_to_upgrade else None
-    )
 
-    upgrade_available = (
-        db_user.max_score >= next_level_data.start_score if next_level_data else False
-    )
-    user_status = get_user_status(db_user, db)
-    points_to_next_level = calculate_score_to_next_level(db_user, db)
-
-    status_data = StatusResponse(
-        status_name=user_status.status_name,
-        level=user_status.level,
-        energy_limit=user_status.energy_limit,
-        nitro=user_status.nitro,
-        recharging_speed=user_status.recharging_speed,
-        coin_farming=user_status.coin_farming,
-        gamebot=user_status.gamebot,
-        fractal=user_status.fractal,
-        points_to_next_level=points_to_next_level,
-        xp_to_upgrade=xp_to_next_level,
-        ton_to_upgrade=ton_to_next_level,
-        upgrade_available=upgrade_available,
+@app.post("/users/{user_id}/claim", dependencies=[Depends(claim_limit)])
+async def claim_reward(user_id: str, db: AsyncSession = Depends(get_db)):
+    change = await claim_pending_score(
+        db, user_id, ShiftUser.reward, reason=REASON_REFERRAL, deferred=True
     )
-
-    return UserResponse.response_(db_user, status_data, days_row)
-
-
-@app.post("/users/{user_id}/claim")
-async def claim_reward(user_id: str, db: Session = Depends(get_db)):
-    user = db.query(ShiftUser).filter(ShiftUser.id == user_id).first()
-    if not user:
+    if not change:
         return {"error": "User not found"}
-    reward_passed = user.reward
-    user.score += user.reward
-    user.reward = 0
 
-    db.commit()
-    db.refresh(user)
+    await db.commit()
 
     return {
         "message": "Reward claimed successfully",
-        "new_score": user.score,
-        "reward_passed": reward_passed,
+        "new_score": change.score,
+        "reward_passed": change.amount,
     }
 
 
-@app.post("/gamebot/{user_id}/claim")
-async def claim_reward(user_id: str, db: Session = Depends(get_db)):
-    user = db.query(ShiftUser).filter(ShiftUser.id == user_id).first()
-    if not user:
+@app.post("/gamebot/{user_id}/claim", dependencies=[Depends(gamebot_claim_limit)])
+async def claim_gamebot_reward(user_id: str, db: AsyncSession = Depends(get_db)):
+    change = await settle_gamebot(db, user_id, credit=True, deferred=True)
+    if not change:
         return {"error": "Gamebot not claimed"}
 
-    user.score += user.gamebot_reward
-    user.gamebot_reward = 0
+    await db.commit()
 
-    db.commit()
-    db.refresh(user)
-
-    return {"message": "Reward claimed successfully", "new_score": user.score}
+    return {"message": "Reward claimed successfully", "new_score": change.score}
 
 
 @app.post("/gamebot/{user_id}/drop")
-async def claim_reward(user_id: str, db: Session = Depends(get_db)):
-    user = db.query(ShiftUser).filter(ShiftUser.id == user_id).first()
-    if not user:
+async def drop_gamebot_reward(user_id: str, db: AsyncSession = Depends(get_db)):
+    change = await settle_gamebot(db, user_id, credit=False)
+    if not change:
         return {"error": "Gamebot not claimed"}
 
-    user.gamebot_reward = 0
-
-    db.commit()
-    db.refresh(user)
+    await db.commit()
 
     return {"message": "Reward claimed successfully"}
 
 
-@app.get("/skins", response_model=List[SkinResponse])
-async def get_skins(user_id: str, db: Session = Depends(get_db)):
-    all_skins = db.query(Skin).all()
+@app.get("/leaderboard", response_model=LeaderboardResponse)
+async def get_leaderboard(
+    limit: int = Query(default=100, ge=1, le=100),
+    offset: int = Query(default=0, ge=0),
+    db: AsyncSession = Depends(get_db),
+):
+    entries = leaderboard.top(limit, offset)
 
-    user = db.query(ShiftUser).filter(ShiftUser.id == user_id).first()
-    if not user:
+    return LeaderboardResponse(
+        total=len(leaderboard), items=await get_leaderboard_entries(entries, db)
+    )
+
+
+@app.get("/leaderboard/{user_id}/rank", response_model=RankResponse)
+async def get_leaderboard_rank(user_id: str, db: AsyncSession = Depends(get_db)):
+    if not await leaderboard.ensure(db, user_id):
         raise HTTPException(status_code=404, detail="User not found")
 
-    purchased_skin_ids = {skin.skin_id for skin in user.purchased_skins}
+    return RankResponse(
+        rank=leaderboard.rank(user_id),
+        score=leaderboard.score(user_id),
+        total=len(leaderboard),
+    )
 
-    skins_with_status = [
-        SkinResponse(
-            id=skin.id,
-            name=skin.name,
-            required_xp=skin.required_xp,
-            price_ton=skin.price_ton,
-            open_from=skin.open_from,
-            owned=skin.id in purchased_skin_ids,
+
+@app.get("/leaderboard/{user_id}/around", response_model=LeaderboardResponse)
+async def get_leaderboard_around(
+    user_id: str,
+    radius: int = Query(default=5, ge=0, le=50),
+    db: AsyncSession = Depends(get_db),
+):
+    if not await leaderboard.ensure(db, user_id):
+        raise HTTPException(status_code=404, detail="User not found")
+
+    entries = leaderboard.around(user_id, radius)
+
+    return LeaderboardResponse(
+        total=len(leaderboard), items=await get_leaderboard_entries(entries, db)
+    )
+
+
+@app.get("/leaderboard/{user_id}/friends", response_model=LeaderboardResponse)
+async def get_friends_leaderboard(user_id: str, db: AsyncSession = Depends(get_db)):
+    if not await leaderboard.ensure(db, user_id):
+        raise HTTPException(status_code=404, detail="User not found")
+
+    friend_ids = await get_friend_ids(user_id, db)
+    for friend_id in friend_ids:
+        await leaderboard.ensure(db, friend_id)
+
+    # Ranked among the friends, not globally
+    entries = [
+        (position, friend_id, score)
+        for position, (_, friend_id, score) in enumerate(
+            leaderboard.ranked([user_id, *friend_ids]), start=1
         )
-        for skin in all_skins
     ]
 
-    return skins_with_status
+    return LeaderboardResponse(
+        total=len(entries), items=await get_leaderboard_entries(entries, db)
+    )
 
 
-@app.post("/skins/purchase")
+@app.get("/skins", response_model=List[SkinResponse], response_class=FastJSONResponse)
+async def get_skins(user_id: str, db: AsyncSession = Depends(get_db)):
+    # One indexed lookup: no rows means no user, a NULL skin no skins owned
+    rows = (
+        await db.execute(
+            select(ShiftUser.id, UserSkin.skin_id)
+            .outerjoin(UserSkin, UserSkin.user_id == ShiftUser.id)
+            .where(ShiftUser.id == user_id)
+        )
+    ).all()
+    if not rows:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    owned_skin_ids = [skin_id for _, skin_id in rows if skin_id is not None]
+
+    catalog = await current_catalog()
+    if not catalog.knows(owned_skin_ids):
+        catalog = await reload_catalog()
+
+    return trusted_response(
+        skins_adapter, catalog.responses(catalog.ownership_mask(owned_skin_ids))
+    )
+
+
+@app.post("/skins/purchase", dependencies=[Depends(purchase_limit)])
 async def purchase_skin(
-    request: PurchaseSkinRequest, user_data: UserData, db: Session = Depends(get_db)
+    request: PurchaseSkinRequest,
+    user_data: UserData = Depends(get_user_data),
+    db: AsyncSession = Depends(get_db),
 ):
-    db_user = db.query(ShiftUser).filter(ShiftUser.tg_id == user_data.tg_id).first()
+    db_user = await db.scalar(
+        select(ShiftUser).where(ShiftUser.tg_id == user_data.tg_id)
+    )
 
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    skin = db.query(Skin).filter(Skin.id == request.skin_id).first()
+    catalog = await current_catalog()
+    skin = catalog.get(request.skin_id)
+    if not skin:
+        catalog = await reload_catalog()
+        skin = catalog.get(request.skin_id)
 
     if not skin:
         raise HTTPException(status_code=404, detail="Skin not found")
 
     if request.purchase_type == "xp":
-        res = purchase_skin_with_xp(db_user, skin, db)
+        res = await purchase_skin_with_xp(db_user, skin, db)
     elif request.purchase_type == "ton":
-        res = purchase_skin_with_ton(db_user, skin, db, request.check_str)
+        res = await purchase_skin_with_ton(db_user, skin, db, request.check_str)
     else:
         raise HTTPException(status_code=400, detail="Invalid purchase type")
     if res["success"]:
         return {
             "message": "Skin purchased successfully",
-            "skin": SkinResponse.from_orm(skin).dict(),
+            "skin": catalog.response(skin).dict(),
             "score": res["score"],
         }
     else:
@@ -307,9 +351,13 @@ async def purchase_skin(
 
 @app.post("/skins/{skin_id}/set-active")
 async def set_active_skin(
-    skin_id: str, user_data: UserData, db: Session = Depends(get_db)
+    skin_id: str,
+    user_data: UserData = Depends(get_user_data),
+    db: AsyncSession = Depends(get_db),
 ):
-    db_user = db.query(ShiftUser).filter(ShiftUser.tg_id == user_data.tg_id).first()
+    db_user = await db.scalar(
+        select(ShiftUser).where(ShiftUser.tg_id == user_data.tg_id)
+    )
 
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -317,10 +365,10 @@ async def set_active_skin(
     if skin_id == "0":
         db_user.active_skin_id = None
     else:
-        user_owned_skin = (
-            db.query(UserSkin)
-            .filter(UserSkin.user_id == db_user.id, UserSkin.skin_id == skin_id)
-            .first()
+        user_owned_skin = await db.scalar(
+            select(UserSkin).where(
+                UserSkin.user_id == db_user.id, UserSkin.skin_id == skin_id
+            )
         )
 
         if not user_owned_skin:
@@ -328,8 +376,8 @@ async def set_active_skin(
 
         db_user.active_skin_id = skin_id
 
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
 
     return {
         "message": "Skin set as active successfully",
@@ -339,25 +387,23 @@ async def set_active_skin(
 
 @app.post("/users/{user_id}/upgrade-level")
 async def upgrade_level(
-    user_id: str, upgrade_request: UpgradeLevelRequest, db: Session = Depends(get_db)
+    user_id: str,
+    upgrade_request: UpgradeLevelRequest,
+    db: AsyncSession = Depends(get_db),
 ):
-    user = db.query(ShiftUser).filter(ShiftUser.id == user_id).first()
+    user = await db.scalar(select(ShiftUser).where(ShiftUser.id == user_id))
 
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
     try:
         boc = upgrade_request.boc
-        success = upgrade_user_level(user, boc, db)
+        success = await upgrade_user_level(user, boc, db)
         if success:
-            next_level_data = (
-                db.query(UserStatus)
-                .filter(UserStatus.level == user.current_level + 1)
-                .first()
-            )
+            next_level_data = get_tiers().next_after(user.current_level)
 
             xp_to_next_level_upgrade = (
-                next_level_data.xp_to_upgrade if next_level_data.xp_to_upgrade else None
+                next_level_data.xp_to_upgrade if next_level_data else None
             )
 
             upgrade_available = (
@@ -365,8 +411,8 @@ async def upgrade_level(
                 if next_level_data
                 else False
             )
-            user_status = get_user_status(user, db)
-            points_to_next_level = calculate_score_to_next_level(user, db)
+            user_status = get_user_status(user)
+            points_to_next_level = calculate_score_to_next_level(user)
 
             return {
                 "message": "User upgraded successfully",
@@ -384,150 +430,49 @@ async def upgrade_level(
         raise HTTPException(status_code=400, detail=str(e))
 
 
-@app.get("/quests", response_model=List[QuestWithProgressResponse])
-async def get_quests(user_id: str, db: Session = Depends(get_db)):
-    user = db.query(ShiftUser).filter(ShiftUser.id == user_id).first()
+@app.get(
+    "/quests",
+    response_model=List[QuestWithProgressResponse],
+    response_class=FastJSONResponse,
+)
+async def get_quests(user_id: str, db: AsyncSession = Depends(get_db)):
+    user = await db.scalar(select(ShiftUser).where(ShiftUser.id == user_id))
 
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    # Fetch all quests
-    quests = db.query(Quest).all()
-
-    quest_responses = []
-
-    for quest in quests:
-        if datetime.utcnow() > quest.valid_by:
-            continue  # Skip expired quests
-
-        user_quest = (
-            db.query(UserQuest)
-            .filter(UserQuest.user_id == user.id, UserQuest.quest_id == quest.id)
-            .first()
-        )
-
-        if not user_quest:
-            user_quest = UserQuest(
-                user_id=user.id,
-                quest_id=quest.id,
-                completed=False,
-                reward_claimed=False,
-            )
-            db.add(user_quest)
-
-        subtasks = db.query(Subtask).filter(Subtask.quest_id == quest.id).all()
-        total_subtasks = len(subtasks)
-
-        user_subtasks = (
-            db.query(UserSubtask)
-            .filter(
-                UserSubtask.user_id == user.id,
-                UserSubtask.subtask_id.in_([subtask.id for subtask in subtasks]),
-            )
-            .all()
-        )
+    return trusted_response(quests_adapter, await get_quests_with_progress(user, db))
 
-        user_subtask_map = {us.subtask_id: us for us in user_subtasks}
-
-        completed_subtasks = 0
-        subtask_responses = []
-        for subtask in subtasks:
-            if subtask.id not in user_subtask_map:
-                user_subtask = UserSubtask(
-                    user_id=user.id,
-                    subtask_id=subtask.id,
-                    completed=False,
-                    reward_claimed=False,
-                )
-                db.add(user_subtask)
-                user_subtask_map[subtask.id] = user_subtask
-
-            if user_subtask_map[subtask.id].completed:
-                completed_subtasks += 1
-
-            subtask_responses.append(
-                SubtaskResponse(
-                    id=subtask.id,
-                    name=subtask.name,
-                    description=subtask.description,
-                    reward=subtask.reward,
-                    completed=user_subtask_map[subtask.id].completed,
-                    reward_claimed=user_subtask_map[subtask.id].reward_claimed or False,
-                    # Ensure reward_claimed is boolean
-                    link=subtask.link,  # Include the link field
-                )
-            )
 
-        # Append the quest response with subtasks
-        quest_responses.append(
-            QuestWithProgressResponse(
-                id=quest.id,
-                name=quest.name,
-                description=quest.description,
-                reward=quest.reward,
-                completed=total_subtasks == completed_subtasks,
-                reward_claimed=user_quest.reward_claimed,
-                valid_by=quest.valid_by,
-                total_subtasks=total_subtasks,
-                completed_subtasks=completed_subtasks,
-                subtasks=subtask_responses,
-            )
-        )
-
-    db.commit()
-
-    return quest_responses
-
-
-@app.post("/subtasks/{subtask_id}/complete", response_model=SubtaskResponse)
+@app.post(
+    "/subtasks/{subtask_id}/complete",
+    response_model=SubtaskResponse,
+    dependencies=[Depends(subtask_complete_limit)],
+)
 async def complete_subtask(
-    subtask_id: str, user_id: str, db: Session = Depends(get_db)
+    subtask_id: str, user_id: str, db: AsyncSession = Depends(get_db)
 ):
-    user = db.query(ShiftUser).filter(ShiftUser.id == user_id).first()
+    user = await db.scalar(select(ShiftUser).where(ShiftUser.id == user_id))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    subtask = db.query(Subtask).filter(Subtask.id == subtask_id).first()
+    subtask = await db.scalar(select(Subtask).where(Subtask.id == subtask_id))
     if not subtask:
         raise HTTPException(status_code=404, detail="Subtask not found")
 
-    user_subtask = (
-        db.query(UserSubtask)
-        .filter(UserSubtask.user_id == user.id, UserSubtask.subtask_id == subtask.id)
-        .first()
-    )
-
-    if not user_subtask:
-        user_subtask = UserSubtask(
-            user_id=user.id,
-            subtask_id=subtask.id,
-            completed=False,
-            reward_claimed=False,
-        )
-        db.add(user_subtask)
-
-    user_subtask.completed = True
-    db.commit()
-
-    subtasks = db.query(Subtask).filter(Subtask.quest_id == subtask.quest_id).all()
-    total_subtasks = len(subtasks)
-    completed_subtasks = (
-        db.query(UserSubtask)
-        .filter(
-            UserSubtask.user_id == user.id,
-            UserSubtask.subtask_id.in_([st.id for st in subtasks]),
-            UserSubtask.completed == True,
-        )
-        .count()
+    reward_claimed = await mark_subtask_completed(user.id, subtask.id, db)
+    total_subtasks, completed_subtasks = await count_subtask_progress(
+        user.id, subtask.quest_id, db
     )
+    await db.commit()
 
     return {
         "id": subtask.id,
         "name": subtask.name,
         "description": subtask.description,
         "reward": subtask.reward,
-        "completed": user_subtask.completed,
-        "reward_claimed": user_subtask.reward_claimed,
+        "completed": True,
+        "reward_claimed": reward_claimed,
         "link": subtask.link,
         "completed_subtasks": completed_subtasks,
         "total_subtasks": total_subtasks,
@@ -536,20 +481,20 @@ async def complete_subtask(
 
 @app.post("/subtasks/{subtask_id}/claim-reward", response_model=SubtaskResponse)
 async def claim_subtask_reward(
-    subtask_id: str, user_id: str, db: Session = Depends(get_db)
+    subtask_id: str, user_id: str, db: AsyncSession = Depends(get_db)
 ):
-    user = db.query(ShiftUser).filter(ShiftUser.id == user_id).first()
+    user = await db.scalar(select(ShiftUser).where(ShiftUser.id == user_id))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    subtask = db.query(Subtask).filter(Subtask.id == subtask_id).first()
+    subtask = await db.scalar(select(Subtask).where(Subtask.id == subtask_id))
     if not subtask:
         raise HTTPException(status_code=404, detail="Subtask not found")
 
-    user_subtask = (
-        db.query(UserSubtask)
-        .filter(UserSubtask.user_id == user.id, UserSubtask.subtask_id == subtask.id)
-        .first()
+    user_subtask = await db.scalar(
+        select(UserSubtask).where(
+            UserSubtask.user_id == user.id, UserSubtask.subtask_id == subtask.id
+        )
     )
 
     if not user_subtask:
@@ -558,26 +503,26 @@ async def claim_subtask_reward(
     if not user_subtask.completed:
         raise HTTPException(status_code=400, detail="Subtask is not completed yet")
 
-    if user_subtask.reward_claimed:
+    claimed_id = await db.scalar(
+        update(UserSubtask)
+        .where(
+            UserSubtask.id == user_subtask.id,
+            UserSubtask.reward_claimed.isnot(True),
+        )
+        .values(reward_claimed=True)
+        .returning(UserSubtask.id)
+        .execution_options(synchronize_session=False)
+    )
+    if not claimed_id:
         raise HTTPException(
             status_code=400, detail="Reward already claimed for this subtask"
         )
 
-    user_subtask.reward_claimed = True
-    user.score += subtask.reward
-    db.commit()
-
-    subtasks = db.query(Subtask).filter(Subtask.quest_id == subtask.quest_id).all()
-    total_subtasks = len(subtasks)
-    completed_subtasks = (
-        db.query(UserSubtask)
-        .filter(
-            UserSubtask.user_id == user.id,
-            UserSubtask.subtask_id.in_([st.id for st in subtasks]),
-            UserSubtask.completed == True,
-        )
-        .count()
+    await add_score(db, user.id, subtask.reward, reason=REASON_SUBTASK, user=user)
+    total_subtasks, completed_subtasks = await count_subtask_progress(
+        user.id, subtask.quest_id, db
     )
+    await db.commit()
 
     return SubtaskResponse(
         id=subtask.id,
@@ -585,7 +530,7 @@ async def claim_subtask_reward(
         description=subtask.description,
         reward=subtask.reward,
         completed=user_subtask.completed,
-        reward_claimed=user_subtask.reward_claimed,
+        reward_claimed=True,
         link=subtask.link,
         completed_subtasks=completed_subtasks,
         total_subtasks=total_subtasks,
@@ -594,50 +539,30 @@ async def claim_subtask_reward(
 
 @app.post("/quests/{quest_id}/claim-reward", response_model=QuestWithProgressResponse)
 async def claim_quest_reward(
-    quest_id: str, user_id: str, db: Session = Depends(get_db)
+    quest_id: str, user_id: str, db: AsyncSession = Depends(get_db)
 ):
-    user = db.query(ShiftUser).filter(ShiftUser.id == user_id).first()
+    user = await db.scalar(select(ShiftUser).where(ShiftUser.id == user_id))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    quest = db.query(Quest).filter(Quest.id == quest_id).first()
+    quest = await db.scalar(select(Quest).where(Quest.id == quest_id))
     if not quest:
         raise HTTPException(status_code=404, detail="Quest not found")
 
-    user_quest = (
-        db.query(UserQuest)
-        .filter(UserQuest.user_id == user.id, UserQuest.quest_id == quest.id)
-        .first()
-    )
-
-    if not user_quest:
-        raise HTTPException(
-            status_code=400, detail="Quest has not been started by the user"
-        )
-
-    subtasks = db.query(Subtask).filter(Subtask.quest_id == quest.id).all()
-    total_subtasks = len(subtasks)
-    completed_subtasks = (
-        db.query(UserSubtask)
-        .filter(
-            UserSubtask.user_id == user.id,
-            UserSubtask.subtask_id.in_([st.id for st in subtasks]),
-            UserSubtask.completed == True,
-        )
-        .count()
+    total_subtasks, completed_subtasks = await count_subtask_progress(
+        user.id, quest.id, db
     )
 
     if completed_subtasks != total_subtasks:
         raise HTTPException(status_code=400, detail="Not all subtasks are completed")
 
-    if user_quest.reward_claimed:
+    if not await mark_quest_reward_claimed(user.id, quest.id, db):
         raise HTTPException(
             status_code=400, detail="Reward already claimed for this quest"
         )
 
-    user_quest.reward_claimed = True
-    user.score += quest.reward
-    db.commit()
+    await add_score(db, user.id, quest.reward, reason=REASON_QUEST, user=user)
+    await db.commit()
 
     return QuestWithProgressResponse(
         id=quest.id,
@@ -645,7 +570,7 @@ async def claim_quest_reward(
         description=quest.description,
         reward=quest.reward,
         completed=True,
-        reward_claimed=user_quest.reward_claimed,
+        reward_claimed=True,
         valid_by=quest.valid_by,
         total_subtasks=total_subtasks,
         completed_subtasks=completed_subtasks,
@@ -654,38 +579,35 @@ async def claim_quest_reward(
 
 @app.put("/users/{user_id}/address", response_model=UserResponse)
 async def set_user_address(
-    user_id: str, request: SetAddressRequest, db: Session = Depends(get_db)
+    user_id: str, request: SetAddressRequest, db: AsyncSession = Depends(get_db)
 ):
     # Fetch the user
-    user = db.query(ShiftUser).filter(ShiftUser.id == user_id).first()
+    user = await db.scalar(select(ShiftUser).where(ShiftUser.id == user_id))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
     # Update the user's address
     user.address = request.address
-    db.commit()
+    await db.commit()
 
     return UserResponse.from_orm(user)
 
 
 @app.delete("/users/{user_id}/address", response_model=UserResponse)
-async def delete_user_address(user_id: str, db: Session = Depends(get_db)):
+async def delete_user_address(user_id: str, db: AsyncSession = Depends(get_db)):
     # Fetch the user
-    user = db.query(ShiftUser).filter(ShiftUser.id == user_id).first()
+    user = await db.scalar(select(ShiftUser).where(ShiftUser.id == user_id))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
     # Set the address to None
     user.address = None
-    db.commit()
+    await db.commit()
 
     return UserResponse.from_orm(user)
 
 
 if __name__ == "__main__":
-    uvicorn.run(
-        "main:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=True,
-    )
+    from server import run
+
+    run()
@@ -1,28 +1,102 @@
-from fastapi import Request, HTTPException
-from starlette.middleware.base import BaseHTTPMiddleware
-from validators import validate_telegram_data
+import logging
 
+from fastapi import Request
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+
+from exceptions import TelegramDataError, TelegramDataIsOutdated
+from querycount import count_queries
+from schemas import UserData
+from validators import get_validator
+
+logger = logging.getLogger(__name__)
+
+
+class TelegramAuthMiddleware:
+    """Require a valid `Authorization: tma <initData>` header.
+
+    The verified TelegramUser is stored in the request state
+    (`request.state.telegram_user`). Requests with a missing or malformed
+    header or outdated init data get a 401 and forged init data a 403,
+    without reaching the app.
+    """
+
+    methods = frozenset({"GET", "POST", "PUT"})
 
-class TelegramAuthMiddleware(BaseHTTPMiddleware):
     def __init__(self, app, telegram_bot_token: str):
-        super().__init__(app)
-        self.telegram_bot_token = telegram_bot_token
-
-    async def dispatch(self, request: Request, call_next):
-        if request.method in ["GET", "POST", "PUT"]:
-            try:
-                auth_header = request.headers.get("Authorization")
-                if not auth_header or not auth_header.startswith("tma "):
-                    raise HTTPException(
-                        status_code=401,
-                        detail="Missing or invalid Authorization header",
+        self.app = app
+        self.validator = get_validator(telegram_bot_token)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in self.methods:
+            await self.app(scope, receive, send)
+            return
+
+        auth_header = Headers(scope=scope).get("authorization", "")
+        scheme, _, raw_data = auth_header.partition(" ")
+        if scheme != "tma" or not raw_data:
+            response = _auth_error(401, "Missing or invalid Authorization header")
+            await response(scope, receive, send)
+            return
+
+        try:
+            telegram_user = self.validator.validate(raw_data)
+        except TelegramDataIsOutdated as e:
+            response = _auth_error(401, str(e))
+        except TelegramDataError as e:
+            response = _auth_error(403, str(e))
+        else:
+            scope.setdefault("state", {})["telegram_user"] = telegram_user
+            await self.app(scope, receive, send)
+            return
+
+        await response(scope, receive, send)
+
+
+def _auth_error(status_code: int, detail: str) -> JSONResponse:
+    headers = {"WWW-Authenticate": "tma"} if status_code == 401 else None
+    return JSONResponse({"detail": detail}, status_code=status_code, headers=headers)
+
+
+class QueryCountMiddleware:
+    """Report the number of SQL statements issued per request.
+
+    The count is logged and returned in the `X-Query-Count` response header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with count_queries() as counter:
+
+            async def send_with_count(message):
+                if message["type"] == "http.response.start":
+                    headers = MutableHeaders(scope=message)
+                    headers.append("X-Query-Count", str(counter.count))
+                    logger.debug(
+                        "%s %s: %d queries",
+                        scope["method"],
+                        scope["path"],
+                        counter.count,
                     )
+                await send(message)
+
+            await self.app(scope, receive, send_with_count)
+
 
-                raw_data = auth_header.split(" ")[1]
-                validate_telegram_data(self.telegram_bot_token, raw_data)
+async def get_user_data(request: Request, user_data: UserData) -> UserData:
+    """Request body, with the identity taken from the verified initData.
 
-            except Exception as e:
-                raise HTTPException(status_code=400, detail=str(e))
+    Without `TelegramAuthMiddleware` the body is returned unchanged. It is
+    async so FastAPI runs it on the event loop rather than in a thread.
+    """
 
-        response = await call_next(request)
-        return response
+    telegram_user = getattr(request.state, "telegram_user", None)
+    if telegram_user is None:
+        return user_data
+    return user_data.verified_by(telegram_user)
@@ -1,5 +1,6 @@
 import os
 import uuid
+from datetime import datetime
 
 from dotenv import load_dotenv
 from sqlalchemy import (
@@ -10,19 +11,45 @@ from sqlalchemy import (
     BigInteger,
     Integer,
     DateTime,
+    Date,
     ForeignKey,
     Float,
+    Index,
+    func,
+    text,
 )
 from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import (
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
 from sqlalchemy.orm import declarative_base, sessionmaker, Session, relationship
 
+from dbpool import InstrumentedPool
+from settings import db_settings
+
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+ASYNC_DATABASE_URL = make_url(DATABASE_URL).set(drivername="postgresql+asyncpg")
 
+# Sync engine, kept for scripts such as init_db
 engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine used by the API, pooled as configured in settings.py
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL, poolclass=InstrumentedPool, **db_settings.engine_options()
+)
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
 Base = declarative_base()
 
 
@@ -124,13 +151,25 @@ class ShiftUser(Base):
     days_in_row = Column(Integer, default=1)
     auth_date = Column(Integer)
     is_days_shown = Column(Boolean, nullable=False, default=False)
+    is_days_dropped = Column(
+        Boolean, nullable=False, default=False, server_default="false"
+    )
+    # UTC day the day state above was last rolled over to, see rollover.py
+    rollover_day = Column(Date, index=True)
     register_date = Column(DateTime, nullable=False)
     reward = Column(Integer, default=0)
     max_score = Column(BigInteger, default=0)
+    # Gamebot earnings are computed on read from the cycle start, see
+    # gamebot.py; the minutes column holds the minutes already paid out
+    gamebot_started_at = Column(BigInteger, nullable=True)
     gamebot_worked_minutes = Column(Integer, default=0)
     gamebot_reward = Column(Integer, default=0)
     current_level = Column(Integer, nullable=False, default=1)
     address = Column(String, nullable=True)
+    referral_count = Column(Integer, nullable=False, default=0, server_default="0")
+    referral_reward_total = Column(
+        BigInteger, nullable=False, default=0, server_default="0"
+    )
 
     referrals_made = relationship(
         "Referral", foreign_keys="[Referral.referrer_id]", back_populates="referrer"
@@ -150,6 +189,11 @@ class ShiftUser(Base):
         "UserSubtask", back_populates="user", cascade="all, delete-orphan"
     )
 
+    # Rank counts without an in-memory board, see Leaderboard.lookup_rank
+    __table_args__ = (
+        Index("ix_users_score_rank", func.coalesce(score, 0).desc(), "id"),
+    )
+
 
 class Referral(Base):
     __tablename__ = "referrals"
@@ -157,7 +201,14 @@ class Referral(Base):
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, index=True)
     referrer_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
     referred_user_id = Column(
-        UUID(as_uuid=True), ForeignKey("users.id"), nullable=False
+        UUID(as_uuid=True), ForeignKey("users.id"), nullable=False, index=True
+    )
+    created_at = Column(
+        DateTime, nullable=False, default=datetime.utcnow, server_default=func.now()
+    )
+
+    __table_args__ = (
+        Index("ix_referrals_referrer_page", "referrer_id", "created_at", "id"),
     )
 
     referrer = relationship(
@@ -189,7 +240,9 @@ class UserSkin(Base):
     __tablename__ = "user_skins"
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
+    user_id = Column(
+        UUID(as_uuid=True), ForeignKey("users.id"), nullable=False, index=True
+    )
     skin_id = Column(UUID(as_uuid=True), ForeignKey("skins.id"), nullable=False)
 
     user = relationship("ShiftUser", back_populates="purchased_skins")
@@ -206,6 +259,7 @@ class Quest(Base):
     valid_by = Column(DateTime, nullable=False)
 
     user_quests = relationship("UserQuest", back_populates="quest")
+    subtasks = relationship("Subtask", back_populates="quest")
 
 
 class UserQuest(Base):
@@ -217,6 +271,10 @@ class UserQuest(Base):
     completed = Column(Boolean, default=False)
     reward_claimed = Column(Boolean, default=False)
 
+    __table_args__ = (
+        Index("uq_user_quests_user_quest", "user_id", "quest_id", unique=True),
+    )
+
     user = relationship("ShiftUser", back_populates="user_quests")
     quest = relationship("Quest", back_populates="user_quests")
 
@@ -230,6 +288,8 @@ class Subtask(Base):
     reward = Column(Integer, nullable=False)
     quest_id = Column(UUID(as_uuid=True), ForeignKey("quests.id"), nullable=False)
     link = Column(String, nullable=True)
+
+    quest = relationship("Quest", back_populates="subtasks")
     user_subtasks = relationship("UserSubtask", back_populates="subtask")
 
 
@@ -242,12 +302,130 @@ class UserSubtask(Base):
     completed = Column(Boolean, default=False)
     reward_claimed = Column(Boolean, default=False)
 
+    __table_args__ = (
+        Index("uq_user_subtasks_user_subtask", "user_id", "subtask_id", unique=True),
+    )
+
     user = relationship("ShiftUser", back_populates="user_subtasks")
     subtask = relationship("Subtask", back_populates="user_subtasks")
 
 
+class ScoreEvent(Base):
+    """Append-only record of a single score change"""
+
+    __tablename__ = "score_events"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
+    delta = Column(BigInteger, nullable=False)
+    reason = Column(String, nullable=False)
+    created_at = Column(DateTime, nullable=False, index=True)
+
+    __table_args__ = (Index("ix_score_events_user_created", "user_id", "created_at"),)
+
+
+class ScoreDailyRollup(Base):
+    """Score events compacted per user, day and reason"""
+
+    __tablename__ = "score_daily_rollups"
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    reason = Column(String, primary_key=True)
+    delta_total = Column(BigInteger, nullable=False)
+    event_count = Column(Integer, nullable=False)
+
+
+class Broadcast(Base):
+    """A notification sent to a segment of users, with its progress.
+
+    Recipients are walked in `users.id` order; `last_user_id` is the last
+    one of the batches already sent, so an interrupted broadcast resumes
+    after it.
+    """
+
+    __tablename__ = "broadcasts"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    segment = Column(String, nullable=False)
+    text = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="pending", index=True)
+    last_user_id = Column(UUID(as_uuid=True), nullable=True)
+    sent = Column(Integer, nullable=False, default=0)
+    blocked = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+
+# create_all only creates missing tables, so columns and indexes added to
+# existing ones are applied here. Every statement must be idempotent.
+SCHEMA_UPGRADES = [
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS "
+    "referral_count INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS "
+    "referral_reward_total BIGINT NOT NULL DEFAULT 0",
+    "ALTER TABLE referrals ADD COLUMN IF NOT EXISTS "
+    "created_at TIMESTAMP NOT NULL DEFAULT now()",
+    "CREATE INDEX IF NOT EXISTS ix_referrals_referrer_page "
+    "ON referrals (referrer_id, created_at, id)",
+    "CREATE INDEX IF NOT EXISTS ix_referrals_referred_user_id "
+    "ON referrals (referred_user_id)",
+    # Backfill the referral counters from the existing referral rows
+    "UPDATE users SET referral_count = r.count, "
+    "referral_reward_total = r.count * 1000 "
+    "FROM (SELECT referrer_id, count(*) AS count FROM referrals "
+    "GROUP BY referrer_id) AS r "
+    "WHERE users.id = r.referrer_id AND users.referral_count = 0",
+    # Quest progress is sparse: rows without progress are dropped and the
+    # remaining duplicates collapsed before the unique indexes are built
+    "DELETE FROM user_quests WHERE reward_claimed IS NOT TRUE",
+    "DELETE FROM user_subtasks "
+    "WHERE completed IS NOT TRUE AND reward_claimed IS NOT TRUE",
+    "DELETE FROM user_quests a USING user_quests b "
+    "WHERE a.user_id = b.user_id AND a.quest_id = b.quest_id AND a.ctid < b.ctid",
+    "DELETE FROM user_subtasks a USING user_subtasks b "
+    "WHERE a.user_id = b.user_id AND a.subtask_id = b.subtask_id "
+    "AND (a.reward_claimed IS TRUE, a.ctid) < (b.reward_claimed IS TRUE, b.ctid)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_user_quests_user_quest "
+    "ON user_quests (user_id, quest_id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_user_subtasks_user_subtask "
+    "ON user_subtasks (user_id, subtask_id)",
+    "CREATE INDEX IF NOT EXISTS ix_user_skins_user_id ON user_skins (user_id)",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS gamebot_started_at BIGINT",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS rollover_day DATE",
+    # Start the cycle so that the minutes worked up to the last login are
+    # exactly the ones already accounted for in gamebot_reward. Only rows
+    # from before the rollover existed: it clears the column to end a cycle
+    "UPDATE users SET gamebot_started_at = "
+    "auth_date - (coalesce(gamebot_worked_minutes, 0) + 1) * 60 "
+    "WHERE gamebot_started_at IS NULL AND auth_date IS NOT NULL "
+    "AND rollover_day IS NULL",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS "
+    "is_days_dropped BOOLEAN NOT NULL DEFAULT false",
+    "CREATE INDEX IF NOT EXISTS ix_users_rollover_day ON users (rollover_day)",
+    # The day state of existing users is as of their last login
+    "UPDATE users SET rollover_day = coalesce("
+    "(to_timestamp(auth_date) AT TIME ZONE 'UTC')::date, register_date::date) "
+    "WHERE rollover_day IS NULL",
+    "CREATE INDEX IF NOT EXISTS ix_users_score_rank "
+    "ON users ((coalesce(score, 0)) DESC, id)",
+    # max_score was not maintained before score changes went through scores.py
+    "UPDATE users SET max_score = score "
+    "WHERE max_score IS NULL OR max_score < score",
+]
+
+
+def upgrade_schema():
+    with engine.begin() as conn:
+        for statement in SCHEMA_UPGRADES:
+            conn.execute(text(statement))
+
+
 def init_db():
     Base.metadata.create_all(bind=engine)
+    upgrade_schema()
 
     with SessionLocal() as db:
         if not db.query(UserStatus).first():
@@ -258,9 +436,6 @@ if __name__ == "__main__":
     init_db()
 
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
@@ -0,0 +1,45 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from sqlalchemy import event
+
+from models import async_engine
+
+
+class QueryCounter:
+    """Number of SQL statements sent to the database while active"""
+
+    __slots__ = ("count",)
+
+    def __init__(self):
+        self.count = 0
+
+
+_current_counter: ContextVar[Optional[QueryCounter]] = ContextVar(
+    "query_counter", default=None
+)
+
+
+@event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    counter = _current_counter.get()
+    if counter is not None:
+        counter.count += 1
+
+
+@contextmanager
+def count_queries() -> Iterator[QueryCounter]:
+    """Count the statements executed within the block.
+
+    with count_queries() as counter:
+        ...
+    counter.count
+    """
+
+    counter = QueryCounter()
+    token = _current_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _current_counter.reset(token)
@@ -0,0 +1,132 @@
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional, Protocol
+
+from fastapi import HTTPException, Request
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") != "0"
+# Buckets kept in memory; the least recently used ones are dropped first
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", 100_000))
+# Calls per second a route takes from all clients together, 0 for no limit
+RATE_LIMIT_ROUTE_RATE = float(os.getenv("RATE_LIMIT_ROUTE_RATE", 200))
+RATE_LIMIT_ROUTE_BURST = int(os.getenv("RATE_LIMIT_ROUTE_BURST", 400))
+
+
+class RateLimitBackend(Protocol):
+    """Storage of token buckets, shared between workers or not"""
+
+    async def take(self, key: Hashable, rate: float, burst: int) -> float:
+        """Take a token from the bucket of `key`.
+
+        Returns 0 when a token was taken, else the seconds until one is
+        available.
+        """
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class MemoryBackend:
+    """Token buckets of this process, at most `max_keys` of them.
+
+    A bucket that is dropped would have refilled anyway unless its client
+    kept calling, in which case it is among the recently used ones.
+    """
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[Hashable, _Bucket] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    async def take(self, key: Hashable, rate: float, burst: int) -> float:
+        now = time.monotonic()
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(burst, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket.tokens = min(burst, bucket.tokens + (now - bucket.updated) * rate)
+            bucket.updated = now
+
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return 0.0
+        return (1 - bucket.tokens) / rate
+
+
+rate_limit_backend: RateLimitBackend = MemoryBackend()
+
+
+def client_key(request: Request) -> str:
+    """Whom a request is counted against.
+
+    The Telegram user verified by the auth middleware, else the client
+    address. Ids in the path or body are chosen by the caller and would let
+    it pick a fresh bucket for every call.
+    """
+
+    telegram_user = getattr(request.state, "telegram_user", None)
+    if telegram_user is not None:
+        return f"tg:{telegram_user.id}"
+
+    return f"ip:{request.client.host if request.client else ''}"
+
+
+class RateLimit:
+    """Route dependency rejecting calls over the limit with a 429.
+
+    Every client gets `rate` calls per second with bursts of `burst` calls
+    on this route, and the route as a whole gets `route_rate` calls per
+    second. Use it in the route's `dependencies`, which run before `get_db`,
+    so a rejected call never opens a session.
+    """
+
+    def __init__(
+        self,
+        route: str,
+        rate: float,
+        burst: int,
+        route_rate: float = RATE_LIMIT_ROUTE_RATE,
+        route_burst: int = RATE_LIMIT_ROUTE_BURST,
+        backend: Optional[RateLimitBackend] = None,
+    ):
+        self.route = route
+        self.rate = rate
+        self.burst = burst
+        self.route_rate = route_rate
+        self.route_burst = route_burst
+        self.backend = backend
+
+    async def __call__(self, request: Request):
+        if not RATE_LIMIT_ENABLED:
+            return
+
+        backend = rate_limit_backend if self.backend is None else self.backend
+
+        retry_after = await backend.take(
+            (self.route, client_key(request)), self.rate, self.burst
+        )
+        # Only calls within their client's limit count against the route, so
+        # one client cannot use up the route bucket by itself
+        if not retry_after and self.route_rate:
+            retry_after = await backend.take(
+                (self.route, None), self.route_rate, self.route_burst
+            )
+        if retry_after:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
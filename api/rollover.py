@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import os
+import sys
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import Date, case, cast, func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import AsyncSessionLocal, ShiftUser, async_engine
+
+logger = logging.getLogger(__name__)
+
+ROLLOVER_BATCH_SIZE = int(os.getenv("ROLLOVER_BATCH_SIZE", 5000))
+# Seconds after UTC midnight the scheduled rollover starts
+ROLLOVER_DELAY = float(os.getenv("ROLLOVER_DELAY", 5))
+
+# pg advisory lock key guarding the rollover job
+ROLLOVER_LOCK_ID = 0x5C07F
+
+
+def utc_day(timestamp: int) -> date:
+    return datetime.fromtimestamp(timestamp, timezone.utc).date()
+
+
+def utc_today() -> date:
+    return datetime.now(timezone.utc).date()
+
+
+def roll_over_user(user: ShiftUser, day: date):
+    """Apply the rollover to `day` to a single loaded user.
+
+    Used by the login when the job has not reached the user yet; does the
+    same as `roll_over` does in SQL. Changes are left in the session.
+    """
+
+    last_login_day = utc_day(user.auth_date) if user.auth_date else None
+    missed_day = last_login_day is None or last_login_day < day - timedelta(days=1)
+    if missed_day:
+        user.days_in_row = 1
+    user.is_days_dropped = missed_day
+    user.is_days_shown = False
+    user.gamebot_started_at = None
+    user.gamebot_worked_minutes = 0
+    user.gamebot_reward = 0
+    user.rollover_day = day
+
+
+async def roll_over(db: AsyncSession, day: date) -> int:
+    """Move the users' day state to the UTC `day` with batched UPDATEs.
+
+    Users that missed the day before lose their streak, everybody gets the
+    daily popup again and the gamebot cycle ends. Only rows this changes are
+    written; inactive users already in the rolled-over state keep their old
+    `rollover_day` and are rolled over by their next login. Rows locked by a
+    login are skipped, that login rolls them over itself. Only one worker
+    runs the job at a time. Returns the number of users rolled over.
+    """
+
+    last_login_day = cast(
+        func.timezone("UTC", func.to_timestamp(ShiftUser.auth_date)), Date
+    )
+    missed_day = func.coalesce(last_login_day < day - timedelta(days=1), True)
+    changes = or_(
+        missed_day & ShiftUser.days_in_row.is_distinct_from(1),
+        ShiftUser.is_days_dropped != missed_day,
+        ShiftUser.is_days_shown,
+        ShiftUser.gamebot_started_at.is_not(None),
+        ShiftUser.gamebot_worked_minutes.is_distinct_from(0),
+        ShiftUser.gamebot_reward.is_distinct_from(0),
+    )
+
+    total = 0
+    last_id = None
+
+    while True:
+        if not await db.scalar(
+            select(func.pg_try_advisory_xact_lock(ROLLOVER_LOCK_ID))
+        ):
+            return total
+
+        # Keyset over the ids, so rows left alone are not read again
+        batch = (
+            select(ShiftUser.id)
+            .where(ShiftUser.rollover_day < day, changes)
+            .order_by(ShiftUser.id)
+            .limit(ROLLOVER_BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+        )
+        if last_id is not None:
+            batch = batch.where(ShiftUser.id > last_id)
+        batch = batch.subquery()
+
+        rolled = await db.scalars(
+            update(ShiftUser)
+            .where(ShiftUser.id == batch.c.id)
+            .values(
+                days_in_row=case((missed_day, 1), else_=ShiftUser.days_in_row),
+                is_days_dropped=missed_day,
+                is_days_shown=False,
+                gamebot_started_at=None,
+                gamebot_worked_minutes=0,
+                gamebot_reward=0,
+                rollover_day=day,
+            )
+            .returning(ShiftUser.id)
+            .execution_options(synchronize_session=False)
+        )
+        ids = rolled.all()
+        await db.commit()
+
+        total += len(ids)
+        if len(ids) < ROLLOVER_BATCH_SIZE:
+            return total
+        last_id = max(ids)
+
+
+async def run_rollover(day: Optional[date] = None) -> int:
+    day = day or utc_today()
+    async with AsyncSessionLocal() as db:
+        rolled = await roll_over(db, day)
+    if rolled:
+        logger.info("Rolled %d users over to %s", rolled, day)
+    return rolled
+
+
+async def run_rollovers():
+    """Roll over at startup, to catch up, and then after every UTC midnight"""
+
+    while True:
+        try:
+            await run_rollover()
+        except Exception:
+            logger.exception("Daily rollover failed")
+
+        now = datetime.now(timezone.utc)
+        midnight = datetime.combine(
+            now.date() + timedelta(days=1), time.min, tzinfo=timezone.utc
+        )
+        await asyncio.sleep((midnight - now).total_seconds() + ROLLOVER_DELAY)
+
+
+async def _main(day: Optional[date]):
+    try:
+        print(await run_rollover(day))
+    finally:
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    # python rollover.py [YYYY-MM-DD]
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main(date.fromisoformat(sys.argv[1]) if len(sys.argv) > 1 else None))
@@ -15,6 +15,19 @@ class UserData(BaseModel):
     auth_date: int
     # hash: str
 
+    def verified_by(self, user) -> "UserData":
+        """Body with the identity fields replaced by a verified Telegram user"""
+
+        return UserData(
+            tg_id=str(user.id),
+            first_name=user.first_name,
+            last_name=user.last_name,
+            username=user.username,
+            is_premium=user.is_premium,
+            tg_image=user.photo_url or self.tg_image,
+            auth_date=user.auth_date,
+        )
+
 
 class StatusResponse(BaseModel):
     """Statuses Response"""
@@ -67,11 +80,21 @@ class ReferralResponse(BaseModel):
 
     referrer: Optional[ReferrerResponse] = None
     referred_users: list[ReferredUserResponse] = []
+    referral_count: int = 0
+    referral_reward_total: int = 0
 
     class Config:
         from_attributes = True
 
 
+class ReferralPageResponse(BaseModel):
+    """One page of the users referred by the current user"""
+
+    referral_count: int
+    items: list[ReferredUserResponse]
+    next_cursor: Optional[str] = None
+
+
 class SkinResponse(BaseModel):
     id: UUID4
     name: str
@@ -95,9 +118,9 @@ class DropReward(BaseModel):
     """Request Body"""
 
     type: str
-    amount: Optional[int]
-    new_score: Optional[int]
-    skin: Optional[SkinResponse]
+    amount: Optional[int] = None
+    new_score: Optional[int] = None
+    skin: Optional[SkinResponse] = None
 
 
 class UpgradeLevelRequest(BaseModel):
@@ -133,6 +156,7 @@ class UserResponse(BaseModel):
     max_score: Optional[int] = None
     drop_reward: Optional[DropReward] = None
     address: Optional[str]
+    rank: Optional[int] = None
 
     class Config:
         from_attributes = True
@@ -143,11 +167,13 @@ class UserResponse(BaseModel):
         obj,
         status_data: StatusResponse,
         days_row,
+        include_referred_users: bool = True,
+        gamebot=None,
     ):
-        """JSON Response"""
+        """JSON Response, built from our own ORM objects without validation"""
 
         referrer = (
-            ReferrerResponse(
+            ReferrerResponse.model_construct(
                 id=str(obj.referrals_received[0].referrer.id),
                 tg_id=obj.referrals_received[0].referrer.tg_id,
                 first_name=obj.referrals_received[0].referrer.first_name,
@@ -159,24 +185,31 @@ class UserResponse(BaseModel):
             else None
         )
 
-        referred_users = [
-            ReferredUserResponse(
-                id=str(referral.referred_user.id),
-                tg_id=referral.referred_user.tg_id,
-                first_name=referral.referred_user.first_name,
-                last_name=referral.referred_user.last_name,
-                username=referral.referred_user.username,
-                is_premium=referral.referred_user.is_premium,
-                score=referral.referred_user.score,
-            )
-            for referral in obj.referrals_made
-        ]
+        referred_users = (
+            [
+                ReferredUserResponse.model_construct(
+                    id=str(referral.referred_user.id),
+                    tg_id=referral.referred_user.tg_id,
+                    first_name=referral.referred_user.first_name,
+                    last_name=referral.referred_user.last_name,
+                    username=referral.referred_user.username,
+                    is_premium=referral.referred_user.is_premium,
+                    score=referral.referred_user.score,
+                )
+                for referral in obj.referrals_made
+            ]
+            if include_referred_users
+            else []
+        )
 
-        referral_data = ReferralResponse(
-            referrer=referrer, referred_users=referred_users
+        referral_data = ReferralResponse.model_construct(
+            referrer=referrer,
+            referred_users=referred_users,
+            referral_count=obj.referral_count,
+            referral_reward_total=obj.referral_reward_total,
         )
 
-        response_data = cls(
+        response_data = cls.model_construct(
             id=str(obj.id),
             tg_id=obj.tg_id,
             first_name=obj.first_name,
@@ -191,8 +224,10 @@ class UserResponse(BaseModel):
             auth_date=obj.auth_date,
             register_date=obj.register_date,
             is_days_shown=obj.is_days_shown,
-            gamebot_worked_minutes=obj.gamebot_worked_minutes,
-            gamebot_reward=obj.gamebot_reward,
+            gamebot_worked_minutes=(
+                gamebot.worked_minutes if gamebot else obj.gamebot_worked_minutes
+            ),
+            gamebot_reward=gamebot.reward if gamebot else obj.gamebot_reward,
             referrals=referral_data,
             active_skin_id=obj.active_skin_id,
             max_score=obj.max_score,
@@ -201,10 +236,8 @@ class UserResponse(BaseModel):
 
         if days_row["is_days_dropped"]:
             response_data.is_days_dropped = True
-        if days_row.get("reward") is not None:
-            response_data.drop_reward = (
-                days_row["reward"] if days_row["reward"] else None
-            )
+        if days_row.get("reward"):
+            response_data.drop_reward = DropReward.model_validate(days_row["reward"])
 
         return response_data
 
@@ -238,3 +271,30 @@ class QuestWithProgressResponse(BaseModel):
 
     class Config:
         orm_mode = True
+
+
+class LeaderboardEntryResponse(BaseModel):
+    """A user's position on a leaderboard"""
+
+    rank: int
+    id: str
+    first_name: str
+    last_name: str
+    username: Optional[str]
+    tg_image: Optional[str] = None
+    score: int
+
+
+class LeaderboardResponse(BaseModel):
+    """A slice of a leaderboard"""
+
+    total: int
+    items: List[LeaderboardEntryResponse]
+
+
+class RankResponse(BaseModel):
+    """The current user's global rank"""
+
+    rank: int
+    score: int
+    total: int
@@ -0,0 +1,351 @@
+from datetime import datetime
+from typing import Any, Iterable, Mapping, NamedTuple, Optional
+
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
+
+from models import ShiftUser
+from writebehind import score_accumulator
+
+
+# Reasons recorded in the score ledger
+REASON_SIGNUP_BONUS = "signup_bonus"
+REASON_REFERRAL = "referral"
+REASON_GAMEBOT = "gamebot"
+REASON_DAILY_DROP = "daily_drop"
+REASON_SUBTASK = "subtask"
+REASON_QUEST = "quest"
+REASON_SKIN_PURCHASE = "skin_purchase"
+REASON_LEVEL_UPGRADE = "level_upgrade"
+
+
+class ScoreChange(NamedTuple):
+    """Result of a score mutation, as returned by the database"""
+
+    score: int
+    max_score: int
+    amount: int = 0
+
+
+def _score_values(delta) -> dict:
+    """SET clause adding `delta` to score and keeping max_score in step.
+
+    In an UPDATE the right-hand side sees the old row, so `score + delta`
+    is the new score in both assignments.
+    """
+
+    new_score = func.coalesce(ShiftUser.score, 0) + delta
+    return {
+        "score": new_score,
+        "max_score": func.greatest(func.coalesce(ShiftUser.max_score, 0), new_score),
+    }
+
+
+def _score_event(user_id, delta: int, reason: str) -> tuple:
+    return user_id, delta, reason, datetime.utcnow()
+
+
+def record_score_event(db: AsyncSession, user_id, delta: int, reason: str):
+    """Queue a ledger event on the session.
+
+    Events are handed to the ledger only once the session commits and are
+    discarded on rollback, see ledger.py.
+    """
+
+    if delta:
+        db.info.setdefault("score_events", []).append(
+            _score_event(user_id, delta, reason)
+        )
+
+
+def queue_score_update(db: AsyncSession, user_id, score: int):
+    """Queue the user's new score for the leaderboard, applied on commit"""
+
+    db.info.setdefault("score_updates", {})[user_id] = score
+
+
+def _take_pending_delta(db: AsyncSession, user_id) -> int:
+    """Move the user's write-behind delta into this transaction.
+
+    Its ledger events join the session's, and the delta goes back to the
+    accumulator if the transaction does not commit, see writebehind.py.
+    """
+
+    if not score_accumulator.enabled:
+        return 0
+
+    taken = score_accumulator.take(user_id)
+    if not taken:
+        return 0
+
+    delta, events = taken
+    db.info.setdefault("score_deltas_taken", []).append((user_id, delta, events))
+    db.info.setdefault("score_events", []).extend(events)
+
+    return delta
+
+
+def _return_pending_delta(db: AsyncSession, user_id):
+    """Undo `_take_pending_delta` when the statement did not apply"""
+
+    taken = db.info.get("score_deltas_taken", [])
+    for entry in [entry for entry in taken if entry[0] == user_id]:
+        taken.remove(entry)
+        delta, events = entry[1], entry[2]
+        score_accumulator.add(user_id, delta, events)
+        for e in events:
+            db.info["score_events"].remove(e)
+
+
+def _sync_user(user: Optional[ShiftUser], row: Mapping[str, Any]):
+    """Copy returned values onto an already loaded user without dirtying it"""
+
+    if user is None:
+        return
+    for key, value in row.items():
+        if key in ShiftUser.__table__.columns:
+            set_committed_value(user, key, value)
+
+
+async def change_score(
+    db: AsyncSession,
+    user_id,
+    delta: int,
+    *,
+    reason: str,
+    min_score: Optional[int] = None,
+    guards: Iterable = (),
+    values: Optional[dict] = None,
+    user: Optional[ShiftUser] = None,
+) -> Optional[ScoreChange]:
+    """Atomically add `delta` to the user's score in a single UPDATE.
+
+    `min_score` is the balance the user must have before the change,
+    `guards` are extra WHERE conditions evaluated against the locked row
+    and `values` extra columns to set in the same statement. Any pending
+    write-behind delta of the user is applied by the same statement.
+    Returns None when no row matched, i.e. the user is missing or a guard
+    failed.
+    """
+
+    values = values or {}
+    pending_delta = _take_pending_delta(db, user_id)
+
+    guards = list(guards)
+    if min_score is not None:
+        guards.append(func.coalesce(ShiftUser.score, 0) + pending_delta >= min_score)
+
+    row = (
+        (
+            await db.execute(
+                update(ShiftUser)
+                .where(ShiftUser.id == user_id, *guards)
+                .values(**_score_values(delta + pending_delta), **values)
+                .returning(
+                    ShiftUser.score,
+                    ShiftUser.max_score,
+                    *(ShiftUser.__table__.c[key] for key in values),
+                )
+                .execution_options(synchronize_session=False)
+            )
+        )
+        .mappings()
+        .first()
+    )
+
+    if row is None:
+        _return_pending_delta(db, user_id)
+        return None
+
+    _sync_user(user, row)
+    record_score_event(db, user_id, delta, reason)
+    queue_score_update(db, user_id, row["score"])
+
+    return ScoreChange(row["score"], row["max_score"], delta)
+
+
+async def add_score(
+    db: AsyncSession,
+    user_id,
+    amount: int,
+    *,
+    reason: str,
+    user: Optional[ShiftUser] = None,
+) -> Optional[ScoreChange]:
+    """Credit `amount` to the user's score"""
+
+    return await change_score(db, user_id, amount, reason=reason, user=user)
+
+
+async def spend_score(
+    db: AsyncSession,
+    user_id,
+    cost: int,
+    *,
+    reason: str,
+    guards: Iterable = (),
+    values: Optional[dict] = None,
+    user: Optional[ShiftUser] = None,
+) -> Optional[ScoreChange]:
+    """Debit `cost` from the user's score if it is large enough"""
+
+    return await change_score(
+        db,
+        user_id,
+        -cost,
+        reason=reason,
+        min_score=cost,
+        guards=guards,
+        values=values,
+        user=user,
+    )
+
+
+async def claim_pending_score(
+    db: AsyncSession,
+    user_id,
+    column,
+    *,
+    reason: str,
+    deferred: bool = False,
+    user: Optional[ShiftUser] = None,
+) -> Optional[ScoreChange]:
+    """Move a pending balance column (e.g. `reward`) into the score.
+
+    The old balance is read under a row lock in a subquery of the same
+    UPDATE, credited to the score and the column reset to 0. The moved
+    amount is returned as `ScoreChange.amount`.
+
+    With `deferred` and write-behind enabled only the column is reset here;
+    the credit goes to the accumulator on commit and the returned score
+    already includes it.
+    """
+
+    pending = (
+        select(ShiftUser.id, func.coalesce(column, 0).label("amount"))
+        .where(ShiftUser.id == user_id)
+        .with_for_update()
+        .subquery()
+    )
+
+    if deferred and score_accumulator.enabled:
+        return await _claim_pending_score_deferred(db, user_id, column, pending, reason)
+
+    row = (
+        (
+            await db.execute(
+                update(ShiftUser)
+                .where(ShiftUser.id == pending.c.id)
+                .values(**_score_values(pending.c.amount), **{column.key: 0})
+                .returning(ShiftUser.score, ShiftUser.max_score, pending.c.amount)
+                .execution_options(synchronize_session=False)
+            )
+        )
+        .mappings()
+        .first()
+    )
+
+    if row is None:
+        return None
+
+    _sync_user(user, {"score": row["score"], "max_score": row["max_score"]})
+    if user is not None:
+        set_committed_value(user, column.key, 0)
+    record_score_event(db, user_id, row["amount"], reason)
+    queue_score_update(db, user_id, row["score"])
+
+    return ScoreChange(row["score"], row["max_score"], row["amount"])
+
+
+async def _claim_pending_score_deferred(
+    db: AsyncSession, user_id, column, pending, reason: str
+) -> Optional[ScoreChange]:
+    row = (
+        (
+            await db.execute(
+                update(ShiftUser)
+                .where(ShiftUser.id == pending.c.id)
+                .values({column.key: 0})
+                .returning(ShiftUser.score, ShiftUser.max_score, pending.c.amount)
+                .execution_options(synchronize_session=False)
+            )
+        )
+        .mappings()
+        .first()
+    )
+
+    if row is None:
+        return None
+
+    return _defer_credit(db, user_id, row["amount"], reason, row)
+
+
+def _defer_credit(
+    db: AsyncSession, user_id, amount: int, reason: str, row: Mapping[str, Any]
+) -> ScoreChange:
+    """Queue `amount` for the accumulator on commit.
+
+    `row` holds the score as just read from the database; the returned
+    score adds everything still buffered for the user.
+    """
+
+    if amount:
+        db.info.setdefault("score_deltas", []).append(
+            (user_id, amount, [_score_event(user_id, amount, reason)])
+        )
+
+    score = (row["score"] or 0) + score_accumulator.pending(user_id) + amount
+    queue_score_update(db, user_id, score)
+
+    return ScoreChange(score, max(row["max_score"] or 0, score), amount)
+
+
+async def credit_score(
+    db: AsyncSession,
+    user_id,
+    amount: int,
+    *,
+    reason: str,
+    guards: Iterable = (),
+    values: Optional[dict] = None,
+    deferred: bool = False,
+    user: Optional[ShiftUser] = None,
+) -> Optional[ScoreChange]:
+    """Credit `amount` and set `values`, if the `guards` hold.
+
+    Like `change_score`, but with `deferred` and write-behind enabled only
+    `values` are written here and the credit goes to the accumulator on
+    commit, as in `claim_pending_score`.
+    """
+
+    if not (deferred and score_accumulator.enabled):
+        return await change_score(
+            db, user_id, amount, reason=reason, guards=guards, values=values, user=user
+        )
+
+    values = values or {}
+    row = (
+        (
+            await db.execute(
+                update(ShiftUser)
+                .where(ShiftUser.id == user_id, *guards)
+                .values(**values)
+                .returning(
+                    ShiftUser.score,
+                    ShiftUser.max_score,
+                    *(ShiftUser.__table__.c[key] for key in values),
+                )
+                .execution_options(synchronize_session=False)
+            )
+        )
+        .mappings()
+        .first()
+    )
+
+    if row is None:
+        return None
+
+    _sync_user(user, {key: row[key] for key in values})
+
+    return _defer_credit(db, user_id, amount, reason, row)
@@ -0,0 +1,38 @@
+from typing import Any, List
+from uuid import UUID
+
+import orjson
+from fastapi.responses import ORJSONResponse
+from pydantic import TypeAdapter
+
+from schemas import QuestWithProgressResponse, SkinResponse, UserResponse
+
+# Built once at import; building an adapter compiles its serializer
+user_adapter = TypeAdapter(UserResponse)
+skins_adapter = TypeAdapter(List[SkinResponse])
+quests_adapter = TypeAdapter(List[QuestWithProgressResponse])
+
+
+def _default(value):
+    # asyncpg returns its own UUID subclass, which orjson does not encode
+    if isinstance(value, UUID):
+        return str(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+class FastJSONResponse(ORJSONResponse):
+    """orjson response that also encodes the values asyncpg returns"""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def trusted_response(adapter: TypeAdapter, value) -> FastJSONResponse:
+    """Serialize data we built ourselves without validating it again.
+
+    Returning a Response makes FastAPI skip the `response_model` round of
+    validation and `jsonable_encoder`; the adapter dumps to Python objects
+    and orjson encodes them.
+    """
+
+    return FastJSONResponse(adapter.dump_python(value))
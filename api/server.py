@@ -0,0 +1,39 @@
+import uvicorn
+
+from settings import server_settings
+
+
+def run():
+    """Run the API with the production settings from `API_*` variables.
+
+    Workers are separate processes, each running the app lifespan, so every
+    worker warms its own pool and caches before it accepts connections. On
+    SIGTERM uvicorn stops accepting, waits up to `graceful_shutdown_timeout`
+    seconds for in-flight requests and then runs the shutdown half of the
+    lifespan, which flushes buffered score changes.
+    """
+
+    settings = server_settings
+    options = {}
+    if settings.tls:
+        options["ssl_certfile"] = str(settings.ssl_certfile)
+        options["ssl_keyfile"] = str(settings.ssl_keyfile)
+
+    uvicorn.run(
+        "main:app",
+        host=settings.host,
+        port=settings.port,
+        workers=None if settings.reload else settings.workers,
+        reload=settings.reload,
+        loop=settings.loop,
+        http=settings.http,
+        log_level=settings.log_level,
+        timeout_graceful_shutdown=settings.graceful_shutdown_timeout,
+        proxy_headers=True,
+        forwarded_allow_ips=settings.forwarded_allow_ips,
+        **options,
+    )
+
+
+if __name__ == "__main__":
+    run()
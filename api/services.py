@@ -1,70 +1,93 @@
-from schemas import SkinResponse
-from datetime import datetime, timedelta
-from typing import Type, Optional
-from sqlalchemy.orm import Session
-from models import ShiftUser, UserStatus, UserSkin, Skin
+from schemas import (
+    UserData,
+    UserResponse,
+    LeaderboardEntryResponse,
+    StatusResponse,
+    SubtaskResponse,
+    QuestWithProgressResponse,
+)
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import date, datetime, timedelta
+from typing import Literal, Optional, List
+from uuid import UUID
+from sqlalchemy import inspect, select, update, func, and_, union
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+from models import (
+    AsyncSessionLocal,
+    ShiftUser,
+    UserSkin,
+    Referral,
+    Quest,
+    Subtask,
+    UserQuest,
+    UserSubtask,
+)
+from scores import (
+    add_score,
+    spend_score,
+    queue_score_update,
+    record_score_event,
+    REASON_DAILY_DROP,
+    REASON_LEVEL_UPGRADE,
+    REASON_SIGNUP_BONUS,
+    REASON_SKIN_PURCHASE,
+)
+from tiers import Tier, current_tiers, get_tiers
+from catalog import CatalogSkin, current_catalog
+from rollover import roll_over_user, utc_day
+from gamebot import gamebot_accrual, start_gamebot_cycle
+from leaderboard import leaderboard
+from writebehind import score_accumulator
+from singleflight import SingleFlight
 import random
 
+REFERRAL_REWARD = 1000
+MAX_REFERRALS = 150
 
-def update_days_in_row(
-    db_user: ShiftUser, auth_date: datetime.date, is_days_shown: bool, db: Session
-) -> bool:
-    """Update the counter for the user's consecutive login days"""
+# Column attributes of a user, i.e. everything but the loaded relationships
+USER_COLUMNS = [attr.key for attr in inspect(ShiftUser).column_attrs]
 
-    last_login = (
-        datetime.fromtimestamp(db_user.auth_date).date() if db_user.auth_date else None
-    )
+logins = SingleFlight()
 
-    is_days_dropped = False
 
-    if last_login:
-        if auth_date == last_login:
-            pass
-        elif auth_date == last_login + timedelta(days=1):
-            db_user.days_in_row += 1
-        else:
-            db_user.days_in_row = 1
-            is_days_dropped = True
+async def update_days_in_row(db_user: ShiftUser, today: date, db: AsyncSession) -> dict:
+    """Count the user's first login of the UTC day `today` in the streak.
 
-    reward = None
+    Missed days were already handled by the rollover (rollover.py), so the
+    streak only grows here. Changes are left in the session for the caller
+    to commit.
+    """
 
-    if is_days_shown is False:
-        reward = give_reward_for_consecutive_days(db_user, db)
+    last_login = utc_day(db_user.auth_date) if db_user.auth_date else None
+    if last_login == today - timedelta(days=1):
+        db_user.days_in_row += 1
+
+    reward = await give_reward_for_consecutive_days(db_user, db)
 
     if db_user.days_in_row > 2:
         db_user.days_in_row = 1
-        is_days_dropped = True
+        db_user.is_days_dropped = True
 
     d = dict()
-    d["is_days_dropped"] = is_days_dropped
+    d["is_days_dropped"] = db_user.is_days_dropped
     d["reward"] = reward
 
     return d
 
 
-def get_user_status(db_user: ShiftUser, db: Session) -> Type[UserStatus]:
-    """Get the current status of the user based on his score."""
-
-    current_level_data = (
-        db.query(UserStatus).filter(UserStatus.level == db_user.current_level).first()
-    )
-
-    if current_level_data is None:
-        current_level_data = (
-            db.query(UserStatus).order_by(UserStatus.level.desc()).first()
-        )
+def get_user_status(db_user: ShiftUser) -> Tier:
+    """Get the current status of the user based on his level."""
 
-    return current_level_data
+    return get_tiers().for_level(db_user.current_level)
 
 
-def calculate_score_to_next_level(db_user: ShiftUser, db: Session) -> int:
+def calculate_score_to_next_level(db_user: ShiftUser) -> int:
     """Calculate how many score/XP is needed to reach the next level."""
 
-    next_level_data = (
-        db.query(UserStatus)
-        .filter(UserStatus.level == db_user.current_level + 1)
-        .first()
-    )
+    next_level_data = get_tiers().next_after(db_user.current_level)
 
     if not next_level_data:
         return 0
@@ -76,33 +99,65 @@ def calculate_score_to_next_level(db_user: ShiftUser, db: Session) -> int:
     )
 
 
-def purchase_skin_with_xp(user: ShiftUser, skin: Type[Skin], db: Session) -> dict:
-    if user.max_score >= skin.open_from:
-        if user.score >= skin.required_xp:
-            user.score -= skin.required_xp
-            user_skin = UserSkin(user_id=user.id, skin_id=skin.id)
-            db.add(user_skin)
-            db.commit()
-            db.refresh(user)
-            d = dict()
-            d["skin"] = skin
-            d["success"] = True
-            d["score"] = user.score
-            return d
+def get_status_data(db_user: ShiftUser) -> StatusResponse:
+    """Build the status block of the user from the tier table."""
+
+    user_status = get_user_status(db_user)
+    next_level_data = get_tiers().next_after(db_user.current_level)
+
+    return StatusResponse.model_construct(
+        status_name=user_status.status_name,
+        level=user_status.level,
+        energy_limit=user_status.energy_limit,
+        nitro=user_status.nitro,
+        recharging_speed=user_status.recharging_speed,
+        coin_farming=user_status.coin_farming,
+        gamebot=user_status.gamebot,
+        fractal=user_status.fractal,
+        points_to_next_level=calculate_score_to_next_level(db_user),
+        xp_to_upgrade=next_level_data.xp_to_upgrade if next_level_data else None,
+        ton_to_upgrade=next_level_data.ton_to_upgrade if next_level_data else None,
+        upgrade_available=(
+            db_user.max_score >= next_level_data.start_score
+            if next_level_data
+            else False
+        ),
+    )
+
+
+async def purchase_skin_with_xp(
+    user: ShiftUser, skin: CatalogSkin, db: AsyncSession
+) -> dict:
+    change = await spend_score(
+        db,
+        user.id,
+        skin.required_xp,
+        reason=REASON_SKIN_PURCHASE,
+        guards=[ShiftUser.max_score >= skin.open_from],
+        user=user,
+    )
+    if change:
+        user_skin = UserSkin(user_id=user.id, skin_id=skin.id)
+        db.add(user_skin)
+        await db.commit()
+        d = dict()
+        d["skin"] = skin
+        d["success"] = True
+        d["score"] = user.score
+        return d
     d = dict()
     d["success"] = False
     d["score"] = user.score
     return d
 
 
-def purchase_skin_with_ton(
-    user: ShiftUser, skin: Type[Skin], db: Session, check_str: str
+async def purchase_skin_with_ton(
+    user: ShiftUser, skin: CatalogSkin, db: AsyncSession, check_str: str
 ) -> dict:
     if check_str:
         user_skin = UserSkin(user_id=user.id, skin_id=skin.id)
         db.add(user_skin)
-        db.commit()
-        db.refresh(user)
+        await db.commit()
         d = dict()
         d["skin"] = skin
         d["success"] = True
@@ -114,40 +169,45 @@ def purchase_skin_with_ton(
     return d
 
 
-def upgrade_user_level(user: ShiftUser, boc: str, db: Session) -> bool:
+async def upgrade_user_level(user: ShiftUser, boc: str, db: AsyncSession) -> bool:
     """Upgrade user to the next level if eligible and deduct XP."""
 
-    current_level_data = (
-        db.query(UserStatus).filter(UserStatus.level == user.current_level).first()
-    )
-    next_level_data = (
-        db.query(UserStatus).filter(UserStatus.level == user.current_level + 1).first()
-    )
+    tiers = await current_tiers()
+    current_level_data = tiers.for_level(user.current_level)
+    next_level_data = tiers.next_after(user.current_level)
 
     if user.max_score >= current_level_data.end_score and next_level_data:
-        xp_cost = next_level_data.xp_to_upgrade
-
-        if boc is not None:
-            user.current_level += 1
-            db.commit()
-            db.refresh(user)
-            return True
+        xp_cost = 0 if boc is not None else next_level_data.xp_to_upgrade
 
-        if user.score >= xp_cost:
-            user.score -= xp_cost
-            user.current_level += 1
+        if user.score < xp_cost:
+            raise ValueError("Not enough XP to upgrade")
 
-            db.commit()
-            db.refresh(user)
+        # Guarding on the current level keeps concurrent upgrades from
+        # skipping a level or charging twice
+        change = await spend_score(
+            db,
+            user.id,
+            xp_cost,
+            reason=REASON_LEVEL_UPGRADE,
+            guards=[
+                ShiftUser.current_level == user.current_level,
+                ShiftUser.max_score >= current_level_data.end_score,
+            ],
+            values={"current_level": ShiftUser.current_level + 1},
+            user=user,
+        )
+        if change is None:
+            return False
 
-            return True
-        else:
-            raise ValueError("Not enough XP to upgrade")
+        await db.commit()
+        return True
     else:
         return False
 
 
-def give_reward_for_consecutive_days(db_user: ShiftUser, db: Session) -> Optional[dict]:
+async def give_reward_for_consecutive_days(
+    db_user: ShiftUser, db: AsyncSession
+) -> Optional[dict]:
     """Give the user a reward (XP or skin) if they've logged in for 7 consecutive days."""
 
     if db_user.days_in_row != 2:
@@ -159,8 +219,9 @@ def give_reward_for_consecutive_days(db_user: ShiftUser, db: Session) -> Optiona
 
     if reward_type == "xp":
         xp_reward = 1000
-        db_user.score += xp_reward
-        db.commit()
+        await add_score(
+            db, db_user.id, xp_reward, reason=REASON_DAILY_DROP, user=db_user
+        )
         d["type"] = "xp"
         d["amount"] = xp_reward
         d["new_score"] = db_user.score
@@ -168,27 +229,437 @@ def give_reward_for_consecutive_days(db_user: ShiftUser, db: Session) -> Optiona
         return d
 
     elif reward_type == "skin":
-        droppable_skins = db.query(Skin).filter(Skin.is_droppable == True).all()
-        owned_skin_ids = {skin.skin_id for skin in db_user.purchased_skins}
-        available_skins = [
-            skin for skin in droppable_skins if skin.id not in owned_skin_ids
-        ]
+        catalog = await current_catalog()
+        owned = catalog.ownership_mask(skin.skin_id for skin in db_user.purchased_skins)
+        available_skins = catalog.droppable(owned)
         if available_skins:
             dropped_skin = random.choice(available_skins)
 
             new_user_skin = UserSkin(user_id=db_user.id, skin_id=dropped_skin.id)
             db.add(new_user_skin)
-            db.commit()
             d["type"] = "skin"
-            d["skin"] = SkinResponse.from_orm(dropped_skin).dict()
+            d["skin"] = catalog.response(dropped_skin).dict()
             return d
         else:
             xp_reward = 1000
-            db_user.score += xp_reward
-            db.commit()
+            await add_score(
+                db, db_user.id, xp_reward, reason=REASON_DAILY_DROP, user=db_user
+            )
             d["type"] = "xp"
             d["amount"] = xp_reward
             d["new_score"] = db_user.score
             return d
 
     return None
+
+
+async def credit_referrer(referrer: ShiftUser, db: AsyncSession) -> bool:
+    """Count a new referral for the referrer unless the referral cap is reached.
+
+    The cap check and the counter update happen in one guarded UPDATE, so
+    concurrent signups cannot push the referrer past `MAX_REFERRALS`.
+    """
+
+    credited_id = await db.scalar(
+        update(ShiftUser)
+        .where(
+            ShiftUser.id == referrer.id,
+            ShiftUser.referral_count < MAX_REFERRALS,
+        )
+        .values(
+            referral_count=ShiftUser.referral_count + 1,
+            referral_reward_total=ShiftUser.referral_reward_total + REFERRAL_REWARD,
+            reward=ShiftUser.reward + REFERRAL_REWARD,
+        )
+        .returning(ShiftUser.id)
+        .execution_options(synchronize_session=False)
+    )
+
+    return credited_id is not None
+
+
+async def create_user(
+    user_data: UserData, referrer_id: Optional[str], today: date, db: AsyncSession
+) -> Optional[ShiftUser]:
+    """Register a new user with INSERT ... ON CONFLICT (tg_id) DO NOTHING.
+
+    Returns None when a concurrent login registered the same Telegram user
+    first; the caller loads that user instead. Changes are left in the
+    session for the caller to commit.
+    """
+
+    referrer = None
+    if referrer_id:
+        referrer = await db.scalar(
+            select(ShiftUser).where(ShiftUser.tg_id == referrer_id)
+        )
+
+    initial_score = 1000 if referrer else 0
+
+    db_user = await db.scalar(
+        insert(ShiftUser)
+        .values(
+            tg_id=user_data.tg_id,
+            first_name=user_data.first_name,
+            last_name=user_data.last_name,
+            username=user_data.username,
+            is_premium=user_data.is_premium,
+            tg_image=user_data.tg_image,
+            days_in_row=1,
+            auth_date=user_data.auth_date,
+            gamebot_started_at=user_data.auth_date,
+            register_date=datetime.fromtimestamp(user_data.auth_date),
+            is_days_shown=False,
+            rollover_day=today,
+            score=initial_score,
+            max_score=initial_score,
+        )
+        .on_conflict_do_nothing(index_elements=[ShiftUser.tg_id])
+        .returning(ShiftUser)
+    )
+    if db_user is None:
+        return None
+
+    # A new user has none of these, so there is nothing to load
+    for collection in ("referrals_made", "referrals_received", "purchased_skins"):
+        set_committed_value(db_user, collection, [])
+
+    record_score_event(db, db_user.id, initial_score, REASON_SIGNUP_BONUS)
+    queue_score_update(db, db_user.id, initial_score)
+
+    if referrer and await credit_referrer(referrer, db):
+        db_user.referrals_received.append(Referral(referrer=referrer))
+
+    return db_user
+
+
+def encode_referral_cursor(referral: Referral) -> str:
+    """Opaque keyset cursor pointing right after the given referral"""
+
+    raw = f"{referral.created_at.isoformat()}|{referral.id}"
+    return urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_referral_cursor(cursor: str) -> tuple[datetime, UUID]:
+    """Inverse of `encode_referral_cursor`, raises ValueError if malformed"""
+
+    try:
+        created_at, referral_id = urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), UUID(referral_id)
+    except (UnicodeDecodeError, TypeError, ValueError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+async def get_quests_with_progress(
+    user: ShiftUser, db: AsyncSession
+) -> List[QuestWithProgressResponse]:
+    """Active quests with the user's progress.
+
+    Runs a fixed number of queries however many quests there are: the active
+    quests with their subtasks, then the user's quest and subtask progress
+    rows, which are merged in a single pass. Progress is stored sparsely, a
+    missing row means "not started", so this never writes.
+    """
+
+    now = datetime.utcnow()
+    active_quest_ids = select(Quest.id).where(Quest.valid_by >= now)
+
+    quests = (
+        await db.scalars(
+            select(Quest)
+            .where(Quest.valid_by >= now)
+            .options(selectinload(Quest.subtasks))
+        )
+    ).all()
+
+    user_quest_map = {
+        user_quest.quest_id: user_quest
+        for user_quest in await db.scalars(
+            select(UserQuest).where(
+                UserQuest.user_id == user.id,
+                UserQuest.quest_id.in_(active_quest_ids),
+            )
+        )
+    }
+    user_subtask_map = {
+        user_subtask.subtask_id: user_subtask
+        for user_subtask in await db.scalars(
+            select(UserSubtask)
+            .join(Subtask, Subtask.id == UserSubtask.subtask_id)
+            .where(
+                UserSubtask.user_id == user.id,
+                Subtask.quest_id.in_(active_quest_ids),
+            )
+        )
+    }
+
+    quest_responses = []
+
+    for quest in quests:
+        user_quest = user_quest_map.get(quest.id)
+
+        completed_subtasks = 0
+        subtask_responses = []
+        for subtask in quest.subtasks:
+            user_subtask = user_subtask_map.get(subtask.id)
+            completed = bool(user_subtask and user_subtask.completed)
+
+            if completed:
+                completed_subtasks += 1
+
+            subtask_responses.append(
+                SubtaskResponse.model_construct(
+                    id=subtask.id,
+                    name=subtask.name,
+                    description=subtask.description,
+                    reward=subtask.reward,
+                    completed=completed,
+                    reward_claimed=bool(user_subtask and user_subtask.reward_claimed),
+                    link=subtask.link,
+                )
+            )
+
+        quest_responses.append(
+            QuestWithProgressResponse.model_construct(
+                id=quest.id,
+                name=quest.name,
+                description=quest.description,
+                reward=quest.reward,
+                completed=len(quest.subtasks) == completed_subtasks,
+                reward_claimed=bool(user_quest and user_quest.reward_claimed),
+                valid_by=quest.valid_by,
+                total_subtasks=len(quest.subtasks),
+                completed_subtasks=completed_subtasks,
+                subtasks=subtask_responses,
+            )
+        )
+
+    return quest_responses
+
+
+async def count_subtask_progress(
+    user_id, quest_id, db: AsyncSession
+) -> tuple[int, int]:
+    """Total and completed subtasks of a quest for the user, in one query"""
+
+    total_subtasks, completed_subtasks = (
+        await db.execute(
+            select(func.count(Subtask.id), func.count(UserSubtask.id))
+            .select_from(Subtask)
+            .outerjoin(
+                UserSubtask,
+                and_(
+                    UserSubtask.subtask_id == Subtask.id,
+                    UserSubtask.user_id == user_id,
+                    UserSubtask.completed == True,
+                ),
+            )
+            .where(Subtask.quest_id == quest_id)
+        )
+    ).one()
+
+    return total_subtasks, completed_subtasks
+
+
+async def mark_subtask_completed(user_id, subtask_id, db: AsyncSession) -> bool:
+    """Create or complete the user's progress row, returns `reward_claimed`"""
+
+    return await db.scalar(
+        insert(UserSubtask)
+        .values(
+            user_id=user_id,
+            subtask_id=subtask_id,
+            completed=True,
+            reward_claimed=False,
+        )
+        .on_conflict_do_update(
+            index_elements=[UserSubtask.user_id, UserSubtask.subtask_id],
+            set_={"completed": True},
+        )
+        .returning(UserSubtask.reward_claimed)
+    )
+
+
+async def mark_quest_reward_claimed(user_id, quest_id, db: AsyncSession) -> bool:
+    """Record the quest reward as claimed.
+
+    Returns False if it had already been claimed, so a reward cannot be
+    claimed twice by concurrent requests.
+    """
+
+    claimed_id = await db.scalar(
+        insert(UserQuest)
+        .values(
+            user_id=user_id,
+            quest_id=quest_id,
+            completed=True,
+            reward_claimed=True,
+        )
+        .on_conflict_do_update(
+            index_elements=[UserQuest.user_id, UserQuest.quest_id],
+            set_={"completed": True, "reward_claimed": True},
+            where=UserQuest.reward_claimed.isnot(True),
+        )
+        .returning(UserQuest.id)
+    )
+
+    return claimed_id is not None
+
+
+async def get_friend_ids(user_id, db: AsyncSession) -> List[UUID]:
+    """The user's referrer and the users they referred"""
+
+    return (
+        await db.scalars(
+            union(
+                select(Referral.referred_user_id).where(
+                    Referral.referrer_id == user_id
+                ),
+                select(Referral.referrer_id).where(
+                    Referral.referred_user_id == user_id
+                ),
+            )
+        )
+    ).all()
+
+
+async def get_leaderboard_entries(
+    entries: List[tuple], db: AsyncSession
+) -> List[LeaderboardEntryResponse]:
+    """Attach profiles to `(rank, user_id, score)` leaderboard entries"""
+
+    if not entries:
+        return []
+
+    profiles = {
+        profile.id: profile
+        for profile in await db.execute(
+            select(
+                ShiftUser.id,
+                ShiftUser.first_name,
+                ShiftUser.last_name,
+                ShiftUser.username,
+                ShiftUser.tg_image,
+            ).where(ShiftUser.id.in_([user_id for _, user_id, _ in entries]))
+        )
+    }
+
+    return [
+        LeaderboardEntryResponse(
+            rank=rank,
+            id=str(user_id),
+            first_name=profiles[user_id].first_name,
+            last_name=profiles[user_id].last_name,
+            username=profiles[user_id].username,
+            tg_image=profiles[user_id].tg_image,
+            score=score,
+        )
+        for rank, user_id, score in entries
+        # Users deleted since the last refresh
+        if user_id in profiles
+    ]
+
+
+async def login_user(
+    user_data: UserData,
+    referrer_id: Optional[str] = None,
+    referrals: Literal["full", "summary"] = "full",
+) -> UserResponse:
+    """Register the user or log them in; identical concurrent logins share one run"""
+
+    return await logins.do(
+        (user_data.model_dump_json(), referrer_id, referrals),
+        _login_user,
+        user_data,
+        referrer_id,
+        referrals == "full",
+    )
+
+
+async def _login_user(
+    user_data: UserData, referrer_id: Optional[str], include_referred_users: bool
+) -> UserResponse:
+    load_options = [
+        selectinload(ShiftUser.referrals_received).joinedload(
+            Referral.referrer, innerjoin=True
+        ),
+        selectinload(ShiftUser.purchased_skins),
+    ]
+    if include_referred_users:
+        load_options.append(
+            selectinload(ShiftUser.referrals_made).joinedload(
+                Referral.referred_user, innerjoin=True
+            )
+        )
+    user_query = (
+        select(ShiftUser)
+        .where(ShiftUser.tg_id == user_data.tg_id)
+        .options(*load_options)
+    )
+
+    today = utc_day(user_data.auth_date)
+
+    days_row = dict()
+    days_row["is_days_dropped"] = False
+
+    # Picks up edits of `user_statuses` in every worker
+    await current_tiers()
+
+    async with AsyncSessionLocal() as db:
+        db_user = await db.scalar(user_query)
+
+        is_new_user = False
+        if db_user is None:
+            db_user = await create_user(user_data, referrer_id, today, db)
+            if db_user is None:
+                # Registered by a concurrent login in another worker
+                db_user = await db.scalar(user_query)
+            else:
+                is_new_user = True
+
+        if not is_new_user:
+            is_first_login = utc_day(db_user.auth_date) < today
+            if is_first_login:
+                # Only the first login of a day writes the day state, so lock
+                # the row and look again in case a concurrent login did it
+                await db.refresh(db_user, USER_COLUMNS, with_for_update=True)
+                is_first_login = utc_day(db_user.auth_date) < today
+
+            if is_first_login:
+                if db_user.rollover_day is None or db_user.rollover_day < today:
+                    # The rollover job has not reached this user yet
+                    roll_over_user(db_user, today)
+
+                days_row = await update_days_in_row(db_user, today, db)
+                start_gamebot_cycle(db_user, user_data.auth_date)
+                db_user.auth_date = user_data.auth_date
+            else:
+                # The first login of the day has shown the daily popup
+                db_user.is_days_shown = True
+
+            # Unchanged values are not written, so a repeated login is read-only
+            db_user.first_name = user_data.first_name
+            db_user.last_name = user_data.last_name
+
+            db_user.username = user_data.username
+            db_user.is_premium = user_data.is_premium
+            db_user.tg_image = user_data.tg_image
+
+        await db.commit()
+
+        rank = await leaderboard.lookup_rank(db, db_user.id)
+
+    status_data = get_status_data(db_user)
+
+    response = UserResponse.response_(
+        db_user,
+        status_data,
+        days_row,
+        include_referred_users,
+        gamebot=gamebot_accrual(db_user),
+    )
+    # Read-your-writes for score credits still in the write-behind buffer
+    response.score += score_accumulator.pending(db_user.id)
+    response.rank = rank
+
+    return response
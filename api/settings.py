@@ -0,0 +1,107 @@
+from pathlib import Path
+from typing import Literal, Optional
+from uuid import uuid4
+
+from dotenv import load_dotenv
+from pydantic import Field
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+load_dotenv()
+
+SSL_DIR = Path(__file__).resolve().parent.parent / "ssl"
+
+
+def _prepared_statement_name() -> str:
+    # Unique names, so statements never collide on a pooled server connection
+    return f"__asyncpg_{uuid4()}__"
+
+
+class DatabaseSettings(BaseSettings):
+    """Connection pool settings, read from `DB_*` environment variables.
+
+    `DB_POOLER_MODE=transaction` is the preset for Supabase's transaction
+    pooler (port 6543) or pgbouncer in transaction mode: server connections
+    are shared between clients per transaction, so prepared statements must
+    not outlive a statement and no session state may be relied upon.
+
+    With `DB_MAX_CONNECTIONS` set, that connection budget is split evenly
+    between the `WEB_CONCURRENCY` worker processes instead of using
+    `DB_POOL_SIZE` and `DB_MAX_OVERFLOW` as is.
+    """
+
+    model_config = SettingsConfigDict(env_prefix="DB_", extra="ignore")
+
+    pooler_mode: Literal["session", "transaction"] = "session"
+    pool_size: int = 5
+    max_overflow: int = 10
+    pool_timeout: float = 30
+    pool_recycle: int = 1800
+    # The asyncpg ping is BEGIN; ROLLBACK, three round trips per checkout
+    # through a pooler. Stale connections are retired by `pool_recycle`
+    # instead, and a connection that fails mid-request is invalidated.
+    pool_pre_ping: bool = False
+    statement_cache_size: int = 100
+    max_connections: Optional[int] = None
+    workers: int = Field(1, validation_alias="WEB_CONCURRENCY")
+
+    @property
+    def worker_pool_size(self) -> int:
+        if self.max_connections is None:
+            return self.pool_size
+        return max(1, self.max_connections // max(1, self.workers))
+
+    @property
+    def worker_max_overflow(self) -> int:
+        # A fixed budget leaves no room for overflow connections
+        return self.max_overflow if self.max_connections is None else 0
+
+    def engine_options(self) -> dict:
+        """Keyword arguments for `create_async_engine`"""
+
+        return {
+            "pool_size": self.worker_pool_size,
+            "max_overflow": self.worker_max_overflow,
+            "pool_timeout": self.pool_timeout,
+            "pool_recycle": self.pool_recycle,
+            "pool_pre_ping": self.pool_pre_ping,
+            "connect_args": self.connect_args(),
+        }
+
+    def connect_args(self) -> dict:
+        if self.pooler_mode == "transaction":
+            return {
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0,
+                "prepared_statement_name_func": _prepared_statement_name,
+            }
+        return {
+            "statement_cache_size": self.statement_cache_size,
+            "prepared_statement_cache_size": self.statement_cache_size,
+        }
+
+
+db_settings = DatabaseSettings()
+
+
+class ServerSettings(BaseSettings):
+    """Launcher settings for server.py, read from `API_*` environment variables"""
+
+    model_config = SettingsConfigDict(env_prefix="API_", extra="ignore")
+
+    host: str = "0.0.0.0"
+    port: int = 8000
+    workers: int = Field(1, validation_alias="WEB_CONCURRENCY")
+    loop: str = "uvloop"
+    http: str = "httptools"
+    tls: bool = False
+    ssl_certfile: Path = SSL_DIR / "cert.pem"
+    ssl_keyfile: Path = SSL_DIR / "key.pem"
+    graceful_shutdown_timeout: int = 30
+    log_level: str = "info"
+    reload: bool = False
+    # Proxies whose X-Forwarded-For is trusted for the client address, which
+    # rate limits count against without auth; "*" trusts every peer
+    forwarded_allow_ips: str = "127.0.0.1"
+
+
+server_settings = ServerSettings()
@@ -0,0 +1,37 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one execution.
+
+    The first caller starts the call in a task, callers arriving while it
+    runs wait for that task and get the same result or exception. The task
+    is shielded, so a caller that goes away does not cancel the call for
+    the others. Nothing is cached: the key is released when the call ends.
+    """
+
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(
+        self, key: Hashable, fn: Callable[..., Awaitable[T]], *args, **kwargs
+    ) -> T:
+        task = self._calls.get(key)
+        if task is None or task.done():
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._release(key, done))
+        return await asyncio.shield(task)
+
+    def _release(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Retrieved here too, in case every caller has gone away
+            task.exception()
@@ -0,0 +1,62 @@
+import time
+from typing import Awaitable, Callable, Generic, TypeVar
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import AsyncSessionLocal
+from singleflight import SingleFlight
+
+T = TypeVar("T")
+
+
+class Snapshot(Generic[T]):
+    """In-process copy of a small, rarely edited table.
+
+    `read` builds an immutable value from the table. The value is replaced
+    as a whole on every load, so readers get it with `get()` and never see
+    a half-loaded one. Loads are counted in `version`, 0 before the first.
+
+    `current()` reloads the value once it is older than `ttl` seconds,
+    which is how edits reach every worker. Concurrent reloads share one
+    query on a session of their own.
+    """
+
+    def __init__(
+        self, read: Callable[[AsyncSession], Awaitable[T]], empty: T, ttl: float
+    ):
+        self.read = read
+        self.ttl = ttl
+        self.version = 0
+        self.loaded_at = 0.0
+        self._value = empty
+        self._reloads = SingleFlight()
+
+    def get(self) -> T:
+        """Currently loaded value, possibly stale"""
+
+        return self._value
+
+    async def load(self, db: AsyncSession) -> T:
+        """Read the table with `db` and make the result current"""
+
+        value = await self.read(db)
+        self._value = value
+        self.version += 1
+        self.loaded_at = time.monotonic()
+        return value
+
+    async def reload(self) -> T:
+        """Load the table again, sharing a reload already under way"""
+
+        return await self._reloads.do(None, self._reload)
+
+    async def current(self) -> T:
+        """Current value, loaded on first use and once older than `ttl`"""
+
+        if not self.version or time.monotonic() - self.loaded_at >= self.ttl:
+            return await self.reload()
+        return self._value
+
+    async def _reload(self) -> T:
+        async with AsyncSessionLocal() as db:
+            return await self.load(db)
@@ -0,0 +1,53 @@
+"""Requests per second through an app with and without TelegramAuthMiddleware.
+
+Drives a one-route app over httpx's ASGITransport, so the numbers are the
+middleware's own cost without sockets or a database. Run from api/:
+
+    python -m tests.bench_auth_middleware [--requests 3000] [--rounds 3]
+"""
+
+import argparse
+import asyncio
+import time
+
+import httpx
+from starlette.applications import Starlette
+from starlette.routing import Route
+
+from middleware import TelegramAuthMiddleware
+from tests.test_auth_middleware import BOT_TOKEN, init_data, whoami
+
+
+def make_app(auth: bool):
+    app = Starlette(routes=[Route("/me", whoami)])
+    if auth:
+        return TelegramAuthMiddleware(app, telegram_bot_token=BOT_TOKEN)
+    return app
+
+
+async def requests_per_second(app, requests: int) -> float:
+    headers = {"Authorization": f"tma {init_data()}"}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+        response = await c.get("/me", headers=headers)
+        response.raise_for_status()
+
+        started_at = time.perf_counter()
+        await asyncio.gather(*(c.get("/me", headers=headers) for _ in range(requests)))
+        return requests / (time.perf_counter() - started_at)
+
+
+async def main(args: argparse.Namespace):
+    for label, auth in (("without auth", False), ("with auth", True)):
+        rates = [
+            await requests_per_second(make_app(auth), args.requests)
+            for _ in range(args.rounds)
+        ]
+        print(f"{label:<13} {max(rates):8.0f} req/s (best of {args.rounds})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--rounds", type=int, default=3)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,145 @@
+"""CPU per response body, the `response_model` path against trusted_response.
+
+The payloads are built in memory, shaped like a login with referrals, the
+skin catalog and the quest list. Run from api/:
+
+    python -m tests.bench_serialization [--number 2000] [--referrals 20]
+"""
+
+import argparse
+import timeit
+from datetime import datetime
+from uuid import uuid4
+
+from schemas import (
+    QuestWithProgressResponse,
+    ReferralResponse,
+    SkinResponse,
+    StatusResponse,
+    UserResponse,
+)
+from serialization import quests_adapter, skins_adapter, trusted_response, user_adapter
+from tests.test_serialization import legacy_body
+
+
+def person(i: int) -> dict:
+    return {
+        "id": str(uuid4()),
+        "tg_id": str(1000 + i),
+        "first_name": f"Ёлка {i}",
+        "last_name": "Last",
+        "username": None if i % 2 else f"user{i}",
+        "is_premium": bool(i % 3),
+    }
+
+
+def user(referrals: int) -> UserResponse:
+    return UserResponse(
+        **person(0),
+        tg_image=None,
+        score=123456,
+        gamebot_worked_minutes=90,
+        gamebot_reward=300,
+        status=StatusResponse(
+            level=3,
+            status_name="status",
+            energy_limit=1000,
+            nitro=3,
+            recharging_speed=2,
+            coin_farming=1,
+            gamebot=10,
+            fractal=None,
+            points_to_next_level=5000,
+            xp_to_upgrade=None,
+            ton_to_upgrade=1.5,
+            upgrade_available=False,
+        ),
+        days_in_row=4,
+        auth_date=int(datetime.now().timestamp()),
+        reward=100,
+        register_date=datetime.now(),
+        referrals=ReferralResponse(
+            referrer=person(1),
+            referred_users=[
+                {**person(i), "score": i * 10} for i in range(2, referrals + 2)
+            ],
+            referral_count=referrals,
+            referral_reward_total=referrals * 50,
+        ),
+        active_skin_id=uuid4(),
+        max_score=200000,
+        address=None,
+        rank=42,
+    )
+
+
+def skins(count: int) -> list[SkinResponse]:
+    return [
+        SkinResponse(
+            id=uuid4(),
+            name=f"skin{i}",
+            required_xp=i * 100,
+            open_from=i % 5,
+            price_ton=0.5 * i,
+            owned=i % 4 == 0,
+        )
+        for i in range(count)
+    ]
+
+
+def quests(count: int, subtasks: int) -> list[QuestWithProgressResponse]:
+    return [
+        QuestWithProgressResponse(
+            id=uuid4(),
+            name=f"quest{i}",
+            description="description",
+            reward=50,
+            completed=False,
+            reward_claimed=False,
+            valid_by=datetime.now(),
+            total_subtasks=subtasks,
+            completed_subtasks=1,
+            subtasks=[
+                {
+                    "id": uuid4(),
+                    "name": f"subtask{j}",
+                    "description": "description",
+                    "reward": 10,
+                    "completed": j == 0,
+                    "reward_claimed": False,
+                    "link": "https://t.me/channel",
+                }
+                for j in range(subtasks)
+            ],
+        )
+        for i in range(count)
+    ]
+
+
+def main(args: argparse.Namespace):
+    payloads = [
+        ("user", user_adapter, user(args.referrals)),
+        ("skins", skins_adapter, skins(args.skins)),
+        ("quests", quests_adapter, quests(args.quests, args.subtasks)),
+    ]
+    for label, adapter, value in payloads:
+        assert trusted_response(adapter, value).body == legacy_body(adapter, value)
+        legacy = timeit.timeit(lambda: legacy_body(adapter, value), number=args.number)
+        trusted = timeit.timeit(
+            lambda: trusted_response(adapter, value).body, number=args.number
+        )
+        print(
+            f"{label:<7} legacy {legacy / args.number * 1e6:8.1f}us  "
+            f"trusted {trusted / args.number * 1e6:8.1f}us  "
+            f"{legacy / trusted:5.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=2000)
+    parser.add_argument("--referrals", type=int, default=20)
+    parser.add_argument("--skins", type=int, default=50)
+    parser.add_argument("--quests", type=int, default=10)
+    parser.add_argument("--subtasks", type=int, default=3)
+    main(parser.parse_args())
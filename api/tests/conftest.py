@@ -0,0 +1,98 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+# Tests drop and recreate every table, so they only ever run against the
+# database named in TEST_DATABASE_URL, never the one from .env
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+os.environ["DATABASE_URL"] = TEST_DATABASE_URL or "postgresql://localhost/unused"
+os.environ.setdefault("RATE_LIMIT_ENABLED", "0")
+
+import httpx  # noqa: E402
+
+import models  # noqa: E402
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(scope="session")
+def database():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    models.Base.metadata.drop_all(models.engine)
+    models.init_db()
+    yield
+    models.engine.dispose()
+
+
+@pytest.fixture
+def seed(database):
+    """A quest with three subtasks and three droppable skins"""
+
+    with models.SessionLocal() as db:
+        quest = models.Quest(
+            name="quest",
+            description="d",
+            reward=50,
+            valid_by=datetime.utcnow() + timedelta(days=1),
+        )
+        db.add(quest)
+        db.flush()
+        for i in range(3):
+            db.add(
+                models.Subtask(
+                    name=f"subtask{i}",
+                    description="d",
+                    reward=10,
+                    quest_id=quest.id,
+                    link="l",
+                )
+            )
+            db.add(
+                models.Skin(
+                    name=f"skin{i}",
+                    required_xp=100,
+                    price_ton=1.0,
+                    open_from=0,
+                    is_droppable=True,
+                )
+            )
+        db.commit()
+        quest_id = quest.id
+
+    yield quest_id
+
+    with models.SessionLocal() as db:
+        for table in reversed(models.Base.metadata.sorted_tables):
+            if table.name != "user_statuses":
+                db.execute(table.delete())
+        db.commit()
+
+
+@pytest.fixture
+async def client(seed):
+    import main
+
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+            yield c
+    # Pooled connections belong to this test's event loop
+    await models.async_engine.dispose()
+
+
+def user_body(tg_id: str = "1", **fields) -> dict:
+    body = {
+        "tg_id": tg_id,
+        "first_name": "First",
+        "last_name": "Last",
+        "username": "user",
+        "is_premium": False,
+        "auth_date": int(datetime.now().timestamp()),
+    }
+    body.update(fields)
+    return body
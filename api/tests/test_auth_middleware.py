@@ -0,0 +1,98 @@
+import hashlib
+import hmac
+import json
+import time
+from urllib.parse import urlencode
+
+import httpx
+import pytest
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from middleware import TelegramAuthMiddleware
+
+pytestmark = pytest.mark.anyio
+
+BOT_TOKEN = "123456:TEST"
+
+
+def init_data(auth_date=None, token: str = BOT_TOKEN, **fields) -> str:
+    """initData signed the way Telegram signs it"""
+
+    fields = {
+        "auth_date": str(int(time.time()) if auth_date is None else auth_date),
+        "query_id": "q",
+        "user": json.dumps({"id": 7, "first_name": "First"}),
+        **fields,
+    }
+    secret = hmac.new(b"WebAppData", token.encode(), hashlib.sha256).digest()
+    data_check_string = "\n".join(f"{k}={v}" for k, v in sorted(fields.items()))
+    fields["hash"] = hmac.new(
+        secret, data_check_string.encode(), hashlib.sha256
+    ).hexdigest()
+    return urlencode(fields)
+
+
+async def whoami(request: Request) -> JSONResponse:
+    user = getattr(request.state, "telegram_user", None)
+    return JSONResponse({"id": user.id if user else None})
+
+
+@pytest.fixture
+async def client():
+    app = Starlette(routes=[Route("/me", whoami, methods=["GET", "OPTIONS"])])
+    transport = httpx.ASGITransport(
+        app=TelegramAuthMiddleware(app, telegram_bot_token=BOT_TOKEN)
+    )
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+        yield c
+
+
+async def test_valid_init_data_reaches_the_app(client):
+    response = await client.get("/me", headers={"Authorization": f"tma {init_data()}"})
+
+    assert response.status_code == 200
+    assert response.json() == {"id": 7}
+
+
+@pytest.mark.parametrize(
+    "headers", [{}, {"Authorization": "Bearer x"}, {"Authorization": "tma "}]
+)
+async def test_missing_header_is_401(client, headers):
+    response = await client.get("/me", headers=headers)
+
+    assert response.status_code == 401
+    assert response.headers["WWW-Authenticate"] == "tma"
+
+
+async def test_outdated_init_data_is_401(client):
+    stale = init_data(auth_date=int(time.time()) - 2 * 86400)
+
+    response = await client.get("/me", headers={"Authorization": f"tma {stale}"})
+
+    assert response.status_code == 401
+    assert response.headers["WWW-Authenticate"] == "tma"
+
+
+@pytest.mark.parametrize(
+    "raw_data",
+    [
+        init_data(token="654321:OTHER"),
+        init_data().replace("query_id=q", "query_id=x"),
+        "not init data",
+    ],
+)
+async def test_forged_init_data_is_403(client, raw_data):
+    response = await client.get("/me", headers={"Authorization": f"tma {raw_data}"})
+
+    assert response.status_code == 403
+    assert "WWW-Authenticate" not in response.headers
+
+
+async def test_other_methods_pass_through(client):
+    response = await client.options("/me")
+
+    assert response.status_code == 200
+    assert response.json() == {"id": None}
@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+
+from flusher import PeriodicFlusher
+
+pytestmark = pytest.mark.anyio
+
+
+class CountingFlusher(PeriodicFlusher):
+    def __init__(self, flush_interval: float):
+        super().__init__(flush_interval)
+        self.flushes = 0
+
+    async def flush(self) -> int:
+        self.flushes += 1
+        return 0
+
+
+async def test_wake_flushes_before_the_interval():
+    flusher = CountingFlusher(flush_interval=60)
+    flusher.start()
+
+    flusher.wake()
+    await asyncio.sleep(0.01)
+    assert flusher.flushes == 1
+
+    await flusher.stop()
+    assert flusher.flushes == 2
+
+
+async def test_flushes_every_interval():
+    flusher = CountingFlusher(flush_interval=0.01)
+    flusher.start()
+
+    await asyncio.sleep(0.05)
+    await flusher.stop()
+
+    assert flusher.flushes >= 3
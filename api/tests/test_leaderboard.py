@@ -0,0 +1,32 @@
+import pytest
+from sqlalchemy import update
+
+import models
+from leaderboard import Leaderboard
+from tests.conftest import user_body
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_rank_without_board_matches_board(client):
+    users = []
+    for tg_id, score in (("1", 10), ("2", 30), ("3", 10), ("4", 0)):
+        response = await client.put("/users", json=user_body(tg_id))
+        users.append(response.json()["id"])
+        with models.SessionLocal() as db:
+            db.execute(
+                update(models.ShiftUser)
+                .where(models.ShiftUser.tg_id == tg_id)
+                .values(score=score)
+            )
+            db.commit()
+
+    board, unloaded = Leaderboard(), Leaderboard()
+    async with models.AsyncSessionLocal() as db:
+        await board.load(db)
+        ranks = [await board.lookup_rank(db, user_id) for user_id in users]
+        assert [await unloaded.lookup_rank(db, user_id) for user_id in users] == ranks
+
+    assert sorted(ranks) == [1, 2, 3, 4]
+    assert ranks[1] == 1
+    assert len(unloaded) == 0
@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+
+import services
+from schemas import UserData
+from tests.conftest import user_body
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def logins(monkeypatch):
+    calls = []
+
+    async def fake_login(user_data, referrer_id, include_referred_users):
+        calls.append(user_data)
+        await asyncio.sleep(0.01)
+        return user_data.username
+
+    monkeypatch.setattr(services, "_login_user", fake_login)
+    return calls
+
+
+async def test_identical_logins_share_one_execution(logins):
+    user_data = UserData(**user_body())
+
+    results = await asyncio.gather(*(services.login_user(user_data) for _ in range(5)))
+
+    assert len(logins) == 1
+    assert results == ["user"] * 5
+
+
+async def test_logins_with_different_data_all_run(logins):
+    results = await asyncio.gather(
+        services.login_user(UserData(**user_body(username="before"))),
+        services.login_user(UserData(**user_body(username="after"))),
+    )
+
+    assert len(logins) == 2
+    assert results == ["before", "after"]
@@ -0,0 +1,39 @@
+from datetime import date, datetime, time, timedelta, timezone
+
+import pytest
+from sqlalchemy import select
+
+import models
+from rollover import roll_over
+
+pytestmark = pytest.mark.anyio
+
+DAY = date(2026, 5, 10)
+
+
+async def test_schema_upgrade_keeps_ended_gamebot_cycles(seed):
+    yesterday = DAY - timedelta(days=1)
+    login = int(datetime.combine(yesterday, time(12), timezone.utc).timestamp())
+    with models.SessionLocal() as db:
+        db.add(
+            models.ShiftUser(
+                tg_id="1",
+                first_name="First",
+                last_name="Last",
+                register_date=datetime(2026, 1, 1),
+                auth_date=login,
+                rollover_day=yesterday,
+                gamebot_started_at=login,
+            )
+        )
+        db.commit()
+
+    models.init_db()
+    async with models.AsyncSessionLocal() as db:
+        assert await roll_over(db, DAY) == 1
+    await models.async_engine.dispose()
+    models.init_db()
+
+    with models.SessionLocal() as db:
+        started_at = db.scalar(select(models.ShiftUser.gamebot_started_at))
+    assert started_at is None
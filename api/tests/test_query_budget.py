@@ -0,0 +1,130 @@
+"""Statements per request, so N+1 queries do not creep back in"""
+
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select, update
+
+import models
+from querycount import count_queries
+from tests.conftest import user_body
+
+pytestmark = pytest.mark.anyio
+
+
+async def login(client, **params):
+    response = await client.put("/users", json=user_body(), params=params)
+    assert response.status_code == 200
+    return response.json()
+
+
+async def test_new_user_login(client):
+    with count_queries() as counter:
+        await login(client)
+
+    assert counter.count <= 2
+
+
+async def test_repeated_login(client):
+    await login(client)
+
+    with count_queries() as counter:
+        await login(client)
+    assert counter.count <= 5
+
+    with count_queries() as counter:
+        await login(client, referrals="summary")
+    assert counter.count <= 3
+
+
+async def test_quests(client):
+    user = await login(client)
+
+    with count_queries() as counter:
+        response = await client.get("/quests", params={"user_id": user["id"]})
+
+    assert response.status_code == 200
+    assert counter.count <= 5
+
+
+def add_quests(count: int, subtasks: int):
+    with models.SessionLocal() as db:
+        for i in range(count):
+            quest = models.Quest(
+                name=f"extra{i}",
+                description="d",
+                reward=50,
+                valid_by=datetime.utcnow() + timedelta(days=1),
+            )
+            db.add(quest)
+            db.flush()
+            for j in range(subtasks):
+                db.add(
+                    models.Subtask(
+                        name=f"extra{i}-{j}",
+                        description="d",
+                        reward=10,
+                        quest_id=quest.id,
+                        link="l",
+                    )
+                )
+        db.commit()
+
+
+async def quests_query_count(client, user) -> int:
+    with models.SessionLocal() as db:
+        subtask_ids = db.scalars(select(models.Subtask.id)).all()
+    # Progress on half of the subtasks
+    for subtask_id in subtask_ids[::2]:
+        await client.post(
+            f"/subtasks/{subtask_id}/complete", params={"user_id": user["id"]}
+        )
+
+    with count_queries() as counter:
+        response = await client.get("/quests", params={"user_id": user["id"]})
+
+    assert response.status_code == 200
+    return counter.count
+
+
+async def test_quests_query_count_does_not_grow(client):
+    user = await login(client)
+    few = await quests_query_count(client, user)
+
+    add_quests(5, subtasks=4)
+    many = await quests_query_count(client, user)
+
+    assert (
+        len((await client.get("/quests", params={"user_id": user["id"]})).json()) == 6
+    )
+    assert many == few
+
+
+async def test_claim(client):
+    user = await login(client)
+
+    with count_queries() as counter:
+        response = await client.post(f"/users/{user['id']}/claim")
+
+    assert response.status_code == 200
+    assert counter.count <= 1
+
+
+async def test_skin_purchase(client):
+    user = await login(client)
+    with models.SessionLocal() as db:
+        db.execute(update(models.ShiftUser).values(score=1000))
+        db.commit()
+    skins = (await client.get("/skins", params={"user_id": user["id"]})).json()
+
+    with count_queries() as counter:
+        response = await client.post(
+            "/skins/purchase",
+            json={
+                "request": {"skin_id": skins[0]["id"], "purchase_type": "xp"},
+                "user_data": user_body(),
+            },
+        )
+
+    assert response.status_code == 200
+    assert counter.count <= 3
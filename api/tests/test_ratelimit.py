@@ -0,0 +1,111 @@
+import json
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from fastapi import Depends, FastAPI, HTTPException
+from starlette.requests import Request
+
+import ratelimit
+from middleware import TelegramAuthMiddleware
+from ratelimit import MemoryBackend, RateLimit, client_key
+from tests.test_auth_middleware import BOT_TOKEN, init_data
+
+pytestmark = pytest.mark.anyio
+
+
+def request(path: str = "/users/1/claim", telegram_user=None, host="10.0.0.1"):
+    state = {} if telegram_user is None else {"telegram_user": telegram_user}
+    return Request(
+        {
+            "type": "http",
+            "method": "POST",
+            "path": path,
+            "query_string": b"",
+            "headers": [],
+            "client": (host, 1234),
+            "path_params": {"user_id": path.split("/")[2]},
+            "state": state,
+        }
+    )
+
+
+def test_key_is_verified_user():
+    user = SimpleNamespace(id=42)
+
+    assert client_key(request(telegram_user=user)) == "tg:42"
+    assert client_key(request("/users/2/claim", telegram_user=user)) == "tg:42"
+
+
+def test_key_ignores_user_id_without_auth():
+    assert client_key(request("/users/1/claim")) == "ip:10.0.0.1"
+    assert client_key(request("/users/2/claim")) == "ip:10.0.0.1"
+
+
+async def test_rotating_user_ids_share_a_bucket(monkeypatch):
+    monkeypatch.setattr(ratelimit, "RATE_LIMIT_ENABLED", True)
+    limit = RateLimit("claim", rate=0.001, burst=2, backend=MemoryBackend())
+
+    await limit(request("/users/1/claim"))
+    await limit(request("/users/2/claim"))
+    with pytest.raises(HTTPException) as e:
+        await limit(request("/users/3/claim"))
+
+    assert e.value.status_code == 429
+    assert int(e.value.headers["Retry-After"]) > 0
+    # Another client is not affected
+    await limit(request("/users/3/claim", host="10.0.0.2"))
+
+
+async def test_routes_have_separate_buckets(monkeypatch):
+    monkeypatch.setattr(ratelimit, "RATE_LIMIT_ENABLED", True)
+    backend = MemoryBackend()
+    claim = RateLimit("claim", rate=0.001, burst=1, backend=backend)
+    purchase = RateLimit("skin_purchase", rate=0.001, burst=1, backend=backend)
+
+    await claim(request())
+    with pytest.raises(HTTPException):
+        await claim(request())
+    await purchase(request())
+
+
+async def test_route_bucket_limits_all_clients(monkeypatch):
+    monkeypatch.setattr(ratelimit, "RATE_LIMIT_ENABLED", True)
+    limit = RateLimit(
+        "claim",
+        rate=0.001,
+        burst=1,
+        route_rate=0.001,
+        route_burst=2,
+        backend=MemoryBackend(),
+    )
+
+    await limit(request(host="10.0.0.1"))
+    await limit(request(host="10.0.0.2"))
+    with pytest.raises(HTTPException) as e:
+        await limit(request(host="10.0.0.3"))
+
+    assert e.value.status_code == 429
+
+
+async def test_verified_users_behind_one_address_have_own_buckets(monkeypatch):
+    monkeypatch.setattr(ratelimit, "RATE_LIMIT_ENABLED", True)
+    limit = RateLimit("claim", rate=0.001, burst=1, backend=MemoryBackend())
+    app = FastAPI()
+
+    @app.post("/claim", dependencies=[Depends(limit)])
+    async def claim():
+        return {}
+
+    transport = httpx.ASGITransport(
+        app=TelegramAuthMiddleware(app, telegram_bot_token=BOT_TOKEN)
+    )
+
+    def headers(user_id: int) -> dict:
+        user = json.dumps({"id": user_id, "first_name": "First"})
+        return {"Authorization": f"tma {init_data(user=user)}"}
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+        assert (await c.post("/claim", headers=headers(1))).status_code == 200
+        assert (await c.post("/claim", headers=headers(1))).status_code == 429
+        assert (await c.post("/claim", headers=headers(2))).status_code == 200
@@ -0,0 +1,64 @@
+from datetime import date, datetime, time, timedelta, timezone
+
+import pytest
+from sqlalchemy import select
+
+import models
+import rollover
+from rollover import roll_over
+
+pytestmark = pytest.mark.anyio
+
+DAY = date(2026, 5, 10)
+
+
+def login_at(day: date) -> int:
+    return int(datetime.combine(day, time(12), timezone.utc).timestamp())
+
+
+def add_user(db, tg_id: str, last_login: date, **fields):
+    db.add(
+        models.ShiftUser(
+            tg_id=tg_id,
+            first_name="First",
+            last_name="Last",
+            register_date=datetime(2026, 1, 1),
+            auth_date=login_at(last_login),
+            rollover_day=DAY - timedelta(days=1),
+            **fields,
+        )
+    )
+
+
+async def test_rollover_writes_only_changed_rows(seed, monkeypatch):
+    monkeypatch.setattr(rollover, "ROLLOVER_BATCH_SIZE", 1)
+    yesterday = DAY - timedelta(days=1)
+    with models.SessionLocal() as db:
+        # Logged in yesterday: the popup is shown again, the streak goes on
+        add_user(db, "active", yesterday, days_in_row=3, is_days_shown=True)
+        # Last seen two days ago: the streak is lost
+        add_user(db, "missed", yesterday - timedelta(days=1), days_in_row=4)
+        # Gone for a week and already rolled over: nothing changes
+        add_user(
+            db, "inactive", DAY - timedelta(days=7), days_in_row=1, is_days_dropped=True
+        )
+        db.commit()
+
+    async with models.AsyncSessionLocal() as db:
+        assert await roll_over(db, DAY) == 2
+
+    with models.SessionLocal() as db:
+        users = {
+            user.tg_id: user for user in db.scalars(select(models.ShiftUser)).all()
+        }
+    await models.async_engine.dispose()
+
+    active, missed, inactive = users["active"], users["missed"], users["inactive"]
+    assert (active.days_in_row, active.is_days_shown, active.is_days_dropped) == (
+        3,
+        False,
+        False,
+    )
+    assert (missed.days_in_row, missed.is_days_dropped) == (1, True)
+    assert active.rollover_day == missed.rollover_day == DAY
+    assert inactive.rollover_day == DAY - timedelta(days=1)
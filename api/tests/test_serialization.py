@@ -0,0 +1,63 @@
+"""The orjson fast path must produce the bytes FastAPI produced before"""
+
+import pytest
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+from sqlalchemy import select
+
+import models
+import services
+from catalog import current_catalog
+from schemas import UserData
+from serialization import quests_adapter, skins_adapter, trusted_response, user_adapter
+from tests.conftest import user_body
+
+pytestmark = pytest.mark.anyio
+
+
+def legacy_body(adapter: TypeAdapter, value) -> bytes:
+    # What a `response_model` route returned: validate, dump in JSON mode,
+    # `jsonable_encoder`, then the stdlib `json` of JSONResponse
+    validated = adapter.validate_python(value)
+    return JSONResponse(
+        jsonable_encoder(adapter.dump_python(validated, mode="json"))
+    ).body
+
+
+async def login(tg_id: str, **params):
+    user_data = UserData(**user_body(tg_id, first_name="Ёлка ✓", username=None))
+    return await services.login_user(user_data, **params)
+
+
+async def test_user_body(client):
+    referrer = await login("1")
+    await login("2", referrer_id=str(referrer.id))
+
+    for response in (await login("1"), await login("2")):
+        assert trusted_response(user_adapter, response).body == legacy_body(
+            user_adapter, response
+        )
+
+
+async def test_skins_body(client):
+    catalog = await current_catalog()
+    skins = catalog.responses(catalog.ownership_mask([next(iter(catalog)).id]))
+
+    assert trusted_response(skins_adapter, skins).body == legacy_body(
+        skins_adapter, skins
+    )
+
+
+async def test_quests_body(client):
+    user = await login("1")
+    async with models.AsyncSessionLocal() as db:
+        db_user = await db.scalar(
+            select(models.ShiftUser).where(models.ShiftUser.id == user.id)
+        )
+        quests = await services.get_quests_with_progress(db_user, db)
+
+    assert quests
+    assert trusted_response(quests_adapter, quests).body == legacy_body(
+        quests_adapter, quests
+    )
@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+
+from snapshots import Snapshot
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def reads():
+    return []
+
+
+@pytest.fixture
+def snapshot(reads):
+    async def read(db):
+        reads.append(db)
+        await asyncio.sleep(0.01)
+        return len(reads)
+
+    return Snapshot(read, 0, ttl=60)
+
+
+async def test_concurrent_reloads_share_one_read(snapshot, reads):
+    values = await asyncio.gather(*(snapshot.current() for _ in range(10)))
+
+    assert values == [1] * 10
+    assert len(reads) == 1
+    assert snapshot.version == 1
+
+
+async def test_reload_once_expired(snapshot, reads):
+    await snapshot.current()
+    assert await snapshot.current() == 1
+
+    snapshot.ttl = 0
+    assert await snapshot.current() == 2
+    assert snapshot.get() == 2
@@ -0,0 +1,85 @@
+import pytest
+from sqlalchemy import select, update
+
+import models
+import tiers
+from tiers import Tier, TierTable, current_tiers, load_tiers
+
+pytestmark = pytest.mark.anyio
+
+
+def rename_tier(name: str):
+    with models.SessionLocal() as db:
+        db.execute(
+            update(models.UserStatus)
+            .where(models.UserStatus.level == 1)
+            .values(status_name=name)
+        )
+        db.commit()
+
+
+@pytest.fixture
+def tier_name(database):
+    with models.SessionLocal() as db:
+        name = db.scalar(
+            select(models.UserStatus.status_name).where(models.UserStatus.level == 1)
+        )
+    yield name
+    rename_tier(name)
+
+
+async def test_tiers_reload_once_expired(tier_name, monkeypatch):
+    async with models.AsyncSessionLocal() as db:
+        loaded = await load_tiers(db)
+        rename_tier("Edited")
+
+        assert await current_tiers() is loaded
+        assert loaded.get(1).status_name == tier_name
+
+        monkeypatch.setattr(tiers._tiers, "ttl", 0)
+        assert (await current_tiers()).get(1).status_name == "Edited"
+
+    await models.async_engine.dispose()
+
+
+def tier(level: int, start_score: int, end_score: int) -> Tier:
+    return Tier(
+        level=level,
+        status_name=f"tier{level}",
+        start_score=start_score,
+        end_score=end_score,
+        energy_limit=0,
+        nitro=0,
+        recharging_speed=0,
+        coin_farming=0,
+        gamebot=None,
+        xp_to_upgrade=None,
+        ton_to_upgrade=None,
+        fractal=None,
+    )
+
+
+@pytest.mark.parametrize(
+    "score, level",
+    [
+        (-1, None),
+        (0, None),
+        (99, None),
+        (100, 1),
+        (999, 1),
+        (1000, 2),
+        (1001, 2),
+        (5000, 3),
+        (10**12, 3),
+    ],
+)
+def test_tier_for_score(score, level):
+    table = TierTable([tier(3, 5000, 10**9), tier(1, 100, 999), tier(2, 1000, 4999)])
+
+    found = table.for_score(score)
+
+    assert (found.level if found else None) == level
+
+
+def test_empty_table_has_no_tier_for_score():
+    assert TierTable().for_score(100) is None
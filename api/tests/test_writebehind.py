@@ -0,0 +1,73 @@
+import asyncio
+from uuid import uuid4
+
+import pytest
+
+import writebehind
+from writebehind import ScoreAccumulator
+
+pytestmark = pytest.mark.anyio
+
+
+class BlockedSession:
+    """Session whose UPDATE waits for `release`, then fails or succeeds"""
+
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.fail = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, statement):
+        await self.release.wait()
+        if self.fail:
+            raise RuntimeError("database is down")
+        return self
+
+    def all(self):
+        return []
+
+    async def commit(self):
+        pass
+
+
+@pytest.fixture
+def session(monkeypatch):
+    session = BlockedSession()
+    monkeypatch.setattr(writebehind, "AsyncSessionLocal", lambda: session)
+    return session
+
+
+async def test_flushing_deltas_stay_pending_until_commit(session):
+    accumulator = ScoreAccumulator(enabled=True)
+    user_id = uuid4()
+    accumulator.add(user_id, 5, [])
+
+    flush = asyncio.create_task(accumulator.flush())
+    await asyncio.sleep(0)
+    accumulator.add(user_id, 2, [])
+    assert accumulator.pending(user_id) == 7
+
+    session.release.set()
+    assert await flush == 1
+    assert accumulator.pending(user_id) == 2
+
+
+async def test_failed_flush_restores_deltas(session):
+    session.fail = True
+    accumulator = ScoreAccumulator(enabled=True)
+    user_id = uuid4()
+    accumulator.add(user_id, 5, [])
+
+    flush = asyncio.create_task(accumulator.flush())
+    await asyncio.sleep(0)
+    accumulator.add(user_id, 2, [])
+    session.release.set()
+
+    assert await flush == 0
+    assert accumulator.pending(user_id) == 7
+    assert len(accumulator) == 1
@@ -0,0 +1,123 @@
+import os
+from bisect import bisect_right
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Iterable, Iterator, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import UserStatus
+from snapshots import Snapshot
+
+# Seconds a worker uses its tier table before reading `user_statuses` again
+TIER_TABLE_TTL = float(os.getenv("TIER_TABLE_TTL", 300))
+
+
+@dataclass(frozen=True, slots=True)
+class Tier:
+    """Read-only snapshot of a single `user_statuses` row"""
+
+    level: int
+    status_name: str
+    start_score: int
+    end_score: int
+    energy_limit: int
+    nitro: int
+    recharging_speed: int
+    coin_farming: int
+    gamebot: Optional[int]
+    xp_to_upgrade: Optional[int]
+    ton_to_upgrade: Optional[float]
+    fractal: Optional[int]
+
+    @classmethod
+    def from_orm(cls, status: UserStatus) -> "Tier":
+        return cls(
+            level=status.level,
+            status_name=status.status_name,
+            start_score=status.start_score,
+            end_score=status.end_score,
+            energy_limit=status.energy_limit,
+            nitro=status.nitro,
+            recharging_speed=status.recharging_speed,
+            coin_farming=status.coin_farming,
+            gamebot=status.gamebot,
+            xp_to_upgrade=status.xp_to_upgrade,
+            ton_to_upgrade=status.ton_to_upgrade,
+            fractal=status.fractal,
+        )
+
+
+class TierTable:
+    """Immutable, level-sorted table of tiers.
+
+    Lookup by level is a dict hit, lookup by score bisects the sorted
+    `start_score` boundaries.
+    """
+
+    __slots__ = ("_tiers", "_by_level", "_start_scores")
+
+    def __init__(self, tiers: Iterable[Tier] = ()):
+        self._tiers = tuple(sorted(tiers, key=lambda tier: tier.level))
+        self._by_level = MappingProxyType({tier.level: tier for tier in self._tiers})
+        self._start_scores = tuple(tier.start_score for tier in self._tiers)
+
+    def __len__(self) -> int:
+        return len(self._tiers)
+
+    def __iter__(self) -> Iterator[Tier]:
+        return iter(self._tiers)
+
+    @property
+    def highest(self) -> Optional[Tier]:
+        return self._tiers[-1] if self._tiers else None
+
+    def get(self, level: int) -> Optional[Tier]:
+        return self._by_level.get(level)
+
+    def for_level(self, level: int) -> Optional[Tier]:
+        """Tier for the given level, falling back to the highest known tier"""
+
+        return self._by_level.get(level) or self.highest
+
+    def next_after(self, level: int) -> Optional[Tier]:
+        return self._by_level.get(level + 1)
+
+    def for_score(self, score: int) -> Optional[Tier]:
+        """Tier whose score range contains the given score"""
+
+        index = bisect_right(self._start_scores, score) - 1
+        return self._tiers[index] if index >= 0 else None
+
+
+async def _read_tiers(db: AsyncSession) -> TierTable:
+    statuses = (await db.scalars(select(UserStatus).order_by(UserStatus.level))).all()
+    return TierTable(Tier.from_orm(status) for status in statuses)
+
+
+_tiers = Snapshot(_read_tiers, TierTable(), TIER_TABLE_TTL)
+
+
+def get_tiers() -> TierTable:
+    """Currently loaded tier table"""
+
+    return _tiers.get()
+
+
+async def load_tiers(db: AsyncSession) -> TierTable:
+    """Read `user_statuses` into a new tier table and make it current"""
+
+    return await _tiers.load(db)
+
+
+async def reload_tiers() -> TierTable:
+    """Reload hook to call after the `user_statuses` rows have been edited"""
+
+    return await _tiers.reload()
+
+
+async def current_tiers() -> TierTable:
+    """Current tier table, loaded on first use and once older than `TIER_TABLE_TTL`"""
+
+    return await _tiers.current()
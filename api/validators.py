@@ -1,24 +1,141 @@
-import logging
+import hashlib
+import hmac
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+from urllib.parse import parse_qsl
 
-from fastapi import HTTPException
-from init_data_py import InitData
+from exceptions import TelegramDataError, TelegramDataIsOutdated
 
-from schemas import UserData
+INIT_DATA_LIFETIME = 3600  # seconds
+INIT_DATA_CACHE_SIZE = 10_000
 
-logging.basicConfig(level=logging.DEBUG)
 
+@dataclass(frozen=True, slots=True)
+class TelegramUser:
+    """User described by a verified Telegram initData string"""
 
-def validate_telegram_data(telegram_bot_token: str, data: UserData) -> bool:
-    init_data = InitData.parse(data)
+    id: int
+    first_name: str
+    last_name: str
+    username: Optional[str]
+    is_premium: Optional[bool]
+    photo_url: Optional[str]
+    auth_date: int
 
-    is_valid = init_data.validate(
-        telegram_bot_token,
-        lifetime=3600,  # seconds
-    )
+    @classmethod
+    def from_init_data(cls, fields: dict, auth_date: int) -> "TelegramUser":
+        try:
+            user = json.loads(fields["user"])
+            return cls(
+                id=int(user["id"]),
+                first_name=user.get("first_name", ""),
+                last_name=user.get("last_name", ""),
+                username=user.get("username"),
+                is_premium=user.get("is_premium", False),
+                photo_url=user.get("photo_url"),
+                auth_date=auth_date,
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            raise TelegramDataError("Init data has no valid user") from e
 
-    if is_valid is not True:
-        raise HTTPException(
-            status_code=403, detail="Token is invalid, please re-fetch the init data"
+
+class TelegramInitDataValidator:
+    """Verifies Telegram Mini App initData for one bot token.
+
+    The `WebAppData` secret is derived once, and verified strings are kept
+    in an LRU keyed by their `hash` until `auth_date + lifetime`, so a
+    session resending the same initData costs a dict lookup instead of a
+    parse and an HMAC.
+    """
+
+    def __init__(
+        self,
+        bot_token: str,
+        lifetime: int = INIT_DATA_LIFETIME,
+        cache_size: int = INIT_DATA_CACHE_SIZE,
+    ):
+        self.lifetime = lifetime
+        self.cache_size = cache_size
+        self._secret_key = hmac.new(
+            b"WebAppData", bot_token.encode(), hashlib.sha256
+        ).digest()
+        self._verified: OrderedDict[str, tuple[str, TelegramUser]] = OrderedDict()
+
+    def validate(self, raw_data: str) -> TelegramUser:
+        """Return the user of a signed, fresh initData string.
+
+        Raises TelegramDataError for malformed or forged data and
+        TelegramDataIsOutdated once it is older than `lifetime`.
+        """
+
+        cached = self._lookup(raw_data)
+        if cached is not None:
+            return cached
+
+        try:
+            fields = dict(
+                parse_qsl(raw_data, keep_blank_values=True, strict_parsing=True)
+            )
+        except ValueError as e:
+            raise TelegramDataError("Init data is malformed") from e
+
+        received_hash = fields.pop("hash", None)
+        if not received_hash:
+            raise TelegramDataError("Init data is not signed")
+
+        data_check_string = "\n".join(
+            f"{key}={value}" for key, value in sorted(fields.items())
         )
+        expected_hash = hmac.new(
+            self._secret_key, data_check_string.encode(), hashlib.sha256
+        ).hexdigest()
+        if not hmac.compare_digest(expected_hash, received_hash):
+            raise TelegramDataError("Init data signature is invalid")
+
+        try:
+            auth_date = int(fields["auth_date"])
+        except (KeyError, ValueError) as e:
+            raise TelegramDataError("Init data has no valid auth_date") from e
+        if time.time() - auth_date > self.lifetime:
+            raise TelegramDataIsOutdated("Init data is outdated")
+
+        user = TelegramUser.from_init_data(fields, auth_date)
+        self._remember(received_hash, raw_data, user)
+
+        return user
+
+    def _lookup(self, raw_data: str) -> Optional[TelegramUser]:
+        # Telegram puts the hash last, so the cache key is found without
+        # parsing; anything unexpected just misses the cache
+        key = raw_data.rpartition("hash=")[2].partition("&")[0]
+        entry = self._verified.get(key)
+        if entry is None or entry[0] != raw_data:
+            return None
+
+        user = entry[1]
+        if time.time() - user.auth_date > self.lifetime:
+            del self._verified[key]
+            raise TelegramDataIsOutdated("Init data is outdated")
+
+        self._verified.move_to_end(key)
+        return user
+
+    def _remember(self, received_hash: str, raw_data: str, user: TelegramUser):
+        self._verified[received_hash] = (raw_data, user)
+        if len(self._verified) > self.cache_size:
+            self._verified.popitem(last=False)
+
+
+@lru_cache
+def get_validator(telegram_bot_token: str) -> TelegramInitDataValidator:
+    """Validator for the token, created once per process"""
+
+    return TelegramInitDataValidator(telegram_bot_token)
+
 
-    return is_valid
+def validate_telegram_data(telegram_bot_token: str, raw_data: str) -> TelegramUser:
+    return get_validator(telegram_bot_token).validate(raw_data)
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import os
+from typing import Optional
+from uuid import UUID
+
+from sqlalchemy import BigInteger, column, event, func, update, values
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID
+from sqlalchemy.orm import Session
+
+from leaderboard import leaderboard, user_key
+from ledger import score_ledger
+from flusher import PeriodicFlusher
+from models import AsyncSessionLocal, ShiftUser
+
+logger = logging.getLogger(__name__)
+
+SCORE_WRITE_BEHIND = os.getenv("SCORE_WRITE_BEHIND", "0") == "1"
+SCORE_WRITE_BEHIND_FLUSH_MS = int(os.getenv("SCORE_WRITE_BEHIND_FLUSH_MS", 500))
+SCORE_WRITE_BEHIND_MAX_USERS = int(os.getenv("SCORE_WRITE_BEHIND_MAX_USERS", 1000))
+SCORE_WRITE_BEHIND_FLUSH_ON_SHUTDOWN = (
+    os.getenv("SCORE_WRITE_BEHIND_FLUSH_ON_SHUTDOWN", "1") == "1"
+)
+
+
+class ScoreAccumulator(PeriodicFlusher):
+    """Coalesces per-user score deltas in memory and writes them in batches.
+
+    Deltas for the same user are summed and the whole buffer is applied with
+    one `UPDATE users ... FROM (VALUES ...)` every `flush_interval_ms` or as
+    soon as `max_users` users are pending. The ledger events behind a delta
+    travel with it and are recorded once the delta is in the database.
+
+    The buffer is per process: `pending()` gives read-your-writes only for
+    requests served by the same worker.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = SCORE_WRITE_BEHIND,
+        flush_interval_ms: int = SCORE_WRITE_BEHIND_FLUSH_MS,
+        max_users: int = SCORE_WRITE_BEHIND_MAX_USERS,
+        flush_on_shutdown: bool = SCORE_WRITE_BEHIND_FLUSH_ON_SHUTDOWN,
+    ):
+        super().__init__(flush_interval_ms / 1000)
+        self.enabled = enabled
+        self.max_users = max_users
+        self.flush_on_shutdown = flush_on_shutdown
+        self._pending: dict[UUID, tuple[int, list]] = {}
+        # The batch being flushed, until its transaction commits
+        self._inflight: dict[UUID, tuple[int, list]] = {}
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, user_id, delta: int, events: list):
+        key = user_key(user_id)
+        pending_delta, pending_events = self._pending.get(key, (0, []))
+        self._pending[key] = (pending_delta + delta, pending_events + events)
+
+        if len(self._pending) >= self.max_users:
+            self.wake()
+
+    def pending(self, user_id) -> int:
+        """Delta not yet written for the user, including one being flushed"""
+
+        key = user_key(user_id)
+        return self._pending.get(key, (0, []))[0] + self._inflight.get(key, (0, []))[0]
+
+    def take(self, user_id) -> Optional[tuple[int, list]]:
+        """Remove and return the user's pending delta and its events"""
+
+        return self._pending.pop(user_key(user_id), None)
+
+    async def flush(self) -> int:
+        """Apply all pending deltas in one batched UPDATE"""
+
+        if not self._pending or self._inflight:
+            return 0
+
+        batch, self._pending = self._pending, {}
+        self._inflight = batch
+        deltas = values(
+            column("id", PG_UUID(as_uuid=True)),
+            column("delta", BigInteger),
+            name="deltas",
+        ).data([(user_id, delta) for user_id, (delta, _) in batch.items()])
+        new_score = func.coalesce(ShiftUser.score, 0) + deltas.c.delta
+
+        try:
+            async with AsyncSessionLocal() as db:
+                scores = (
+                    await db.execute(
+                        update(ShiftUser)
+                        .where(ShiftUser.id == deltas.c.id)
+                        .values(
+                            score=new_score,
+                            max_score=func.greatest(
+                                func.coalesce(ShiftUser.max_score, 0), new_score
+                            ),
+                        )
+                        .returning(ShiftUser.id, ShiftUser.score)
+                        .execution_options(synchronize_session=False)
+                    )
+                ).all()
+                await db.commit()
+        except Exception:
+            logger.exception("Failed to flush score deltas for %d users", len(batch))
+            self._restore(batch)
+            return 0
+        except asyncio.CancelledError:
+            # Stopped mid-flush; the shutdown flush writes the batch again
+            self._restore(batch)
+            raise
+
+        self._inflight = {}
+        score_ledger.record([e for _, events in batch.values() for e in events])
+        leaderboard.update_many(scores)
+
+        return len(batch)
+
+    def _restore(self, batch: dict[UUID, tuple[int, list]]):
+        self._inflight = {}
+        for user_id, (delta, events) in batch.items():
+            self.add(user_id, delta, events)
+
+    def start(self):
+        if self.enabled:
+            super().start()
+
+    async def stop(self):
+        if self.flush_on_shutdown:
+            await super().stop()
+            return
+
+        await self._cancel()
+        if self._pending:
+            logger.warning("Discarding score deltas for %d users", len(self._pending))
+
+
+score_accumulator = ScoreAccumulator()
+
+
+@event.listens_for(Session, "after_commit")
+def _hand_over_score_deltas(session: Session):
+    for user_id, delta, events in session.info.pop("score_deltas", ()):
+        score_accumulator.add(user_id, delta, events)
+    # Deltas taken out of the buffer were written by this transaction
+    session.info.pop("score_deltas_taken", None)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _restore_score_deltas(session: Session, transaction):
+    if transaction.parent is not None:
+        return
+    session.info.pop("score_deltas", None)
+    for user_id, delta, events in session.info.pop("score_deltas_taken", ()):
+        score_accumulator.add(user_id, delta, events)
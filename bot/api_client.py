@@ -0,0 +1,177 @@
+import asyncio
+import importlib
+import logging
+import os
+import random
+import sys
+from contextlib import AsyncExitStack
+from pathlib import Path
+from typing import Optional
+
+import httpx
+from dotenv import load_dotenv
+from pydantic import ValidationError
+
+load_dotenv()
+
+# "http" calls the API over HTTP at API_URL, "local" calls its services
+# in this process, sharing a connection pool to the same database
+BOT_API_MODE = os.getenv("BOT_API_MODE", "http")
+API_DIR = Path(os.getenv("API_DIR", Path(__file__).resolve().parent.parent / "api"))
+API_URL = os.getenv("API_URL", "http://localhost:8000")
+API_TIMEOUT = float(os.getenv("API_TIMEOUT", 10))
+API_CONNECT_TIMEOUT = float(os.getenv("API_CONNECT_TIMEOUT", 3))
+API_MAX_CONNECTIONS = int(os.getenv("API_MAX_CONNECTIONS", 50))
+API_MAX_KEEPALIVE = int(os.getenv("API_MAX_KEEPALIVE", 20))
+API_KEEPALIVE_EXPIRY = float(os.getenv("API_KEEPALIVE_EXPIRY", 30))
+# Attempts after the first one, and the base delay they back off from
+API_RETRIES = int(os.getenv("API_RETRIES", 3))
+API_RETRY_BACKOFF = float(os.getenv("API_RETRY_BACKOFF", 0.2))
+
+# Failures where the request may be sent again
+RETRY_EXCEPTIONS = (httpx.ConnectError, httpx.ConnectTimeout)
+
+logger = logging.getLogger(__name__)
+
+
+def use_api_modules(api_dir: Path = API_DIR):
+    """Make the API's modules importable, to use them in this process"""
+
+    if str(api_dir) not in sys.path:
+        sys.path.insert(0, str(api_dir))
+
+
+class ApiError(Exception):
+    """The API refused a call"""
+
+    def __init__(self, status_code: int, text: str):
+        super().__init__(f"{status_code}: {text}")
+        self.status_code = status_code
+        self.text = text
+
+
+class ApiClient:
+    """Keep-alive HTTP client of the bot for the backend API.
+
+    One connection pool is shared by all handlers for the lifetime of the
+    dispatcher. Requests that fail to connect or get a 5xx answer are
+    retried up to `retries` times with exponential backoff and full jitter,
+    so a restarting API does not get the retries of all users at once.
+    """
+
+    def __init__(
+        self,
+        base_url: str = API_URL,
+        retries: int = API_RETRIES,
+        backoff: float = API_RETRY_BACKOFF,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.base_url = base_url
+        self.retries = retries
+        self.backoff = backoff
+        self.transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def start(self):
+        if self._client is not None:
+            return
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=httpx.Timeout(API_TIMEOUT, connect=API_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=API_MAX_CONNECTIONS,
+                max_keepalive_connections=API_MAX_KEEPALIVE,
+                keepalive_expiry=API_KEEPALIVE_EXPIRY,
+            ),
+            transport=self.transport,
+        )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        """Send a request, retrying connect errors and 5xx answers.
+
+        The last 5xx response is returned, the last connect error raised,
+        once the retries are used up.
+        """
+
+        if self._client is None:
+            raise RuntimeError("ApiClient is not started")
+
+        attempt = 0
+        while True:
+            try:
+                response = await self._client.request(method, path, **kwargs)
+            except RETRY_EXCEPTIONS as e:
+                if attempt >= self.retries:
+                    raise
+                logger.warning("%s %s failed: %r, retrying", method, path, e)
+            else:
+                if response.status_code < 500 or attempt >= self.retries:
+                    return response
+                logger.warning(
+                    "%s %s answered %d, retrying", method, path, response.status_code
+                )
+
+            await asyncio.sleep(random.uniform(0, self.backoff * 2**attempt))
+            attempt += 1
+
+    async def login(self, user_info: dict) -> dict:
+        """Register or log in the user, returning the profile"""
+
+        response = await self.request("PUT", "/users", json=user_info)
+        if response.status_code != 200:
+            raise ApiError(response.status_code, response.text)
+        return response.json()
+
+
+class LocalApiClient:
+    """Calls the API's services directly, when the bot runs next to the API.
+
+    Saves the HTTP hop and the JSON round trip per call. The services get
+    their own connection pool and caches in the bot process; scheduled
+    database jobs and the in-memory leaderboard are left to the API, ranks
+    are counted in the database instead. Answers are the same as over HTTP.
+    """
+
+    def __init__(self, api_dir: Path = API_DIR):
+        self.api_dir = api_dir
+        self._stack: Optional[AsyncExitStack] = None
+
+    async def start(self):
+        if self._stack is not None:
+            return
+        use_api_modules(self.api_dir)
+
+        lifecycle = importlib.import_module("lifecycle")
+        self._services = importlib.import_module("services")
+        self._schemas = importlib.import_module("schemas")
+        self._serialization = importlib.import_module("serialization")
+
+        stack = AsyncExitStack()
+        await stack.enter_async_context(
+            lifecycle.running_services(jobs=False, board=False)
+        )
+        self._stack = stack
+
+    async def close(self):
+        if self._stack is not None:
+            await self._stack.aclose()
+            self._stack = None
+
+    async def login(self, user_info: dict) -> dict:
+        if self._stack is None:
+            raise RuntimeError("LocalApiClient is not started")
+
+        try:
+            user_data = self._schemas.UserData(**user_info)
+        except ValidationError as e:
+            raise ApiError(422, e.json()) from e
+        response = await self._services.login_user(user_data)
+        return self._serialization.user_adapter.dump_python(response, mode="json")
+
+
+api_client = LocalApiClient() if BOT_API_MODE == "local" else ApiClient()
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from aiogram import Bot
+
+# Seconds a resolved avatar is used without asking Telegram again
+AVATAR_CACHE_TTL = float(os.getenv("AVATAR_CACHE_TTL", 3600))
+AVATAR_CACHE_SIZE = int(os.getenv("AVATAR_CACHE_SIZE", 10_000))
+# Answer with an expired avatar and refresh it in the background
+AVATAR_STALE_WHILE_REVALIDATE = os.getenv("AVATAR_STALE_WHILE_REVALIDATE", "1") != "0"
+# Seconds past the TTL an expired avatar may still be answered with
+AVATAR_MAX_STALE = float(os.getenv("AVATAR_MAX_STALE", 86400))
+
+logger = logging.getLogger(__name__)
+
+
+class Avatar(NamedTuple):
+    file_unique_id: str
+    file_path: str
+
+    def url(self, bot: Bot) -> str:
+        """Download link on the Bot API server the bot is configured with"""
+
+        return bot.session.api.file_url(bot.token, self.file_path)
+
+
+class _Entry(NamedTuple):
+    avatar: Optional[Avatar]
+    resolved_at: float
+
+
+class AvatarCache:
+    """Profile photos of Telegram users, resolved to a downloadable file.
+
+    Resolving takes `get_user_profile_photos` and `get_file`; the latter is
+    skipped when the photo's `file_unique_id` has not changed. Users
+    without a photo are cached too. Concurrent lookups of a user share one
+    refresh, and in stale-while-revalidate mode an expired avatar is
+    answered right away while it is refreshed in the background.
+    """
+
+    def __init__(
+        self,
+        ttl: float = AVATAR_CACHE_TTL,
+        max_size: int = AVATAR_CACHE_SIZE,
+        stale_while_revalidate: bool = AVATAR_STALE_WHILE_REVALIDATE,
+        max_stale: float = AVATAR_MAX_STALE,
+    ):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.stale_while_revalidate = stale_while_revalidate
+        self.max_stale = max_stale
+        self._entries: OrderedDict[int, _Entry] = OrderedDict()
+        self._refreshes: dict[int, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get(self, bot: Bot, user_id: int) -> Optional[Avatar]:
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            self._entries.move_to_end(user_id)
+            age = time.monotonic() - entry.resolved_at
+            if age < self.ttl:
+                return entry.avatar
+            if self.stale_while_revalidate and age < self.ttl + self.max_stale:
+                self._refresh(bot, user_id)
+                return entry.avatar
+
+        return await asyncio.shield(self._refresh(bot, user_id))
+
+    def invalidate(self, user_id: int):
+        self._entries.pop(user_id, None)
+
+    def _refresh(self, bot: Bot, user_id: int) -> asyncio.Task:
+        task = self._refreshes.get(user_id)
+        if task is None:
+            task = asyncio.ensure_future(self._resolve(bot, user_id))
+            self._refreshes[user_id] = task
+            task.add_done_callback(lambda done: self._refreshed(user_id, done))
+        return task
+
+    def _refreshed(self, user_id: int, task: asyncio.Task):
+        if self._refreshes.get(user_id) is task:
+            del self._refreshes[user_id]
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Avatar refresh of %s failed: %r", user_id, task.exception())
+
+    async def _resolve(self, bot: Bot, user_id: int) -> Optional[Avatar]:
+        photos = await bot.get_user_profile_photos(user_id, limit=1)
+
+        avatar = None
+        if photos.total_count > 0:
+            photo = photos.photos[0][0]
+            cached = self._entries.get(user_id)
+            if (
+                cached is not None
+                and cached.avatar is not None
+                and cached.avatar.file_unique_id == photo.file_unique_id
+            ):
+                avatar = cached.avatar
+            else:
+                file = await bot.get_file(photo.file_id)
+                avatar = Avatar(photo.file_unique_id, file.file_path)
+
+        self._entries[user_id] = _Entry(avatar, time.monotonic())
+        self._entries.move_to_end(user_id)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+        return avatar
+
+
+avatar_cache = AvatarCache()
@@ -0,0 +1,339 @@
+import argparse
+import asyncio
+import logging
+import os
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramNotFound,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+from sqlalchemy import and_, false, or_, select, true, update
+
+from api_client import use_api_modules
+from telegram_bot import create_bot
+
+use_api_modules()
+
+from gamebot import GAMEBOT_GRACE_MINUTES  # noqa: E402
+from models import AsyncSessionLocal, Broadcast, ShiftUser, async_engine  # noqa: E402
+from rollover import utc_today  # noqa: E402
+from tiers import get_tiers, load_tiers  # noqa: E402
+
+# Messages per second to all chats together; Telegram allows about 30
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", 25))
+# Seconds between two messages to the same chat
+BROADCAST_CHAT_INTERVAL = float(os.getenv("BROADCAST_CHAT_INTERVAL", 1))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", 30))
+# Recipients read and checkpointed at a time
+BROADCAST_BATCH_SIZE = int(os.getenv("BROADCAST_BATCH_SIZE", 1000))
+# Attempts per message after network or server errors
+BROADCAST_RETRIES = int(os.getenv("BROADCAST_RETRIES", 3))
+# Seconds without a checkpoint after which a running broadcast is taken
+# to be dead, and may be resumed by another process
+BROADCAST_LEASE = float(os.getenv("BROADCAST_LEASE", 600))
+
+SENT = "sent"
+BLOCKED = "blocked"
+FAILED = "failed"
+
+logger = logging.getLogger(__name__)
+
+
+def _utc_midnight() -> int:
+    midnight = datetime.combine(utc_today(), datetime.min.time(), timezone.utc)
+    return int(midnight.timestamp())
+
+
+def _gamebot_full():
+    # The cycle is over and its minutes have not all been paid out yet
+    now = int(time.time())
+    return or_(
+        false(),
+        *(
+            and_(
+                ShiftUser.current_level == tier.level,
+                ShiftUser.gamebot_started_at
+                <= now - (tier.gamebot * 60 + GAMEBOT_GRACE_MINUTES) * 60,
+                ShiftUser.gamebot_worked_minutes < tier.gamebot * 60,
+            )
+            for tier in get_tiers()
+            if tier.gamebot and tier.level != 1
+        ),
+    )
+
+
+# Who gets a broadcast, as a filter on `users`
+SEGMENTS: dict[str, Callable] = {
+    "all": true,
+    "daily_reward": lambda: ShiftUser.auth_date < _utc_midnight(),
+    "gamebot_full": _gamebot_full,
+}
+
+
+class SendRateLimiter:
+    """Paces messages to a global rate and a minimum interval per chat.
+
+    Every send reserves the next free slot, so concurrent senders are
+    spread out instead of bursting. A `pause` (Telegram's retry_after)
+    pushes back every send, including those already waiting.
+    """
+
+    def __init__(
+        self,
+        rate: float = BROADCAST_RATE,
+        chat_interval: float = BROADCAST_CHAT_INTERVAL,
+        max_chats: int = 100_000,
+    ):
+        self.interval = 1 / rate
+        self.chat_interval = chat_interval
+        self.max_chats = max_chats
+        self._next_slot = 0.0
+        self._paused_until = 0.0
+        self._chat_ready: OrderedDict[str, float] = OrderedDict()
+
+    async def wait(self, chat_id: str):
+        while True:
+            now = time.monotonic()
+            slot = max(
+                now,
+                self._next_slot,
+                self._paused_until,
+                self._chat_ready.get(chat_id, 0.0),
+            )
+            self._next_slot = slot + self.interval
+            self._chat_ready[chat_id] = slot + self.chat_interval
+            self._chat_ready.move_to_end(chat_id)
+            if len(self._chat_ready) > self.max_chats:
+                self._chat_ready.popitem(last=False)
+
+            await asyncio.sleep(slot - now)
+            if self._paused_until <= time.monotonic():
+                return
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class Broadcaster:
+    """Sends broadcasts through a bounded queue of concurrent senders.
+
+    Recipients are read in keyset batches of `batch_size` in `users.id`
+    order. Progress is checkpointed after every batch, so a broadcast
+    resumes after the last finished batch; messages of a batch cut off
+    midway are sent again.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        limiter: Optional[SendRateLimiter] = None,
+        concurrency: int = BROADCAST_CONCURRENCY,
+        batch_size: int = BROADCAST_BATCH_SIZE,
+    ):
+        self.bot = bot
+        self.limiter = limiter or SendRateLimiter()
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+
+    async def create(self, segment: str, text: str) -> Broadcast:
+        if segment not in SEGMENTS:
+            raise ValueError(f"Unknown segment {segment!r}")
+
+        async with AsyncSessionLocal() as db:
+            broadcast = Broadcast(segment=segment, text=text)
+            db.add(broadcast)
+            await db.commit()
+        return broadcast
+
+    async def run(self, broadcast_id) -> Broadcast:
+        """Send the broadcast, or resume it where it stopped.
+
+        The broadcast is claimed by setting it running in one UPDATE, so
+        two processes never send it at the same time. One that is running
+        elsewhere is refused, unless it has not checkpointed for
+        `BROADCAST_LEASE` seconds.
+        """
+
+        now = datetime.utcnow()
+        expired = now - timedelta(seconds=BROADCAST_LEASE)
+        async with AsyncSessionLocal() as db:
+            broadcast = await db.scalar(
+                update(Broadcast)
+                .where(
+                    Broadcast.id == broadcast_id,
+                    Broadcast.status != "done",
+                    or_(Broadcast.status != "running", Broadcast.updated_at < expired),
+                )
+                .values(status="running", updated_at=now)
+                .returning(Broadcast)
+            )
+            await db.commit()
+
+            if broadcast is None:
+                broadcast = await db.get(Broadcast, broadcast_id)
+                if broadcast is None:
+                    raise ValueError(f"Broadcast {broadcast_id} not found")
+                if broadcast.status == "done":
+                    return broadcast
+                raise RuntimeError(f"Broadcast {broadcast_id} is already running")
+
+            await load_tiers(db)
+
+        queue = asyncio.Queue(self.concurrency * 2)
+        senders = [
+            asyncio.create_task(self._sender(queue, broadcast.text))
+            for _ in range(self.concurrency)
+        ]
+        try:
+            await self._run_batches(broadcast, queue)
+        finally:
+            for sender in senders:
+                sender.cancel()
+            await asyncio.gather(*senders, return_exceptions=True)
+
+        return broadcast
+
+    async def _run_batches(self, broadcast: Broadcast, queue: asyncio.Queue):
+        started_at = time.monotonic()
+        sent_before = broadcast.sent
+
+        while True:
+            query = (
+                select(ShiftUser.id, ShiftUser.tg_id)
+                .where(SEGMENTS[broadcast.segment]())
+                .order_by(ShiftUser.id)
+                .limit(self.batch_size)
+            )
+            if broadcast.last_user_id is not None:
+                query = query.where(ShiftUser.id > broadcast.last_user_id)
+
+            async with AsyncSessionLocal() as db:
+                recipients = (await db.execute(query)).all()
+
+            outcomes = Counter()
+            for _, tg_id in recipients:
+                await queue.put((tg_id, outcomes))
+            await queue.join()
+
+            done = len(recipients) < self.batch_size
+            values = {
+                "sent": Broadcast.sent + outcomes[SENT],
+                "blocked": Broadcast.blocked + outcomes[BLOCKED],
+                "failed": Broadcast.failed + outcomes[FAILED],
+                "updated_at": datetime.utcnow(),
+            }
+            if recipients:
+                values["last_user_id"] = recipients[-1].id
+            if done:
+                values["status"] = "done"
+                values["finished_at"] = values["updated_at"]
+
+            async with AsyncSessionLocal() as db:
+                row = (
+                    await db.execute(
+                        update(Broadcast)
+                        .where(Broadcast.id == broadcast.id)
+                        .values(**values)
+                        .returning(
+                            Broadcast.sent,
+                            Broadcast.blocked,
+                            Broadcast.failed,
+                            Broadcast.last_user_id,
+                            Broadcast.status,
+                        )
+                    )
+                ).one()
+                await db.commit()
+            (
+                broadcast.sent,
+                broadcast.blocked,
+                broadcast.failed,
+                broadcast.last_user_id,
+                broadcast.status,
+            ) = row
+
+            elapsed = time.monotonic() - started_at
+            logger.info(
+                "Broadcast %s: %d sent, %d blocked, %d failed (%.1f/s)",
+                broadcast.id,
+                broadcast.sent,
+                broadcast.blocked,
+                broadcast.failed,
+                (broadcast.sent - sent_before) / elapsed if elapsed else 0.0,
+            )
+            if done:
+                return
+
+    async def _sender(self, queue: asyncio.Queue, text: str):
+        while True:
+            chat_id, outcomes = await queue.get()
+            try:
+                outcomes[await self._send(chat_id, text)] += 1
+            except Exception:
+                logger.exception("Broadcast message to %s failed", chat_id)
+                outcomes[FAILED] += 1
+            finally:
+                queue.task_done()
+
+    async def _send(self, chat_id: str, text: str) -> str:
+        attempt = 0
+        while True:
+            await self.limiter.wait(chat_id)
+            try:
+                await self.bot.send_message(chat_id, text)
+                return SENT
+            except TelegramRetryAfter as e:
+                # Flood control applies to the whole bot, so every sender
+                # waits; this does not count as an attempt
+                self.limiter.pause(e.retry_after)
+            except TelegramForbiddenError:
+                return BLOCKED
+            except (TelegramBadRequest, TelegramNotFound):
+                return FAILED
+            except (TelegramNetworkError, TelegramServerError):
+                attempt += 1
+                if attempt > BROADCAST_RETRIES:
+                    return FAILED
+                await asyncio.sleep(2**attempt)
+
+
+async def _main(args: argparse.Namespace):
+    bot = create_bot()
+    broadcaster = Broadcaster(bot)
+    try:
+        if args.command == "send":
+            broadcast = await broadcaster.create(args.segment, args.text)
+            print(broadcast.id)
+            broadcast_id = broadcast.id
+        else:
+            broadcast_id = args.broadcast_id
+
+        broadcast = await broadcaster.run(broadcast_id)
+        print(broadcast.status, broadcast.sent, broadcast.blocked, broadcast.failed)
+    finally:
+        await bot.session.close()
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    # python broadcast.py send SEGMENT TEXT
+    # python broadcast.py resume BROADCAST_ID
+    parser = argparse.ArgumentParser(description="Send a notification to users")
+    commands = parser.add_subparsers(dest="command", required=True)
+    send = commands.add_parser("send")
+    send.add_argument("segment", choices=sorted(SEGMENTS))
+    send.add_argument("text")
+    resume = commands.add_parser("resume")
+    resume.add_argument("broadcast_id")
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main(parser.parse_args()))
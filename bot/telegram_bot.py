@@ -4,10 +4,11 @@ import logging
 import os
 import sys
 from datetime import datetime
-import httpx
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
 from aiogram.filters import Command, CommandStart
 from aiogram.types import (
@@ -15,15 +16,23 @@ from aiogram.types import (
     InlineKeyboardMarkup,
     InlineKeyboardButton,
     WebAppInfo,
-    UserProfilePhotos,
 )
 from dotenv import load_dotenv
 
+from api_client import ApiError, api_client
+from avatars import avatar_cache
+from webhook import run_webhook
+
 load_dotenv()
 TOKEN = os.getenv("BOT_TOKEN")
-API_URL = "http://localhost:8000"
+# "polling" or "webhook", see webhook.py
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Bot API server to use instead of api.telegram.org, e.g. a local one
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
 
 dp = Dispatcher()
+dp.startup.register(api_client.start)
+dp.shutdown.register(api_client.close)
 
 user_data = {}
 
@@ -70,39 +79,41 @@ async def handle_save_or_get_user_data(message: Message) -> None:
         "auth_date": auth_date,
     }
 
-    bot = message.bot
-    user_photos: UserProfilePhotos = await bot.get_user_profile_photos(
-        message.from_user.id
+    avatar = await avatar_cache.get(message.bot, message.from_user.id)
+    if avatar is not None:
+        user_info["tg_image"] = avatar.url(message.bot)
+
+    try:
+        user_data = await api_client.login(user_info)
+        user_json = json.dumps(user_data, indent=2)
+        await message.answer(f"<pre>{user_json}</pre>", parse_mode=ParseMode.HTML)
+    except ApiError as e:
+        await message.answer(
+            f"Failed to save or get user data. Status code: {e.status_code}."
+            f"Response text: {e.text}"
+        )
+    except Exception as e:
+        logging.error(f"Error sending user data to server: {e}", exc_info=True)
+        await message.answer("An error occurred while saving or getting user data.")
+
+
+def create_bot() -> Bot:
+    session = None
+    if TELEGRAM_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+    return Bot(
+        token=TOKEN,
+        session=session,
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
     )
 
-    if user_photos.total_count > 0:
-        photo_file_id = user_photos.photos[0][0].file_id
-        photo_info = await bot.get_file(photo_file_id)
-        avatar_url = f"https://api.telegram.org/file/bot{TOKEN}/{photo_info.file_path}"
-        user_info["tg_image"] = avatar_url
-
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.put(f"{API_URL}/users", json=user_info)
-            if response.status_code == 200:
-                user_data = response.json()
-                user_json = json.dumps(user_data, indent=2)
-                await message.answer(
-                    f"<pre>{user_json}</pre>", parse_mode=ParseMode.HTML
-                )
-            else:
-                await message.answer(
-                    f"Failed to save or get user data. Status code: {response.status_code}."
-                    f"Response text: {response.text}"
-                )
-        except Exception as e:
-            logging.error(f"Error sending user data to server: {e}", exc_info=True)
-            await message.answer("An error occurred while saving or getting user data.")
-
 
 async def main() -> None:
-    bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    await dp.start_polling(bot)
+    bot = create_bot()
+    if BOT_MODE == "webhook":
+        await run_webhook(dp, bot)
+    else:
+        await dp.start_polling(bot)
 
 
 if __name__ == "__main__":
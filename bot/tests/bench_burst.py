@@ -0,0 +1,114 @@
+"""Replay a burst of /users commands against a local stub API.
+
+Compares a new httpx client per command, as the bot did before, with the
+shared ApiClient. Run from bot/:
+
+    python -m tests.bench_burst [--commands 200] [--delay-ms 5] [--flaky 0.1]
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import statistics
+import time
+
+import httpx
+from aiohttp import web
+
+from api_client import ApiClient
+
+
+class StubApi:
+    """PUT /users answering after `delay`, with a 503 for a `flaky` share"""
+
+    def __init__(self, delay: float, flaky: float):
+        self.delay = delay
+        self.flaky = flaky
+        self.requests = 0
+        self.connections = set()
+
+    async def put_user(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        self.connections.add(request.transport.get_extra_info("peername"))
+        body = await request.json()
+        await asyncio.sleep(self.delay)
+        if random.random() < self.flaky:
+            return web.json_response({"detail": "unavailable"}, status=503)
+        return web.json_response({"id": body["tg_id"], "score": 0})
+
+
+def user_info(tg_id: int) -> dict:
+    return {
+        "tg_id": str(tg_id),
+        "first_name": "First",
+        "last_name": "Last",
+        "username": "user",
+        "is_premium": False,
+        "tg_image": None,
+        "auth_date": int(time.time()),
+    }
+
+
+async def replay(label: str, stub: StubApi, command, commands: int):
+    stub.requests = 0
+    stub.connections.clear()
+    latencies = []
+    failures = 0
+
+    async def timed(tg_id: int):
+        nonlocal failures
+        started_at = time.perf_counter()
+        try:
+            await command(user_info(tg_id))
+        except Exception:
+            failures += 1
+        latencies.append(time.perf_counter() - started_at)
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(timed(tg_id) for tg_id in range(commands)))
+    elapsed = time.perf_counter() - started_at
+
+    latencies.sort()
+    print(
+        f"{label:<22} {elapsed:6.2f}s {commands / elapsed:8.0f} cmd/s "
+        f"p50 {statistics.median(latencies) * 1000:7.1f}ms "
+        f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:7.1f}ms "
+        f"requests {stub.requests:5d} connections {len(stub.connections):4d} "
+        f"failed {failures}"
+    )
+
+
+async def main(args: argparse.Namespace):
+    stub = StubApi(args.delay_ms / 1000, args.flaky)
+    app = web.Application()
+    app.router.add_put("/users", stub.put_user)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    base_url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+    async def client_per_command(info: dict):
+        async with httpx.AsyncClient() as client:
+            response = await client.put(f"{base_url}/users", json=info)
+            response.raise_for_status()
+
+    shared = ApiClient(base_url)
+    await shared.start()
+    try:
+        await replay("client per command", stub, client_per_command, args.commands)
+        await replay("shared ApiClient", stub, shared.login, args.commands)
+    finally:
+        await shared.close()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--commands", type=int, default=200)
+    parser.add_argument("--delay-ms", type=float, default=5)
+    parser.add_argument("--flaky", type=float, default=0.0)
+    # Retries are counted in `requests`, not logged one by one
+    logging.getLogger("api_client").setLevel(logging.ERROR)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,123 @@
+"""Latency of a login over HTTP and in process, against the same database.
+
+Starts the API with uvicorn in a subprocess and logs one user in
+`--logins` times through ApiClient, then through LocalApiClient. Run
+from bot/ with a database that may be written to:
+
+    TEST_DATABASE_URL=postgresql://... python -m tests.bench_local_api
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import statistics
+import sys
+import time
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+if not TEST_DATABASE_URL:
+    sys.exit("TEST_DATABASE_URL is not set")
+os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+
+import httpx  # noqa: E402
+
+from api_client import API_DIR, ApiClient, LocalApiClient, use_api_modules  # noqa: E402
+
+USER_INFO = {
+    "tg_id": "bench-local-api",
+    "first_name": "First",
+    "last_name": "Last",
+    "username": "user",
+    "is_premium": False,
+    "tg_image": None,
+    "auth_date": int(time.time()),
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def run_api(port: int) -> asyncio.subprocess.Process:
+    process = await asyncio.create_subprocess_exec(
+        sys.executable,
+        "-m",
+        "uvicorn",
+        "main:app",
+        "--port",
+        str(port),
+        "--log-level",
+        "warning",
+        cwd=API_DIR,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    async with httpx.AsyncClient() as client:
+        for _ in range(100):
+            try:
+                await client.get(f"http://127.0.0.1:{port}/docs")
+                return process
+            except httpx.ConnectError:
+                await asyncio.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("The API did not start")
+
+
+async def measure(label: str, client, logins: int) -> dict:
+    await client.login(USER_INFO)
+
+    latencies = []
+    for _ in range(logins):
+        started_at = time.perf_counter()
+        answer = await client.login(USER_INFO)
+        latencies.append((time.perf_counter() - started_at) * 1000)
+
+    latencies.sort()
+    print(
+        f"{label:<6} p50 {statistics.median(latencies):6.2f}ms "
+        f"p95 {latencies[int(len(latencies) * 0.95) - 1]:6.2f}ms "
+        f"mean {statistics.mean(latencies):6.2f}ms"
+    )
+    return answer
+
+
+async def main(args: argparse.Namespace):
+    use_api_modules()
+    import models
+
+    models.init_db()
+    models.engine.dispose()
+
+    port = free_port()
+    api = await run_api(port)
+    http = ApiClient(f"http://127.0.0.1:{port}")
+    await http.start()
+    try:
+        over_http = await measure("http", http, args.logins)
+    finally:
+        await http.close()
+        api.terminate()
+        await api.wait()
+
+    local = LocalApiClient()
+    await local.start()
+    try:
+        in_process = await measure("local", local, args.logins)
+    finally:
+        await local.close()
+
+    differences = sorted(
+        key for key in over_http if over_http[key] != in_process.get(key)
+    )
+    print("differing fields:", ", ".join(differences) or "none")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=300)
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,88 @@
+import asyncio
+import os
+from collections import Counter
+
+import pytest
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import web
+
+# The API's models are only imported against the database named in
+# TEST_DATABASE_URL, never the one from .env
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+os.environ["DATABASE_URL"] = TEST_DATABASE_URL or "postgresql://localhost/unused"
+
+TOKEN = "123456:TEST"
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+class TelegramStub:
+    """Bot API server answering from canned results, counting the calls.
+
+    `results` maps a method to its result, or to a function of the call's
+    parameters returning it. While `gate` is cleared, calls wait for it.
+    """
+
+    def __init__(self):
+        self.results: dict = {}
+        self.calls = Counter()
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        await self.gate.wait()
+
+        params = dict(await request.post())
+        result = self.results[method]
+        if callable(result):
+            result = result(params)
+        if isinstance(result, web.Response):
+            return result
+        return web.json_response({"ok": True, "result": result})
+
+
+@pytest.fixture
+async def telegram():
+    stub = TelegramStub()
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", stub.handle)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    stub.bot = Bot(
+        TOKEN,
+        session=AiohttpSession(
+            api=TelegramAPIServer.from_base(f"http://127.0.0.1:{port}")
+        ),
+    )
+    yield stub
+
+    await stub.bot.session.close()
+    await runner.cleanup()
+
+
+@pytest.fixture(scope="session")
+def database():
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL is not set")
+
+    from api_client import use_api_modules
+
+    use_api_modules()
+    import models
+
+    models.Base.metadata.drop_all(models.engine)
+    models.init_db()
+    yield models
+    models.engine.dispose()
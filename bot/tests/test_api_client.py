@@ -0,0 +1,103 @@
+import httpx
+import pytest
+
+from api_client import ApiClient, ApiError
+
+pytestmark = pytest.mark.anyio
+
+
+class Api:
+    """Transport answering with `responses` in turn, the last one repeating.
+
+    Exceptions among them are raised, like a failed connection.
+    """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        response = (
+            self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+        )
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def ok(**body) -> httpx.Response:
+    return httpx.Response(200, json=body)
+
+
+@pytest.fixture
+async def client_for():
+    clients = []
+
+    async def client_for(api: Api, retries: int = 3) -> ApiClient:
+        client = ApiClient(
+            "http://api", retries=retries, backoff=0, transport=httpx.MockTransport(api)
+        )
+        await client.start()
+        clients.append(client)
+        return client
+
+    yield client_for
+
+    for client in clients:
+        await client.close()
+
+
+async def test_one_client_for_all_requests(client_for):
+    api = Api(ok(id="1"))
+    client = await client_for(api)
+    http_client = client._client
+
+    await client.start()
+    for _ in range(3):
+        assert await client.login({"tg_id": "1"}) == {"id": "1"}
+
+    assert client._client is http_client
+    assert len(api.requests) == 3
+
+
+async def test_connect_errors_are_retried(client_for):
+    api = Api(httpx.ConnectError("refused"), httpx.ConnectTimeout("slow"), ok(id="1"))
+    client = await client_for(api)
+
+    assert await client.login({"tg_id": "1"}) == {"id": "1"}
+    assert len(api.requests) == 3
+
+
+async def test_server_errors_are_retried(client_for):
+    api = Api(httpx.Response(502), httpx.Response(503), ok(id="1"))
+    client = await client_for(api)
+
+    assert await client.login({"tg_id": "1"}) == {"id": "1"}
+    assert len(api.requests) == 3
+
+
+async def test_retries_run_out(client_for):
+    api = Api(httpx.Response(503))
+    client = await client_for(api, retries=2)
+    with pytest.raises(ApiError) as e:
+        await client.login({"tg_id": "1"})
+    assert e.value.status_code == 503
+    assert len(api.requests) == 3
+
+    api = Api(httpx.ConnectError("refused"))
+    client = await client_for(api, retries=2)
+    with pytest.raises(httpx.ConnectError):
+        await client.login({"tg_id": "1"})
+    assert len(api.requests) == 3
+
+
+async def test_client_errors_are_not_retried(client_for):
+    api = Api(httpx.Response(422, text="invalid"))
+    client = await client_for(api)
+
+    with pytest.raises(ApiError) as e:
+        await client.login({"tg_id": "1"})
+
+    assert (e.value.status_code, e.value.text) == (422, "invalid")
+    assert len(api.requests) == 1
@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+from avatars import Avatar, AvatarCache
+
+pytestmark = pytest.mark.anyio
+
+USER_ID = 42
+
+
+@pytest.fixture
+def photo(telegram):
+    """The user's current photo; change `unique_id` to replace it"""
+
+    photo = {"unique_id": "photo1"}
+    telegram.results["getUserProfilePhotos"] = lambda params: {
+        "total_count": 1,
+        "photos": [
+            [
+                {
+                    "file_id": photo["unique_id"] + "-file",
+                    "file_unique_id": photo["unique_id"],
+                    "width": 160,
+                    "height": 160,
+                }
+            ]
+        ],
+    }
+    telegram.results["getFile"] = lambda params: {
+        "file_id": params["file_id"],
+        "file_unique_id": params["file_id"].removesuffix("-file"),
+        "file_path": f"photos/{params['file_id']}.jpg",
+    }
+    return photo
+
+
+async def test_cache_hit(telegram, photo):
+    cache = AvatarCache(ttl=60)
+
+    first = await cache.get(telegram.bot, USER_ID)
+    second = await cache.get(telegram.bot, USER_ID)
+
+    assert first == second == Avatar("photo1", "photos/photo1-file.jpg")
+    assert telegram.calls == {"getUserProfilePhotos": 1, "getFile": 1}
+
+
+async def test_stale_avatar_is_answered_while_refreshing(telegram, photo):
+    cache = AvatarCache(ttl=0, stale_while_revalidate=True, max_stale=60)
+    await cache.get(telegram.bot, USER_ID)
+
+    # Same photo: the refresh skips getFile
+    assert (await cache.get(telegram.bot, USER_ID)).file_unique_id == "photo1"
+    await asyncio.gather(*cache._refreshes.values())
+    assert telegram.calls == {"getUserProfilePhotos": 2, "getFile": 1}
+
+    # New photo: the stale one is answered, the next lookup gets the new one
+    photo["unique_id"] = "photo2"
+    assert (await cache.get(telegram.bot, USER_ID)).file_unique_id == "photo1"
+    await asyncio.gather(*cache._refreshes.values())
+    assert (await cache.get(telegram.bot, USER_ID)).file_unique_id == "photo2"
+    assert telegram.calls["getFile"] == 2
+
+
+async def test_concurrent_lookups_share_one_refresh(telegram, photo):
+    cache = AvatarCache(ttl=60)
+    telegram.gate.clear()
+
+    lookups = [asyncio.create_task(cache.get(telegram.bot, USER_ID)) for _ in range(10)]
+    await asyncio.sleep(0.05)
+    telegram.gate.set()
+    avatars = await asyncio.gather(*lookups)
+
+    assert set(avatars) == {Avatar("photo1", "photos/photo1-file.jpg")}
+    assert telegram.calls == {"getUserProfilePhotos": 1, "getFile": 1}
+
+
+async def test_url_uses_configured_server(telegram, photo):
+    avatar = await AvatarCache().get(telegram.bot, USER_ID)
+
+    assert avatar.url(telegram.bot) == telegram.bot.session.api.file_url(
+        telegram.bot.token, "photos/photo1-file.jpg"
+    )
+    assert "api.telegram.org" not in avatar.url(telegram.bot)
@@ -0,0 +1,106 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from aiohttp import web
+from sqlalchemy import delete, update
+
+pytestmark = pytest.mark.anyio
+
+BLOCKED_CHAT = "3"
+
+
+@pytest.fixture
+async def users(database, telegram):
+    models = database
+    with models.SessionLocal() as db:
+        for tg_id in "12345":
+            db.add(
+                models.ShiftUser(
+                    tg_id=tg_id,
+                    first_name="First",
+                    last_name="Last",
+                    register_date=datetime.utcnow(),
+                )
+            )
+        db.commit()
+
+    def send_message(params):
+        if params["chat_id"] == BLOCKED_CHAT:
+            return web.json_response(
+                {
+                    "ok": False,
+                    "error_code": 403,
+                    "description": "Forbidden: bot was blocked by the user",
+                },
+                status=403,
+            )
+        return {
+            "message_id": 1,
+            "date": 0,
+            "chat": {"id": int(params["chat_id"]), "type": "private"},
+            "text": params["text"],
+        }
+
+    telegram.results["sendMessage"] = send_message
+    yield models
+
+    await models.async_engine.dispose()
+    with models.SessionLocal() as db:
+        db.execute(delete(models.Broadcast))
+        db.execute(delete(models.ShiftUser))
+        db.commit()
+
+
+@pytest.fixture
+def broadcaster(users, telegram):
+    from broadcast import Broadcaster, SendRateLimiter
+
+    return Broadcaster(
+        telegram.bot,
+        limiter=SendRateLimiter(rate=1000, chat_interval=0),
+        batch_size=2,
+    )
+
+
+async def test_broadcast_reaches_every_user(broadcaster, telegram):
+    broadcast = await broadcaster.create("all", "hello")
+
+    broadcast = await broadcaster.run(broadcast.id)
+
+    assert broadcast.status == "done"
+    assert (broadcast.sent, broadcast.blocked, broadcast.failed) == (4, 1, 0)
+    assert telegram.calls["sendMessage"] == 5
+
+    # Running a finished broadcast again sends nothing
+    await broadcaster.run(broadcast.id)
+    assert telegram.calls["sendMessage"] == 5
+
+
+async def test_running_broadcast_is_not_claimed_twice(broadcaster, telegram):
+    broadcast = await broadcaster.create("all", "hello")
+    telegram.gate.clear()
+
+    first = asyncio.create_task(broadcaster.run(broadcast.id))
+    while not telegram.calls["sendMessage"]:
+        await asyncio.sleep(0.01)
+    with pytest.raises(RuntimeError):
+        await asyncio.wait_for(broadcaster.run(broadcast.id), 5)
+
+    telegram.gate.set()
+    assert (await first).status == "done"
+    assert telegram.calls["sendMessage"] == 5
+
+
+async def test_expired_run_is_resumed(broadcaster, telegram, users):
+    broadcast = await broadcaster.create("all", "hello")
+    with users.SessionLocal() as db:
+        db.execute(
+            update(users.Broadcast).values(
+                status="running", updated_at=datetime.utcnow() - timedelta(days=1)
+            )
+        )
+        db.commit()
+
+    assert (await broadcaster.run(broadcast.id)).status == "done"
+    assert telegram.calls["sendMessage"] == 5
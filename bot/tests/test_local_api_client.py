@@ -0,0 +1,98 @@
+import time
+from datetime import datetime
+
+import httpx
+import pytest
+from sqlalchemy import update
+
+from api_client import ApiClient, ApiError, LocalApiClient
+
+pytestmark = pytest.mark.anyio
+
+AUTH_DATE = int(time.time())
+
+
+def user_info(tg_id: str) -> dict:
+    return {
+        "tg_id": tg_id,
+        "first_name": "Ёлка",
+        "last_name": "Last",
+        "username": None,
+        "is_premium": False,
+        "tg_image": None,
+        "auth_date": AUTH_DATE,
+    }
+
+
+@pytest.fixture
+async def models(database):
+    models = database
+    yield models
+
+    await models.async_engine.dispose()
+    with models.SessionLocal() as db:
+        for table in reversed(models.Base.metadata.sorted_tables):
+            if table.name != "user_statuses":
+                db.execute(table.delete())
+        db.commit()
+
+
+async def http_logins(users) -> list[dict]:
+    import main
+
+    async with main.lifespan(main.app):
+        client = ApiClient(
+            "http://test", transport=httpx.ASGITransport(app=main.app), backoff=0
+        )
+        await client.start()
+        try:
+            return [await client.login(user) for user in users]
+        finally:
+            await client.close()
+
+
+async def local_logins(users) -> list[dict]:
+    client = LocalApiClient()
+    await client.start()
+    try:
+        return [await client.login(user) for user in users]
+    finally:
+        await client.close()
+
+
+async def test_local_client_answers_like_http(models, monkeypatch):
+    tg_ids = ["1", "2", "3"]
+    await http_logins(map(user_info, tg_ids))
+    with models.SessionLocal() as db:
+        for tg_id, score in zip(tg_ids, (10, 30, 10)):
+            db.execute(
+                update(models.ShiftUser)
+                .where(models.ShiftUser.tg_id == tg_id)
+                .values(score=score, register_date=datetime(2026, 1, 1))
+            )
+        db.commit()
+    await models.async_engine.dispose()
+
+    over_http = await http_logins(map(user_info, tg_ids))
+    await models.async_engine.dispose()
+    # The bot does not load the board, its ranks are counted in the database
+    from leaderboard import leaderboard
+
+    monkeypatch.setattr(leaderboard, "loaded", False)
+    in_process = await local_logins(map(user_info, tg_ids))
+
+    assert in_process == over_http
+    ranks = [user["rank"] for user in in_process]
+    assert ranks[1] == 1 and sorted(ranks) == [1, 2, 3]
+
+
+async def test_both_clients_reject_invalid_user_info(models):
+    invalid = {**user_info("1"), "auth_date": "yesterday"}
+
+    with pytest.raises(ApiError) as over_http:
+        await http_logins([invalid])
+    await models.async_engine.dispose()
+    with pytest.raises(ApiError) as in_process:
+        await local_logins([invalid])
+
+    assert over_http.value.status_code == in_process.value.status_code == 422
@@ -0,0 +1,69 @@
+import pytest
+from aiogram import Dispatcher
+from aiohttp.test_utils import TestClient, TestServer
+
+from webhook import (
+    SECRET_HEADER,
+    WEBHOOK_PATH,
+    UpdateWorkers,
+    create_app,
+    create_metrics_app,
+)
+
+pytestmark = pytest.mark.anyio
+
+SECRET = "webhook-secret"
+
+UPDATE = {
+    "update_id": 1,
+    "message": {
+        "message_id": 1,
+        "date": 0,
+        "chat": {"id": 7, "type": "private"},
+        "from": {"id": 7, "is_bot": False, "first_name": "First"},
+        "text": "hello",
+    },
+}
+
+
+@pytest.fixture
+async def workers(telegram):
+    workers = UpdateWorkers(Dispatcher(), telegram.bot, workers=2)
+    workers.start()
+    yield workers
+    await workers.stop(timeout=1)
+
+
+async def serve(app):
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    return client
+
+
+async def test_public_app_takes_only_authenticated_updates(workers):
+    client = await serve(create_app(workers, secret=SECRET))
+    try:
+        response = await client.post(WEBHOOK_PATH, json=UPDATE)
+        assert response.status == 401
+
+        response = await client.post(
+            WEBHOOK_PATH, json=UPDATE, headers={SECRET_HEADER: SECRET}
+        )
+        assert response.status == 200
+
+        response = await client.get("/metrics")
+        assert response.status == 404
+    finally:
+        await client.close()
+
+    assert workers.stats.received == 1
+
+
+async def test_metrics_app_serves_worker_snapshot(workers):
+    client = await serve(create_metrics_app(workers))
+    try:
+        response = await client.get("/metrics")
+        assert response.status == 200
+        assert (await response.json())["workers"] == 2
+    finally:
+        await client.close()
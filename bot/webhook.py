@@ -0,0 +1,259 @@
+import asyncio
+import hmac
+import logging
+import os
+import ssl
+import time
+from pathlib import Path
+from typing import Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import FSInputFile, Update
+from aiohttp import web
+from dotenv import load_dotenv
+
+load_dotenv()
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8443))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Serve TLS with the certificates in ssl/, and upload the (self-signed)
+# certificate to Telegram when setting the webhook
+WEBHOOK_TLS = os.getenv("WEBHOOK_TLS", "0") != "0"
+WEBHOOK_UPLOAD_CERT = os.getenv("WEBHOOK_UPLOAD_CERT", "0") != "0"
+# Concurrent connections Telegram opens to deliver updates (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 100))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 32))
+# Updates a worker holds before deliveries wait for it
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 100))
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", 10))
+# Worker metrics are served on their own listener, kept off the public
+# address; port 0 turns them off
+WEBHOOK_METRICS_HOST = os.getenv("WEBHOOK_METRICS_HOST", "127.0.0.1")
+WEBHOOK_METRICS_PORT = int(os.getenv("WEBHOOK_METRICS_PORT", 9100))
+
+SSL_DIR = Path(__file__).resolve().parent.parent / "ssl"
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+logger = logging.getLogger(__name__)
+
+
+def chat_key(update: Update) -> int:
+    """The chat an update belongs to, or the user when it has no chat"""
+
+    event = update.event
+    chat = getattr(event, "chat", None) or getattr(
+        getattr(event, "message", None), "chat", None
+    )
+    if chat is not None:
+        return chat.id
+
+    user = getattr(event, "from_user", None) or getattr(event, "user", None)
+    if user is not None:
+        return user.id
+
+    return update.update_id
+
+
+class UpdateStats:
+    """Counters of the update workers, for spotting a backlog"""
+
+    __slots__ = (
+        "received",
+        "processed",
+        "failed",
+        "wait_total",
+        "wait_max",
+        "handler_total",
+        "handler_max",
+    )
+
+    def __init__(self):
+        self.received = 0
+        self.processed = 0
+        self.failed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.handler_total = 0.0
+        self.handler_max = 0.0
+
+    def record(self, wait: float, handler: float, failed: bool):
+        self.processed += 1
+        self.failed += failed
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        self.handler_total += handler
+        self.handler_max = max(self.handler_max, handler)
+
+
+class UpdateWorkers:
+    """Bounded pool processing updates concurrently, in order per chat.
+
+    Every chat is pinned to one of `workers` queues, so a user's updates
+    are handled one after another while different chats run in parallel.
+    When a queue is full, the delivery waits for room, which holds the
+    webhook request open and makes Telegram slow down instead of the bot
+    buffering without bound.
+    """
+
+    def __init__(
+        self,
+        dp: Dispatcher,
+        bot: Bot,
+        workers: int = WEBHOOK_WORKERS,
+        queue_size: int = WEBHOOK_QUEUE_SIZE,
+    ):
+        self.dp = dp
+        self.bot = bot
+        self.queues = [asyncio.Queue(queue_size) for _ in range(workers)]
+        self.stats = UpdateStats()
+        self._tasks: list[asyncio.Task] = []
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._work(queue)) for queue in self.queues]
+
+    async def stop(self, timeout: float = WEBHOOK_DRAIN_TIMEOUT):
+        """Finish the queued updates, for at most `timeout` seconds"""
+
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(queue.join() for queue in self.queues)), timeout
+            )
+        except asyncio.TimeoutError:
+            logger.warning("%d updates dropped on shutdown", self.depth())
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, update: Update):
+        self.stats.received += 1
+        queue = self.queues[chat_key(update) % len(self.queues)]
+        await queue.put((time.monotonic(), update))
+
+    async def _work(self, queue: asyncio.Queue):
+        while True:
+            enqueued_at, update = await queue.get()
+            started_at = time.monotonic()
+            failed = False
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception:
+                failed = True
+                logger.exception("Update %s failed", update.update_id)
+            finally:
+                self.stats.record(
+                    started_at - enqueued_at, time.monotonic() - started_at, failed
+                )
+                queue.task_done()
+
+    def depth(self) -> int:
+        return sum(queue.qsize() for queue in self.queues)
+
+    def snapshot(self) -> dict:
+        stats = self.stats
+        processed = stats.processed or 1
+        return {
+            "workers": len(self.queues),
+            "queue_depth": self.depth(),
+            "queue_depth_max": max(queue.qsize() for queue in self.queues),
+            "queue_capacity": sum(queue.maxsize for queue in self.queues),
+            "received": stats.received,
+            "processed": stats.processed,
+            "failed": stats.failed,
+            "wait_avg_ms": stats.wait_total / processed * 1000,
+            "wait_max_ms": stats.wait_max * 1000,
+            "handler_avg_ms": stats.handler_total / processed * 1000,
+            "handler_max_ms": stats.handler_max * 1000,
+        }
+
+
+def create_app(workers: UpdateWorkers, secret: Optional[str] = WEBHOOK_SECRET):
+    """aiohttp app taking updates on `WEBHOOK_PATH`"""
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if secret and not hmac.compare_digest(
+            request.headers.get(SECRET_HEADER, ""), secret
+        ):
+            return web.Response(status=401)
+
+        update = Update.model_validate(
+            await request.json(), context={"bot": workers.bot}
+        )
+        await workers.submit(update)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    return app
+
+
+def create_metrics_app(workers: UpdateWorkers):
+    """aiohttp app serving the worker metrics on `/metrics`"""
+
+    async def metrics(request: web.Request) -> web.Response:
+        return web.json_response(workers.snapshot())
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    return app
+
+
+def ssl_context() -> ssl.SSLContext:
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(SSL_DIR / "cert.pem", SSL_DIR / "key.pem")
+    return context
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    """Serve the webhook until cancelled"""
+
+    if not WEBHOOK_URL:
+        raise RuntimeError("WEBHOOK_URL is not set")
+    if not WEBHOOK_SECRET:
+        logger.warning("WEBHOOK_SECRET is not set, updates are not authenticated")
+
+    workers = UpdateWorkers(dp, bot)
+    runner = web.AppRunner(create_app(workers), access_log=None)
+    await runner.setup()
+    metrics_runner = web.AppRunner(create_metrics_app(workers), access_log=None)
+    await metrics_runner.setup()
+
+    await dp.emit_startup(bot=bot)
+    workers.start()
+    try:
+        site = web.TCPSite(
+            runner,
+            WEBHOOK_HOST,
+            WEBHOOK_PORT,
+            ssl_context=ssl_context() if WEBHOOK_TLS else None,
+        )
+        await site.start()
+        if WEBHOOK_METRICS_PORT:
+            metrics_site = web.TCPSite(
+                metrics_runner, WEBHOOK_METRICS_HOST, WEBHOOK_METRICS_PORT
+            )
+            await metrics_site.start()
+
+        await bot.set_webhook(
+            WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            certificate=(
+                FSInputFile(SSL_DIR / "cert.pem") if WEBHOOK_UPLOAD_CERT else None
+            ),
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=dp.resolve_used_update_types(),
+            secret_token=WEBHOOK_SECRET,
+        )
+        logger.info("Webhook listening on %s:%d", WEBHOOK_HOST, WEBHOOK_PORT)
+
+        await asyncio.Event().wait()
+    finally:
+        # Stop taking deliveries before draining what is queued
+        await runner.cleanup()
+        await metrics_runner.cleanup()
+        await workers.stop()
+        await dp.emit_shutdown(bot=bot)